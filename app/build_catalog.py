@@ -0,0 +1,45 @@
+"""Prebuild the catalog artifact loaded at startup by load_catalog().
+
+Usage:
+    python app/build_catalog.py [--data data/attractions.csv] [--out artifacts/catalog.pkl] [--no-distance-matrix]
+
+Fits the text vectors and the clusters for every crowd filter (and, unless
+disabled, the distance matrix) once, e.g. while building the container image,
+so servers and workers start without fitting models or importing scikit-learn.
+The artifact records the CSV checksum; load_catalog() ignores it once the CSV changes.
+"""
+import argparse
+import os
+import sys
+import time
+
+from catalog import CATALOG_ARTIFACT, Catalog, file_checksum
+from data_loader import load_data
+
+
+def build(data_path, out_path, distance_matrix=True):
+    """Fit every derived structure for data_path and save it to out_path"""
+    catalog = Catalog(load_data(data_path)).warm()
+    if distance_matrix:
+        catalog.distance_matrix  # built on first access
+    catalog.save(out_path, source_checksum=file_checksum(data_path))
+    return catalog
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prebuild the catalog artifact")
+    parser.add_argument('--data', default='data/attractions.csv')
+    parser.add_argument('--out', default=CATALOG_ARTIFACT)
+    parser.add_argument('--no-distance-matrix', action='store_true',
+                        help="skip the n x n distance matrix (for very large catalogs)")
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    catalog = build(args.data, args.out, distance_matrix=not args.no_distance_matrix)
+    size_mb = os.path.getsize(args.out) / 1e6
+    print(f"Wrote {args.out} ({len(catalog.data)} attractions, {size_mb:.1f} MB) in {time.time() - start:.1f}s",
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,535 @@
+import hashlib
+import os
+import pickle
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from data_loader import load_data
+from embeddings import N_PROBE, EmbeddingIndex, fit_lsa, project
+from hybrid_recommender import (
+    crowd_mask,
+    find_optimal_k_simple,
+    fit_kmeans_scalers,
+    prepare_kmeans_features_v3,
+)
+from metrics import increment, set_attrs
+from opening_hours import OPENING_COLUMNS, fill_opening_hours
+from utils import haversine_vectorized
+
+# Prebuilt catalog written by build_catalog.py; used instead of refitting when it matches the CSV
+CATALOG_ARTIFACT = os.getenv('PLANNER_CATALOG_ARTIFACT', 'artifacts/catalog.pkl')
+ARTIFACT_FORMAT = 2
+# Content scoring: 'tfidf' (sparse cosine similarity) or 'lsa' (dense embeddings, see embeddings.py)
+CONTENT_MODELS = ('tfidf', 'lsa')
+CONTENT_MODEL = os.getenv('PLANNER_CONTENT_MODEL', 'tfidf')
+# CountVectorizer's default token pattern, used for free-text queries
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+
+def normalize_rows(matrix):
+    """L2-normalize the rows of a sparse matrix, like sklearn's normalize() (without importing it)"""
+    matrix = sparse.csr_matrix(matrix, dtype=np.float64, copy=True)
+    row_nnz = np.diff(matrix.indptr)
+    # bincount sums each row in order, so results match sklearn bit for bit
+    row_of_value = np.repeat(np.arange(matrix.shape[0]), row_nnz)
+    norms = np.sqrt(np.bincount(row_of_value, weights=matrix.data ** 2, minlength=matrix.shape[0]))
+    norms[norms == 0] = 1.0
+    matrix.data /= np.repeat(norms, row_nnz)
+    return matrix
+
+
+def file_checksum(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class Catalog:
+    """Loaded attraction catalog with its derived models, updatable in place.
+
+    Rows are identified by their DataFrame index (the attraction id). Derived
+    structures are kept aligned with the row order of `data`:
+    - term counts + document frequencies for TF-IDF content scores
+    - LSA embeddings (float32) and their nearest-neighbour index, built on first use
+    - a Haversine distance matrix (km), built on first use
+    - KMeans cluster labels per crowd filter, built on first use
+
+    content_model ('tfidf' or 'lsa', default PLANNER_CONTENT_MODEL) picks how
+    content_scores() compares attractions with a profile.
+
+    append/patch/delete only recompute those structures for the rows they touch
+    and bump `version`, so downstream caches can invalidate precisely.
+    save()/load() store everything built so far, so a server can start from a
+    prebuilt catalog without fitting anything (or importing scikit-learn).
+    """
+
+    def __init__(self, data, content_model=None):
+        self.data = fill_opening_hours(data.copy())
+        self.version = 0
+        self.changes = []  # (version, op, ids) log for precise cache invalidation
+        self.content_model = check_content_model(content_model)
+        self.refit()
+
+    # ===== FULL (RE)BUILD =====
+
+    def refit(self):
+        """Rebuild every derived structure from scratch (vocabulary, IDF, clusters)"""
+        from sklearn.feature_extraction.text import CountVectorizer
+
+        self._vectorizer = CountVectorizer(stop_words='english')
+        self._counts = self._vectorizer.fit_transform(self.data['Description'].tolist()).tocsr()
+        self._vocabulary = dict(self._vectorizer.vocabulary_)
+        self._analyzer = None
+        self._df = np.asarray((self._counts > 0).sum(axis=0)).ravel()
+        self._distance_matrix = None
+        self._clusters = {}
+        self._tfidf_cache = None
+        self._lsa_components = None
+        self._embeddings = None
+        self._embedding_index = None
+
+    # ===== PREBUILT ARTIFACTS =====
+
+    def save(self, path, source_checksum=None):
+        """Write the catalog and everything built so far to a pickle file"""
+        clusters = {
+            crowded_preference: {
+                'labels': state['labels'],
+                'n_clusters': state['n_clusters'],
+                # Pickled separately so loading does not import scikit-learn until a model is needed
+                'model': state.get('model') or pickle.dumps((state['kmeans'], state['scalers'])),
+            }
+            for crowded_preference, state in self._clusters.items()
+        }
+        artifact = {
+            'format': ARTIFACT_FORMAT,
+            'source_checksum': source_checksum,
+            'data': self.data,
+            'version': self.version,
+            'changes': self.changes,
+            'counts': self._counts,
+            'vocabulary': self._vocabulary,
+            'df': self._df,
+            'distance_matrix': self._distance_matrix,
+            'clusters': clusters,
+            'lsa_components': self._lsa_components,
+            'embeddings': self._embeddings,
+            'embedding_index': self._embedding_index,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'wb') as f:
+            pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path, source_checksum=None, content_model=None):
+        """Catalog from a file written by save(); None if it is missing, outdated or
+        was built from a different source file"""
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            artifact = pickle.load(f)
+        if artifact.get('format') != ARTIFACT_FORMAT:
+            return None
+        if source_checksum is not None and artifact['source_checksum'] != source_checksum:
+            return None
+
+        catalog = cls.__new__(cls)
+        catalog.data = artifact['data']
+        catalog.version = artifact['version']
+        catalog.changes = artifact['changes']
+        catalog.content_model = check_content_model(content_model)
+        catalog._counts = artifact['counts']
+        catalog._vocabulary = artifact['vocabulary']
+        catalog._df = artifact['df']
+        catalog._distance_matrix = artifact['distance_matrix']
+        catalog._clusters = artifact['clusters']
+        catalog._lsa_components = artifact['lsa_components']
+        catalog._embeddings = artifact['embeddings']
+        catalog._embedding_index = artifact['embedding_index']
+        catalog._vectorizer = None
+        catalog._analyzer = None
+        catalog._tfidf_cache = None
+        return catalog
+
+    # ===== DERIVED STRUCTURES =====
+
+    @property
+    def vectorizer(self):
+        """CountVectorizer over the catalog vocabulary (created on first use for loaded catalogs)"""
+        if self._vectorizer is None:
+            from sklearn.feature_extraction.text import CountVectorizer
+            self._vectorizer = CountVectorizer(stop_words='english', vocabulary=dict(self._vocabulary))
+        return self._vectorizer
+
+    @property
+    def analyzer(self):
+        """Tokenizer used for the catalog's term counts"""
+        if self._analyzer is None:
+            self._analyzer = self.vectorizer.build_analyzer()
+        return self._analyzer
+
+    @property
+    def ids(self):
+        return self.data.index
+
+    def positions(self, ids):
+        """Row positions of the given attraction ids"""
+        pos = self.data.index.get_indexer(list(ids))
+        if (pos < 0).any():
+            missing = [i for i, p in zip(ids, pos) if p < 0]
+            raise KeyError(f"Unknown attraction ids: {missing}")
+        return pos
+
+    @property
+    def idf(self):
+        # Same smoothed IDF as sklearn's TfidfVectorizer
+        n = self._counts.shape[0]
+        return np.log((1 + n) / (1 + self._df)) + 1
+
+    @property
+    def tfidf_matrix(self):
+        """L2-normalized TF-IDF rows for every attraction (cached per catalog version)"""
+        if self._tfidf_cache is None or self._tfidf_cache[0] != self.version:
+            matrix = normalize_rows(self._counts.multiply(self.idf))
+            self._tfidf_cache = (self.version, matrix)
+        return self._tfidf_cache[1]
+
+    def profile_vectors(self, profile_masks):
+        """TF-IDF vectors of category profiles, one per row of a (profiles x rows) mask.
+
+        A profile is the concatenation of the descriptions it covers, so its
+        term counts are just the sum of those rows' counts.
+        """
+        masks = sparse.csr_matrix(np.asarray(profile_masks, dtype=np.float64))
+        profile_counts = masks @ self._counts
+        return normalize_rows(profile_counts.multiply(self.idf))
+
+    def profile_tfidf_scores(self, profile_masks, positions=None):
+        """(profiles x rows) TF-IDF cosine similarity of attractions (all, or those at
+        positions) to category profiles, as TfidfVectorizer fitted on the profile
+        document plus all descriptions computes it: the profile's own terms count
+        once more in the document frequencies, so every profile has its own IDF.
+        """
+        masks = sparse.csr_matrix(np.asarray(profile_masks, dtype=np.float64))
+        profile_counts = masks @ self._counts
+        n = self._counts.shape[0] + 1
+        idf_out = np.log((1 + n) / (1 + self._df)) + 1  # terms not in the profile
+        idf_in = np.log((1 + n) / (2 + self._df)) + 1  # terms in the profile
+        counts = self._counts if positions is None else self._counts[positions]
+
+        # Only the profile's terms contribute to the dot products, and they all use idf_in
+        profiles = normalize_rows(profile_counts.multiply(idf_in))
+        dots = (profiles @ counts.multiply(idf_in).T).toarray()
+        # Attraction norms under each profile's IDF: idf_out everywhere, corrected on the profile's terms
+        squares = counts.multiply(counts).tocsr()
+        in_profile = (profile_counts > 0).astype(np.float64)
+        norms = np.sqrt(
+            (squares @ idf_out ** 2)[np.newaxis, :]
+            + (in_profile @ squares.multiply(idf_in ** 2 - idf_out ** 2).T).toarray()
+        )
+        norms[norms == 0] = 1.0
+        return dots / norms
+
+    def _tfidf_rows(self, positions):
+        """TF-IDF rows of some attractions, without rebuilding the whole matrix"""
+        return normalize_rows(self._counts[positions].multiply(self.idf))
+
+    @property
+    def embeddings(self):
+        """Unit-length LSA embeddings (float32) of every attraction, fitted on first use"""
+        if self._embeddings is None:
+            self._lsa_components = fit_lsa(self.tfidf_matrix)
+            self._embeddings = project(self.tfidf_matrix, self._lsa_components)
+        return self._embeddings
+
+    @property
+    def embedding_index(self):
+        """Nearest-neighbour index over the embeddings, built on first use"""
+        if self._embedding_index is None:
+            self._embedding_index = EmbeddingIndex(self.embeddings)
+        return self._embedding_index
+
+    def profile_embeddings(self, profile_masks):
+        """LSA embeddings of category profiles, one per row of a (profiles x rows) mask"""
+        self.embeddings  # fits the components if needed
+        return project(self.profile_vectors(profile_masks), self._lsa_components)
+
+    def text_embedding(self, text):
+        """LSA embedding of free text; words outside the catalog vocabulary are ignored"""
+        self.embeddings
+        counts = {}
+        # Stop words never reach the vocabulary, so CountVectorizer's token pattern
+        # is all the tokenizing needed (and scikit-learn need not be imported)
+        for term in TOKEN_PATTERN.findall(text.lower()):
+            col = self._vocabulary.get(term)
+            if col is not None:
+                counts[col] = counts.get(col, 0) + 1
+        row = sparse.csr_matrix(
+            (list(counts.values()), ([0] * len(counts), list(counts.keys()))),
+            shape=(1, self._counts.shape[1]), dtype=np.float64
+        )
+        return project(normalize_rows(row.multiply(self.idf)), self._lsa_components)[0]
+
+    def profile_scores(self, profile_masks, positions=None, model=None):
+        """(profiles x rows) similarity of attractions (all, or those at positions) to
+        category profiles, by content_model (or model)"""
+        model = check_content_model(model or self.content_model)
+        if model == 'lsa':
+            embeddings = self.embeddings if positions is None else self.embeddings[positions]
+            # Dense dot products; clipped like TF-IDF cosine similarity to [0, 1]
+            return np.clip(self.profile_embeddings(profile_masks) @ embeddings.T, 0, None).astype(np.float64)
+        return self.profile_tfidf_scores(profile_masks, positions)
+
+    def content_scores(self, selected_categories, model=None):
+        """Similarity of every attraction to the profile of the selected categories"""
+        mask = self.data['Category'].isin(selected_categories).values
+        return self.profile_scores(mask[np.newaxis, :], model=model)[0]
+
+    def nearest(self, query, top_n=10, n_probe=N_PROBE):
+        """Top-N attractions most similar to a query, as [(id, similarity)], best first.
+        query is free text or a list of categories (their combined profile).
+        """
+        if isinstance(query, str):
+            vector = self.text_embedding(query)
+        else:
+            mask = self.data['Category'].isin(list(query)).values
+            vector = self.profile_embeddings(mask[np.newaxis, :])[0]
+        if not vector.any():
+            return []
+        positions, scores = self.embedding_index.search(self.embeddings, vector, top_n, n_probe)
+        return [(self.data.index[p], float(score)) for p, score in zip(positions, scores)]
+
+    @property
+    def distance_matrix(self):
+        """Haversine distances (km) between all attractions, built on first access"""
+        if self._distance_matrix is None:
+            lat = self.data['Latitude'].values.astype(float)
+            lon = self.data['Longitude'].values.astype(float)
+            self._distance_matrix = haversine_vectorized(
+                lat[:, np.newaxis], lon[:, np.newaxis], lat[np.newaxis, :], lon[np.newaxis, :]
+            )
+        return self._distance_matrix
+
+    def cluster_state(self, crowded_preference):
+        """Cluster labels (Series by id) and n_clusters for a crowd filter, plus the fitted
+        KMeans and scalers when built here (see cluster_model for loaded catalogs)"""
+        cached = crowded_preference in self._clusters
+        increment('cluster_cache', result='hit' if cached else 'miss')
+        set_attrs(cache='hit' if cached else 'miss')
+        if not cached:
+            from sklearn.cluster import KMeans
+
+            subset = self.data[crowd_mask(self.data, crowded_preference)]
+            scalers = fit_kmeans_scalers(subset)
+            features = prepare_kmeans_features_v3(subset, scalers)
+            n_clusters = find_optimal_k_simple(features)
+            kmeans = KMeans(n_clusters=n_clusters, n_init=10, random_state=42)
+            labels = pd.Series(kmeans.fit_predict(features), index=subset.index)
+            self._clusters[crowded_preference] = {
+                'kmeans': kmeans,
+                'scalers': scalers,
+                'n_clusters': n_clusters,
+                'labels': labels,
+            }
+        return self._clusters[crowded_preference]
+
+    def cluster_model(self, crowded_preference):
+        """(kmeans, scalers) for a crowd filter, unpickled on first use for loaded catalogs"""
+        state = self._clusters.get(crowded_preference) or self.cluster_state(crowded_preference)
+        if 'kmeans' not in state:
+            state['kmeans'], state['scalers'] = pickle.loads(state.pop('model'))
+        return state['kmeans'], state['scalers']
+
+    def warm(self):
+        """Build every lazily computed structure up front (e.g. before forking workers)"""
+        for crowded_preference in (None, True, False):
+            self.cluster_state(crowded_preference)
+        self.tfidf_matrix  # cached per catalog version
+        self.embedding_index  # fits the embeddings too
+        return self
+
+    # ===== INCREMENTAL UPDATES =====
+
+    def _count_rows(self, descriptions):
+        """Term counts for new descriptions, growing the vocabulary if needed"""
+        rows, cols, vals = [], [], []
+        for i, text in enumerate(descriptions):
+            counts = {}
+            for term in self.analyzer(text):
+                col = self._vocabulary.setdefault(term, len(self._vocabulary))
+                counts[col] = counts.get(col, 0) + 1
+            rows.extend([i] * len(counts))
+            cols.extend(counts.keys())
+            vals.extend(counts.values())
+
+        n_terms = len(self._vocabulary)
+        if n_terms > self._counts.shape[1]:
+            self._counts.resize((self._counts.shape[0], n_terms))
+            self._df = np.concatenate([self._df, np.zeros(n_terms - len(self._df), dtype=self._df.dtype)])
+        return sparse.csr_matrix(
+            (vals, (rows, cols)), shape=(len(descriptions), n_terms), dtype=self._counts.dtype
+        )
+
+    def _distance_rows(self, positions):
+        lat = self.data['Latitude'].values.astype(float)
+        lon = self.data['Longitude'].values.astype(float)
+        return haversine_vectorized(
+            lat[positions, np.newaxis], lon[positions, np.newaxis], lat[np.newaxis, :], lon[np.newaxis, :]
+        )
+
+    def _update_clusters(self, changed_ids=(), deleted_ids=()):
+        """Re-assign changed rows to existing clusters and drop deleted ones"""
+        for crowded_preference, state in self._clusters.items():
+            labels = state['labels'].drop(index=list(changed_ids) + list(deleted_ids), errors='ignore')
+            if len(changed_ids):
+                changed = self.data.loc[list(changed_ids)]
+                changed = changed[crowd_mask(changed, crowded_preference)]
+                if not changed.empty:
+                    kmeans, scalers = self.cluster_model(crowded_preference)
+                    features = prepare_kmeans_features_v3(changed, scalers)
+                    new_labels = pd.Series(kmeans.predict(features), index=changed.index)
+                    labels = pd.concat([labels, new_labels])
+            # Keep labels in catalog row order
+            state['labels'] = labels.reindex(self.data.index[self.data.index.isin(labels.index)])
+
+    def _record(self, op, ids):
+        self.version += 1
+        self.changes.append((self.version, op, list(ids)))
+        return self.version
+
+    def changed_since(self, version):
+        """Ids appended, patched or deleted after the given catalog version"""
+        return {i for v, _, ids in self.changes if v > version for i in ids}
+
+    def append(self, rows):
+        """Append new attractions (DataFrame or list of dicts). Returns their ids."""
+        rows = pd.DataFrame(rows)
+        if rows.empty:
+            return []
+        start = (self.data.index.max() + 1) if len(self.data) else 0
+        rows.index = pd.RangeIndex(start, start + len(rows))
+        rows = fill_opening_hours(rows.reindex(columns=self.data.columns))
+        old_n = len(self.data)
+        self.data = pd.concat([self.data, rows])
+
+        new_counts = self._count_rows(rows['Description'].fillna('').tolist())
+        self._counts = sparse.vstack([self._counts, new_counts]).tocsr()
+        self._df += np.asarray((new_counts > 0).sum(axis=0)).ravel()
+        new_positions = np.arange(old_n, len(self.data))
+
+        if self._embeddings is not None:
+            # Fold the new rows into the fitted components
+            new_embeddings = project(self._tfidf_rows(new_positions), self._lsa_components)
+            self._embeddings = np.vstack([self._embeddings, new_embeddings])
+            if self._embedding_index is not None:
+                self._embedding_index.append(new_embeddings)
+
+        if self._distance_matrix is not None:
+            new_rows = self._distance_rows(new_positions)
+            grown = np.zeros((len(self.data), len(self.data)))
+            grown[:old_n, :old_n] = self._distance_matrix
+            grown[new_positions, :] = new_rows
+            grown[:, new_positions] = new_rows.T
+            self._distance_matrix = grown
+
+        self._update_clusters(changed_ids=rows.index)
+        self._record('append', rows.index)
+        return rows.index.tolist()
+
+    def patch(self, updates):
+        """Apply field changes, given as {id: {column: value}}"""
+        if not updates:
+            return self.version
+        ids = list(updates)
+        positions = self.positions(ids)
+        for attraction_id, changes in updates.items():
+            for column, value in changes.items():
+                self.data.at[attraction_id, column] = value
+        if any(set(OPENING_COLUMNS) & set(changes) for changes in updates.values()):
+            # Cleared opening hours fall back to the category defaults
+            opening = list(OPENING_COLUMNS)
+            self.data.loc[ids, opening] = fill_opening_hours(self.data.loc[ids].copy())[opening]
+
+        text_changed = [p for i, p in zip(ids, positions) if 'Description' in updates[i]]
+        if text_changed:
+            new_rows = self._count_rows(self.data['Description'].iloc[text_changed].fillna('').tolist())
+            old_rows = self._counts[text_changed]
+            self._df -= np.asarray((old_rows > 0).sum(axis=0)).ravel()
+            self._df += np.asarray((new_rows > 0).sum(axis=0)).ravel()
+            # Swap the changed rows in with a single row permutation
+            order = np.arange(self._counts.shape[0])
+            order[text_changed] = self._counts.shape[0] + np.arange(len(text_changed))
+            self._counts = sparse.vstack([self._counts, new_rows]).tocsr()[order]
+            if self._embeddings is not None:
+                new_embeddings = project(self._tfidf_rows(text_changed), self._lsa_components)
+                self._embeddings[text_changed] = new_embeddings
+                if self._embedding_index is not None:
+                    self._embedding_index.update(text_changed, new_embeddings)
+
+        moved = [p for i, p in zip(ids, positions) if {'Latitude', 'Longitude'} & set(updates[i])]
+        if moved and self._distance_matrix is not None:
+            new_rows = self._distance_rows(moved)
+            self._distance_matrix[moved, :] = new_rows
+            self._distance_matrix[:, moved] = new_rows.T
+
+        self._update_clusters(changed_ids=ids)
+        return self._record('patch', ids)
+
+    def delete(self, ids):
+        """Remove attractions by id"""
+        ids = list(ids)
+        if not ids:
+            return self.version
+        positions = self.positions(ids)
+        keep = np.ones(len(self.data), dtype=bool)
+        keep[positions] = False
+
+        self._df -= np.asarray((self._counts[positions] > 0).sum(axis=0)).ravel()
+        self._counts = self._counts[keep]
+        self.data = self.data[keep]
+        if self._distance_matrix is not None:
+            self._distance_matrix = self._distance_matrix[np.ix_(keep, keep)]
+        if self._embeddings is not None:
+            self._embeddings = self._embeddings[keep]
+            if self._embedding_index is not None:
+                self._embedding_index.delete(keep)
+
+        self._update_clusters(deleted_ids=ids)
+        return self._record('delete', ids)
+
+    def apply_delta(self, delta):
+        """Apply one delta record: {'op': 'append'|'patch'|'delete', ...}
+
+        - append: {'op': 'append', 'rows': [{...}, ...]}
+        - patch:  {'op': 'patch', 'id': 3, 'changes': {'Cost': 1500}}
+        - delete: {'op': 'delete', 'ids': [3, 7]}
+        """
+        op = delta.get('op')
+        if op == 'append':
+            self.append(delta['rows'])
+        elif op == 'patch':
+            self.patch({delta['id']: delta['changes']})
+        elif op == 'delete':
+            self.delete(delta['ids'])
+        else:
+            raise ValueError(f"Unknown catalog delta op: {op!r}")
+        return self.version
+
+
+def check_content_model(content_model):
+    """content_model, or CONTENT_MODEL if None; ValueError for unknown models"""
+    content_model = content_model or CONTENT_MODEL
+    if content_model not in CONTENT_MODELS:
+        raise ValueError(f"Unknown content model: {content_model!r}")
+    return content_model
+
+
+def load_catalog(path="data/attractions.csv", artifact_path=CATALOG_ARTIFACT, content_model=None):
+    """Load attractions.csv into a Catalog, from the prebuilt artifact when it matches the CSV"""
+    if artifact_path:
+        catalog = Catalog.load(artifact_path, source_checksum=file_checksum(path), content_model=content_model)
+        if catalog is not None:
+            return catalog
+    return Catalog(load_data(path), content_model=content_model)
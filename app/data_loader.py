@@ -1,6 +1,7 @@
 import pandas as pd
+from opening_hours import fill_opening_hours
 
-def load_data():
-    data = pd.read_csv("data/attractions.csv")
+def load_data(path="data/attractions.csv"):
+    data = pd.read_csv(path)
     data.dropna(subset=["Latitude", "Longitude"], inplace=True)
-    return data
+    return fill_opening_hours(data)
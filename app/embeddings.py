@@ -0,0 +1,126 @@
+"""Dense description embeddings (LSA) and a nearest-neighbour index over them.
+
+fit_lsa() learns a truncated SVD of the catalog's TF-IDF rows; project() maps
+any TF-IDF rows (attractions, category profiles, free text) onto it as unit-length
+float32 vectors, so cosine similarity is a dot product of EMBEDDING_DIM numbers
+whatever the length of the descriptions. EmbeddingIndex answers top-N queries
+by scanning only the rows near the query (inverted lists over coarse centroids).
+Only fitting needs scikit-learn; projecting and searching are plain numpy.
+"""
+import numpy as np
+
+EMBEDDING_DIM = 64
+# Catalogs below this size are scanned in full; above it queries probe N_PROBE of ~sqrt(n) lists
+IVF_MIN_ROWS = 2048
+N_PROBE = 8
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+# Rows scored against the centroids at once when assigning lists
+ASSIGN_CHUNK = 8192
+
+
+def fit_lsa(tfidf_matrix, dim=EMBEDDING_DIM, seed=42):
+    """(dim x terms) float32 components of a truncated SVD of the TF-IDF rows"""
+    from sklearn.decomposition import TruncatedSVD
+
+    dim = max(1, min(dim, tfidf_matrix.shape[0] - 1, tfidf_matrix.shape[1] - 1))
+    svd = TruncatedSVD(n_components=dim, random_state=seed)
+    svd.fit(tfidf_matrix)
+    return svd.components_.astype(np.float32)
+
+
+def project(tfidf_rows, components):
+    """Unit-length float32 embeddings of sparse TF-IDF rows.
+    Terms added to the vocabulary after the fit carry no weight.
+    """
+    rows = tfidf_rows[:, :components.shape[1]]
+    vectors = np.asarray(rows @ components.T, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def spherical_kmeans(vectors, n_clusters, seed=42, iterations=KMEANS_ITERATIONS):
+    """Unit-length centroids of cosine k-means over a sample of unit-length vectors"""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), n_clusters * KMEANS_SAMPLE_PER_LIST)
+    sample = vectors[rng.choice(len(vectors), size=sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), size=n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        labels = (sample @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Empty clusters keep their previous centroid
+        filled = norms[:, 0] > 0
+        centroids[filled] = sums[filled] / norms[filled]
+    return centroids
+
+
+class EmbeddingIndex:
+    """Inverted-file index over the rows of an embedding matrix.
+
+    Rows are grouped by their most similar of ~sqrt(n) centroids; a query scores
+    the centroids, then only the rows in the n_probe best groups. Row positions
+    follow the embedding matrix, so append/update/delete mirror its changes.
+    Catalogs under IVF_MIN_ROWS rows use a single group (an exact full scan).
+    """
+
+    def __init__(self, embeddings, n_lists=None, seed=42):
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(embeddings))) if len(embeddings) >= IVF_MIN_ROWS else 0
+        self.centroids = spherical_kmeans(embeddings, n_lists, seed) if n_lists else None
+        self.assignments = self.assign(embeddings)
+        self._lists = None
+
+    @property
+    def n_lists(self):
+        return 1 if self.centroids is None else len(self.centroids)
+
+    def assign(self, vectors):
+        """Group of each vector"""
+        if self.centroids is None:
+            return np.zeros(len(vectors), dtype=np.int32)
+        return np.concatenate([
+            (vectors[i:i + ASSIGN_CHUNK] @ self.centroids.T).argmax(axis=1)
+            for i in range(0, len(vectors), ASSIGN_CHUNK)
+        ] or [np.zeros(0, dtype=np.int64)]).astype(np.int32)
+
+    def append(self, vectors):
+        self.assignments = np.concatenate([self.assignments, self.assign(vectors)])
+        self._lists = None
+
+    def update(self, positions, vectors):
+        self.assignments[positions] = self.assign(vectors)
+        self._lists = None
+
+    def delete(self, keep):
+        """Drop the rows where the boolean mask keep is False"""
+        self.assignments = self.assignments[keep]
+        self._lists = None
+
+    @property
+    def lists(self):
+        """(row positions sorted by group, start offset of each group), rebuilt after changes"""
+        if self._lists is None:
+            order = np.argsort(self.assignments, kind='stable')
+            bounds = np.searchsorted(self.assignments[order], np.arange(self.n_lists + 1))
+            self._lists = (order, bounds)
+        return self._lists
+
+    def search(self, embeddings, query, top_n=10, n_probe=N_PROBE):
+        """(row positions, similarities) of the top_n rows most similar to the
+        unit-length query vector, best first
+        """
+        order, bounds = self.lists
+        if self.centroids is None:
+            rows = order
+        else:
+            probe = np.argsort(-(self.centroids @ query))[:n_probe]
+            rows = np.concatenate([order[bounds[g]:bounds[g + 1]] for g in probe])
+        scores = embeddings[rows] @ query
+        if len(rows) > top_n:
+            best = np.argpartition(-scores, top_n)[:top_n]
+            rows, scores = rows[best], scores[best]
+        ranking = np.argsort(-scores, kind='stable')
+        return rows[ranking], scores[ranking]
@@ -0,0 +1,117 @@
+"""Exact attraction selection: the time and budget limits as a 2-D knapsack.
+
+Given a value and a (time, cost) weight per candidate, pick the set with the
+highest total value that fits both capacities:
+- knapsack_dp: dynamic programming over capacities discretized into cells
+  (weights are rounded up, so every result fits the real limits)
+- knapsack_cpsat: OR-Tools CP-SAT on integer-scaled weights, stopped after max_seconds
+
+Both return (positions, info) with info['status'] 'OPTIMAL' or 'FEASIBLE'
+(CP-SAT stopped by its time cap) and the objective bound where known.
+"""
+import numpy as np
+
+# Discretization of the DP: time in quarter hours, the budget in at most BUDGET_CELLS cells
+TIME_STEP_HOURS = 0.25
+BUDGET_CELLS = 200
+# Upper bound on the DP's backtracking table (one byte per item and cell)
+MAX_TABLE_BYTES = 64 * 1024 * 1024
+
+# CP-SAT: default time cap and the integer scales of values and hours
+CPSAT_MAX_SECONDS = 1.0
+VALUE_SCALE = 1000
+TIME_SCALE = 100
+
+
+def _usable(values, time_weights, costs, time_capacity, budget):
+    """Items that can add value and fit on their own"""
+    values = np.asarray(values, dtype=float)
+    return np.flatnonzero(
+        np.isfinite(values) & (values > 0)
+        & (np.asarray(time_weights, dtype=float) <= time_capacity)
+        & (np.asarray(costs, dtype=float) <= budget)
+    )
+
+
+def knapsack_dp(values, time_weights, costs, time_capacity, budget,
+                time_step=TIME_STEP_HOURS, budget_cells=BUDGET_CELLS):
+    """Best set of items under both capacities by DP over a (time x budget) grid.
+
+    Optimal for the discretized weights; a coarser budget grid is used when the
+    backtracking table would exceed MAX_TABLE_BYTES.
+    """
+    items = _usable(values, time_weights, costs, time_capacity, budget)
+    info = {'status': 'OPTIMAL', 'objective': 0.0, 'time_step': time_step}
+    if len(items) == 0:
+        info['budget_step'] = None
+        return [], info
+
+    time_cells = int(np.floor(time_capacity / time_step + 1e-9))
+    max_budget_cells = max(1, MAX_TABLE_BYTES // (len(items) * (time_cells + 1)) - 1)
+    budget_step = max(1.0, budget / min(budget_cells, max_budget_cells)) if budget > 0 else 1.0
+    budget_cells = int(np.floor(budget / budget_step + 1e-9))
+    info['budget_step'] = budget_step
+
+    item_values = np.asarray(values, dtype=float)[items]
+    # Rounding weights up keeps every grid solution within the real limits
+    time_units = np.ceil(np.asarray(time_weights, dtype=float)[items] / time_step - 1e-9).astype(int)
+    cost_units = np.ceil(np.asarray(costs, dtype=float)[items] / budget_step - 1e-9).astype(int)
+
+    # best[t, b]: highest value using at most t time cells and b budget cells
+    best = np.zeros((time_cells + 1, budget_cells + 1))
+    taken = np.zeros((len(items), time_cells + 1, budget_cells + 1), dtype=bool)
+    for i, (t, c, value) in enumerate(zip(time_units, cost_units, item_values)):
+        if t > time_cells or c > budget_cells:
+            continue
+        with_item = best[:time_cells + 1 - t, :budget_cells + 1 - c] + value
+        better = with_item > best[t:, c:]
+        taken[i, t:, c:] = better
+        best[t:, c:] = np.where(better, with_item, best[t:, c:])
+
+    positions = []
+    t, c = time_cells, budget_cells
+    for i in range(len(items) - 1, -1, -1):
+        if taken[i, t, c]:
+            positions.append(int(items[i]))
+            t -= time_units[i]
+            c -= cost_units[i]
+    info['objective'] = float(best[-1, -1])
+    return positions[::-1], info
+
+
+def knapsack_cpsat(values, time_weights, costs, time_capacity, budget,
+                   max_seconds=CPSAT_MAX_SECONDS, hint=None):
+    """Best set of items under both capacities with CP-SAT, within max_seconds.
+
+    Values and hours are scaled to integers (VALUE_SCALE, TIME_SCALE; weights
+    rounded up). hint: positions of a known solution (e.g. the greedy picks).
+    """
+    from ortools.sat.python import cp_model
+
+    items = _usable(values, time_weights, costs, time_capacity, budget)
+    if len(items) == 0:
+        return [], {'status': 'OPTIMAL', 'objective': 0.0, 'bound': 0.0}
+
+    item_values = np.round(np.asarray(values, dtype=float)[items] * VALUE_SCALE).astype(int)
+    time_units = np.ceil(np.asarray(time_weights, dtype=float)[items] * TIME_SCALE - 1e-9).astype(int)
+    cost_units = np.ceil(np.asarray(costs, dtype=float)[items] - 1e-9).astype(int)
+
+    model = cp_model.CpModel()
+    chosen = [model.NewBoolVar(f"x{i}") for i in range(len(items))]
+    model.Add(sum(int(t) * x for t, x in zip(time_units, chosen)) <= int(np.floor(time_capacity * TIME_SCALE + 1e-9)))
+    model.Add(sum(int(c) * x for c, x in zip(cost_units, chosen)) <= int(np.floor(budget + 1e-9)))
+    model.Maximize(sum(int(v) * x for v, x in zip(item_values, chosen)))
+    if hint is not None:
+        hinted = set(int(p) for p in hint)
+        for item, x in zip(items, chosen):
+            model.AddHint(x, int(item) in hinted)
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = float(max_seconds)
+    status = solver.Solve(model)
+    info = {'status': solver.StatusName(status)}
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return [], info
+    info['objective'] = solver.ObjectiveValue() / VALUE_SCALE
+    info['bound'] = solver.BestObjectiveBound() / VALUE_SCALE
+    return [int(item) for item, x in zip(items, chosen) if solver.Value(x)], info
@@ -1,91 +1,110 @@
+import logging
+import time
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import KMeans
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import StandardScaler
-from utils import haversine_distance
+# scikit-learn is imported inside the functions that fit models: it is slow to import
+# and not needed to serve requests from a prebuilt catalog
+from utils import haversine_distance, haversine_vectorized
 import numpy as np
+from metrics import set_attrs, span
+from opening_hours import OPENING_COLUMNS, fill_opening_hours, wait_hours
+from travel_time import AVG_SPEED_KMH, travel_hours
 
-# Helper to estimate travel time (in hours) given distance (km), assuming avg speed 40km/h
-AVG_SPEED_KMH = 40
+logger = logging.getLogger(__name__)
 
+# Helper to estimate travel time (in hours) given distance (km), assuming avg speed 40km/h
+# (time-of-day aware estimates: travel_time.travel_hours)
 def estimate_travel_time_km(distance_km):
     return distance_km / AVG_SPEED_KMH
 
 def find_optimal_k_simple(features, max_k=8):
     """Simple elbow method implementation with detailed logging"""
-    print(f"\n=== ELBOW METHOD DEBUG ===")
-    print(f"Input features shape: {features.shape}")
+    from sklearn.cluster import KMeans
+
+    logger.debug(f"\n=== ELBOW METHOD DEBUG ===")
+    logger.debug(f"Input features shape: {features.shape}")
 
     # Handle both DataFrame and numpy array
     if hasattr(features, 'columns'):
-        print(f"Features used: {list(features.columns)}")
+        logger.debug(f"Features used: {list(features.columns)}")
         feature_data = features.values  # Convert DataFrame to numpy array
     else:
-        print(f"Features used: numpy array with {features.shape[1]} features")
+        logger.debug(f"Features used: numpy array with {features.shape[1]} features")
         feature_data = features  # Already a numpy array
 
-    print(f"Max k to test: {max_k}")
+    logger.debug(f"Max k to test: {max_k}")
 
     if len(feature_data) <= 2:
-        print(f"Too few data points ({len(feature_data)}), returning k=1")
+        logger.debug(f"Too few data points ({len(feature_data)}), returning k=1")
         return 1
 
     max_k = min(max_k, len(feature_data))
-    print(f"Adjusted max_k (limited by data size): {max_k}")
+    logger.debug(f"Adjusted max_k (limited by data size): {max_k}")
     
     wcss = []
-    print(f"\n--- Calculating WCSS for different k values ---")
+    logger.debug(f"\n--- Calculating WCSS for different k values ---")
     
     for k in range(1, max_k + 1):
         kmeans = KMeans(n_clusters=k, n_init=10, random_state=42)
         kmeans.fit(feature_data)
         wcss_value = kmeans.inertia_
         wcss.append(wcss_value)
-        print(f"k={k}: WCSS = {wcss_value:.2f}")
+        logger.debug(f"k={k}: WCSS = {wcss_value:.2f}")
     
-    print(f"\nWCSS values: {[f'{w:.2f}' for w in wcss]}")
+    logger.debug(f"\nWCSS values: {[f'{w:.2f}' for w in wcss]}")
     
     # Find elbow using rate of change
     if len(wcss) >= 3:
-        print(f"\n--- Finding Elbow Point ---")
+        logger.debug(f"\n--- Finding Elbow Point ---")
         differences = [wcss[i-1] - wcss[i] for i in range(1, len(wcss))]
-        print(f"First differences (WCSS reduction): {[f'{d:.2f}' for d in differences]}")
+        logger.debug(f"First differences (WCSS reduction): {[f'{d:.2f}' for d in differences]}")
         
         max_difference = max(differences)
         max_diff_index = differences.index(max_difference)
         optimal_k = max_diff_index + 2  # +2 because differences start from k=2
         
-        print(f"Maximum WCSS reduction: {max_difference:.2f} (between k={max_diff_index+1} and k={max_diff_index+2})")
-        print(f"Elbow point found at k={optimal_k}")
+        logger.debug(f"Maximum WCSS reduction: {max_difference:.2f} (between k={max_diff_index+1} and k={max_diff_index+2})")
+        logger.debug(f"Elbow point found at k={optimal_k}")
         
         # Show why this k is optimal
         if optimal_k > 1:
             improvement_before = differences[max_diff_index]
             if max_diff_index + 1 < len(differences):
                 improvement_after = differences[max_diff_index + 1]
-                print(f"WCSS reduction at optimal k: {improvement_before:.2f}")
-                print(f"WCSS reduction after optimal k: {improvement_after:.2f}")
-                print(f"Diminishing returns ratio: {improvement_after/improvement_before:.2f}")
+                logger.debug(f"WCSS reduction at optimal k: {improvement_before:.2f}")
+                logger.debug(f"WCSS reduction after optimal k: {improvement_after:.2f}")
+                logger.debug(f"Diminishing returns ratio: {improvement_after/improvement_before:.2f}")
         
         final_k = min(optimal_k, max_k)
-        print(f"Final optimal k: {final_k}")
+        logger.debug(f"Final optimal k: {final_k}")
         return final_k
     else:
-        print(f"Not enough k values to find elbow, returning k={len(wcss)}")
+        logger.debug(f"Not enough k values to find elbow, returning k={len(wcss)}")
         return len(wcss)
 
-def prepare_kmeans_features_v3(filtered_data):
+def fit_kmeans_scalers(filtered_data):
+    """Fit the scalers used by prepare_kmeans_features_v3 so they can be reused for new rows"""
+    from sklearn.preprocessing import StandardScaler
+
+    return {
+        'geo': StandardScaler().fit(filtered_data[['Latitude', 'Longitude']]),
+        'time': StandardScaler().fit(filtered_data[['AvgVisitTimeHrs']]),
+        'popularity': StandardScaler().fit(filtered_data[['Popularity']]),
+    }
+
+def prepare_kmeans_features_v3(filtered_data, scalers=None):
+    # Scalers are fitted on the given rows unless pre-fitted ones are passed in
+    if scalers is None:
+        scalers = fit_kmeans_scalers(filtered_data)
+
     # Geographic features (normalized)
     geo_features = filtered_data[['Latitude', 'Longitude']].copy()
-    geo_scaler = StandardScaler()
-    geo_normalized = geo_scaler.fit_transform(geo_features)
+    geo_normalized = scalers['geo'].transform(geo_features)
     
     # Experience features
     experience_features = []
     
     # Time investment (normalized)
-    time_normalized = StandardScaler().fit_transform(filtered_data[['AvgVisitTimeHrs']])
+    time_normalized = scalers['time'].transform(filtered_data[['AvgVisitTimeHrs']])
     experience_features.append(time_normalized.flatten())
     
     # Cost tier (categorical)
@@ -95,7 +114,7 @@ def prepare_kmeans_features_v3(filtered_data):
     cost_tiers[filtered_data['Cost'] >= 2000, 2] = 1  # High cost
     
     # Popularity tier
-    popularity_normalized = StandardScaler().fit_transform(filtered_data[['Popularity']])
+    popularity_normalized = scalers['popularity'].transform(filtered_data[['Popularity']])
     experience_features.append(popularity_normalized.flatten())
     
     # Combine all features
@@ -108,6 +127,12 @@ def prepare_kmeans_features_v3(filtered_data):
     
     return all_features
 
+def crowd_mask(data, crowded_preference):
+    """Boolean mask of rows matching the crowded preference"""
+    if crowded_preference is None:
+        return np.ones(len(data), dtype=bool)
+    return (data['Crowded'] == ('Yes' if crowded_preference else 'No')).values
+
 def format_top_candidates_for_users(top_candidates):
     """Format top candidates with user-friendly information"""
     candidates = []
@@ -122,58 +147,86 @@ def format_top_candidates_for_users(top_candidates):
         })
     return candidates
 
-def hybrid_recommend(
+def prepare_candidates(
     data,
     selected_categories,
     time_limit,
     budget,
     crowded_preference,
     user_location=None,
-    top_k_candidates=3,
-    return_explanation_data=False  # NEW: Return data for XAI explanation
+    catalog=None,
+    departure_hour=None
 ):
+    """Score and cluster the candidate attractions for a request.
+    Returns (candidates, start, explanation_data), or None if no attraction matches
+    the selected categories. With departure_hour, attractions whose opening hours
+    cannot be reached within the time limit are dropped (see reachable_mask).
+    """
+    if catalog is not None:
+        data = catalog.data
+
     # Filter by category and crowded preference
     filtered = data[data['Category'].isin(selected_categories)].copy()
     
     if filtered.empty:
-        if return_explanation_data:
-            return pd.DataFrame([]), {}
-        return pd.DataFrame([])
+        return None
 
-    # user preference profile 
-    filtered_descriptions = filtered['Description'].tolist()
-    user_preference_profile = " ".join(filtered_descriptions)
-    all_descriptions = data['Description'].tolist()
+    if catalog is not None:
+        # Precomputed TF-IDF rows and per-crowd-filter clusters from the catalog
+        with span('recommend.content_scores', source='catalog'):
+            all_attractions_with_scores = data.copy()
+            all_attractions_with_scores['content_score'] = catalog.content_scores(selected_categories)
+            constraint_filtered = all_attractions_with_scores[
+                crowd_mask(all_attractions_with_scores, crowded_preference)
+            ].copy()
 
-    documents = [user_preference_profile] + all_descriptions
+        with span('recommend.clustering', source='catalog'):
+            cluster_state = catalog.cluster_state(crowded_preference)
+            n_clusters = cluster_state['n_clusters']
+            constraint_filtered['cluster'] = cluster_state['labels'].loc[constraint_filtered.index]
+            set_attrs(n_clusters=n_clusters)
+    else:
+        from sklearn.cluster import KMeans
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.metrics.pairwise import cosine_similarity
 
-    # Content-based filtering (TF-IDF on Description)
-    tfidf = TfidfVectorizer(stop_words='english')
-    tfidf_matrix = tfidf.fit_transform(documents)
-    
-    # Cosine similarity to all attractions
-    user_profile_vector = tfidf_matrix[0:1]  # First row (user preference profile)
-    all_attraction_vectors = tfidf_matrix[1:]  # All attraction descriptions
+        with span('recommend.content_scores', source='fit'):
+            # user preference profile
+            filtered_descriptions = filtered['Description'].tolist()
+            user_preference_profile = " ".join(filtered_descriptions)
+            all_descriptions = data['Description'].tolist()
+
+            documents = [user_preference_profile] + all_descriptions
 
-    similarity_scores = cosine_similarity(user_profile_vector, all_attraction_vectors)[0]
-    all_attractions_with_scores = data.copy()
-    all_attractions_with_scores['content_score'] = similarity_scores
+            # Content-based filtering (TF-IDF on Description)
+            tfidf = TfidfVectorizer(stop_words='english')
+            tfidf_matrix = tfidf.fit_transform(documents)
     
-    constraint_filtered = all_attractions_with_scores.copy()
+            # Cosine similarity to all attractions
+            user_profile_vector = tfidf_matrix[0:1]  # First row (user preference profile)
+            all_attraction_vectors = tfidf_matrix[1:]  # All attraction descriptions
+
+            similarity_scores = cosine_similarity(user_profile_vector, all_attraction_vectors)[0]
+            all_attractions_with_scores = data.copy()
+            all_attractions_with_scores['content_score'] = similarity_scores
     
-    # Apply crowded preference constraint
-    if crowded_preference is not None:
-        if crowded_preference:
-            constraint_filtered = constraint_filtered[constraint_filtered['Crowded'] == 'Yes']
-        else:
-            constraint_filtered = constraint_filtered[constraint_filtered['Crowded'] == 'No']
+            constraint_filtered = all_attractions_with_scores.copy()
     
-    # KMeans clustering for diversity (by location and duration)
-    kmeans_features = prepare_kmeans_features_v3(constraint_filtered)
-    n_clusters = find_optimal_k_simple(kmeans_features)
-    print(f"Optimal clusters using elbow method: {n_clusters}")
-    kmeans = KMeans(n_clusters=n_clusters, n_init=10, random_state=42)
-    constraint_filtered['cluster'] = kmeans.fit_predict(kmeans_features)
+            # Apply crowded preference constraint
+            if crowded_preference is not None:
+                if crowded_preference:
+                    constraint_filtered = constraint_filtered[constraint_filtered['Crowded'] == 'Yes']
+                else:
+                    constraint_filtered = constraint_filtered[constraint_filtered['Crowded'] == 'No']
+
+        with span('recommend.clustering', source='fit'):
+            # KMeans clustering for diversity (by location and duration)
+            kmeans_features = prepare_kmeans_features_v3(constraint_filtered)
+            n_clusters = find_optimal_k_simple(kmeans_features)
+            logger.debug(f"Optimal clusters using elbow method: {n_clusters}")
+            kmeans = KMeans(n_clusters=n_clusters, n_init=10, random_state=42)
+            constraint_filtered['cluster'] = kmeans.fit_predict(kmeans_features)
+            set_attrs(n_clusters=n_clusters)
 
     constraint_filtered['hybrid_score'] = (
         constraint_filtered['content_score'] + 
@@ -191,36 +244,119 @@ def hybrid_recommend(
                 start[col] = None
     else:
         start = constraint_filtered.iloc[0]
+
+    n_closed = 0
+    if departure_hour is not None:
+        # NEW: Prune attractions that are closed whenever we could get there
+        if not set(OPENING_COLUMNS) <= set(constraint_filtered.columns):
+            constraint_filtered = fill_opening_hours(constraint_filtered)
+        with span('recommend.opening_hours', candidates=len(constraint_filtered)):
+            reachable = reachable_mask(constraint_filtered, start, time_limit, departure_hour)
+            n_closed = int((~reachable).sum())
+            constraint_filtered = constraint_filtered[reachable]
+            set_attrs(closed=n_closed)
     
-    # Store original filtered data for explanation
+    # Compact record for explanation: ids and scores instead of DataFrame copies.
+    # Detailed views are rebuilt from the (shared) attraction data when needed, see xai.py
     explanation_data = {
-        'original_data': data.copy(),
-        'filtered_data': constraint_filtered.copy(),
-        'kmeans_model': kmeans,
-        'tfidf_matrix': tfidf_matrix,
-        'tfidf_vectorizer': tfidf,
-        'selected_categories': selected_categories,
+        'candidate_ids': constraint_filtered.index.to_numpy(),
+        'content_scores': constraint_filtered['content_score'].to_numpy(dtype=np.float32),
+        'clusters': constraint_filtered['cluster'].to_numpy(dtype=np.int16),
+        'hybrid_scores': constraint_filtered['hybrid_score'].to_numpy(dtype=np.float32),
+        'catalog_version': catalog.version if catalog is not None else None,
+        'selected_categories': list(selected_categories),
         'time_limit': time_limit,
         'budget': budget,
         'crowded_preference': crowded_preference,
         'user_location': user_location,
-        'n_clusters': n_clusters
+        'n_clusters': int(n_clusters),
+        'closed_candidates': n_closed,  # Dropped for their opening hours
+        'departure_hour': departure_hour,
+        'selection_steps': []  # Filled in as the greedy selection picks attractions
     }
 
+    return constraint_filtered, start, explanation_data
+
+def reachable_mask(candidates, start, time_limit, departure_hour):
+    """Candidates whose opening hours can be met on a trip leaving start at
+    departure_hour: driving there directly (the earliest possible arrival),
+    waiting for opening if needed, the visit must end by closing time and
+    within the time limit.
+    """
+    travel = travel_hours(
+        haversine_vectorized(start['Latitude'], start['Longitude'],
+                             candidates['Latitude'].values, candidates['Longitude'].values),
+        start['Longitude'], candidates['Longitude'].values, departure_hour
+    )
+    visit = candidates['AvgVisitTimeHrs'].values
+    wait = wait_hours(departure_hour + travel, visit,
+                      candidates['OpenHour'].values, candidates['CloseHour'].values)
+    # NaN waits (closed) compare False
+    return travel + wait + visit <= time_limit
+
+def selection_step(number, attraction, total_time, total_cost, time_limit, budget, feasible_options, top_candidates):
+    """Explanation record of one pick; total_time and total_cost are the totals before it"""
+    return {
+        'step': number,
+        'attraction_id': attraction.name,
+        'selected_attraction': attraction['Name'],
+        'category': attraction['Category'],
+        'cost': f"LKR {attraction['Cost']:,}" if attraction['Cost'] > 0 else "FREE",
+        'visit_time': f"{attraction['AvgVisitTimeHrs']:.1f} hours",
+        'popularity': f"{attraction['Popularity']}/10",
+        'crowded': attraction['Crowded'],
+        'travel_time': f"{attraction['travel_time']:.1f} hours",
+        'wait_time': f"{attraction.get('wait_time', 0):.1f} hours",
+        'total_time_so_far': f"{total_time + attraction['total_time']:.1f} hours",
+        'total_cost_so_far': f"LKR {total_cost + attraction['Cost']:,}",
+        'budget_remaining': f"LKR {budget - (total_cost + attraction['Cost']):,}",
+        'time_remaining': f"{time_limit - (total_time + attraction['total_time']):.1f} hours",
+        'feasible_options': feasible_options,
+        'top_candidates': format_top_candidates_for_users(top_candidates)
+    }
+
+# Weights of value per hour, value per LKR, hybrid score and value per budget share
+# in the greedy's efficiency_score
+EFFICIENCY_WEIGHTS = (0.4, 0.3, 0.2, 0.1)
+
+def iter_greedy_selection(candidates, start, time_limit, budget, top_k_candidates=3, selection_steps=None,
+                          departure_hour=None):
+    """Greedy selection over prepared candidates, yielding (attraction, selection_step)
+    as soon as each attraction is picked. Steps are also appended to selection_steps if given.
+    With departure_hour (hour of day at the start) each leg's travel time follows
+    the time-of-day speed tables of travel_time.py, and attractions are only
+    picked if the visit fits their opening hours (waiting time counts).
+    """
     # ===== IMPROVED GREEDY SELECTION ALGORITHM =====
     selected = []
     total_time = 0
     total_cost = 0
     current = start
-    remaining = constraint_filtered.copy()
-    selection_steps = []  #Track selection process for explanation
+    remaining = candidates.copy()
+    if selection_steps is None:
+        selection_steps = []  #Track selection process for explanation
     
     while not remaining.empty:
         # Calculate travel time from current location to each remaining attraction
-        remaining['travel_time'] = remaining.apply(
-            lambda x: estimate_travel_time_km(haversine_distance(current, x)), axis=1
-        )
+        if departure_hour is None:
+            remaining['travel_time'] = remaining.apply(
+                lambda x: estimate_travel_time_km(haversine_distance(current, x)), axis=1
+            )
+        else:
+            # NEW: Speeds for the hour we leave the current stop
+            remaining['travel_time'] = travel_hours(
+                haversine_vectorized(current['Latitude'], current['Longitude'],
+                                     remaining['Latitude'].values, remaining['Longitude'].values),
+                current['Longitude'], remaining['Longitude'].values, departure_hour + total_time
+            )
         remaining['total_time'] = remaining['travel_time'] + remaining['AvgVisitTimeHrs']
+        if departure_hour is not None:
+            # NEW: Wait for opening time; NaN (closed by the end of the visit) is never feasible
+            remaining['wait_time'] = wait_hours(
+                departure_hour + total_time + remaining['travel_time'].values, remaining['AvgVisitTimeHrs'].values,
+                remaining['OpenHour'].values, remaining['CloseHour'].values
+            )
+            remaining['total_time'] += remaining['wait_time']
         
         # NEW: Calculate efficiency metrics for better selection
         remaining['value_time_ratio'] = remaining['hybrid_score'] / remaining['total_time']
@@ -228,11 +364,12 @@ def hybrid_recommend(
         remaining['value_budget_ratio'] = remaining['hybrid_score'] / (remaining['Cost'] / budget + 0.01)
         
         # NEW: Combined efficiency score that considers multiple factors
+        time_weight, cost_weight, score_weight, budget_weight = EFFICIENCY_WEIGHTS
         remaining['efficiency_score'] = (
-            0.4 * remaining['value_time_ratio'] + 
-            0.3 * remaining['value_cost_ratio'] + 
-            0.2 * remaining['hybrid_score'] +
-            0.1 * remaining['value_budget_ratio']
+            time_weight * remaining['value_time_ratio'] + 
+            cost_weight * remaining['value_cost_ratio'] + 
+            score_weight * remaining['hybrid_score'] +
+            budget_weight * remaining['value_budget_ratio']
         )
         
         # Filter attractions that fit within constraints
@@ -256,22 +393,11 @@ def hybrid_recommend(
         next_idx = best_candidate.name
         
         # Store selection step for explanation
-        selection_steps.append({
-            'step': len(selected) + 1,
-            'selected_attraction': best_candidate['Name'],
-            'category': best_candidate['Category'],
-            'cost': f"LKR {best_candidate['Cost']:,}" if best_candidate['Cost'] > 0 else "FREE",
-            'visit_time': f"{best_candidate['AvgVisitTimeHrs']:.1f} hours",
-            'popularity': f"{best_candidate['Popularity']}/10",
-            'crowded': best_candidate['Crowded'],
-            'travel_time': f"{best_candidate['travel_time']:.1f} hours",
-            'total_time_so_far': f"{total_time + best_candidate['total_time']:.1f} hours",
-            'total_cost_so_far': f"LKR {total_cost + best_candidate['Cost']:,}",
-            'budget_remaining': f"LKR {budget - (total_cost + best_candidate['Cost']):,}",
-            'time_remaining': f"{time_limit - (total_time + best_candidate['total_time']):.1f} hours",
-            'feasible_options': len(feasible_attractions),
-            'top_candidates': format_top_candidates_for_users(top_candidates)
-        })
+        step = selection_step(
+            len(selected) + 1, best_candidate, total_time, total_cost, time_limit, budget,
+            len(feasible_attractions), top_candidates
+        )
+        selection_steps.append(step)
         
         # Add selected attraction to itinerary
         next_attraction = remaining.loc[next_idx]
@@ -280,26 +406,789 @@ def hybrid_recommend(
         total_cost += next_attraction['Cost']
         current = next_attraction
         remaining = remaining.drop(next_idx)
-    
-    # Add selection steps to explanation data
-    explanation_data['selection_steps'] = selection_steps
-    
+        yield next_attraction, step
+
+# Temporary scoring columns removed from returned itineraries
+TEMP_COLUMNS = [
+    'cluster', 'content_score', 'hybrid_score', 'travel_time', 'wait_time', 'total_time',
+    'value_time_ratio', 'value_cost_ratio', 'value_budget_ratio', 'efficiency_score'
+]
+
+def selection_to_frame(selected):
+    """Itinerary DataFrame from picked attraction rows, without scoring columns"""
+    if not selected:
+        return pd.DataFrame([])
+    result = pd.DataFrame(selected)
+    result = result.drop(columns=TEMP_COLUMNS, errors='ignore')
+    return result.reset_index(drop=True)
+
+def hybrid_recommend(
+    data,
+    selected_categories,
+    time_limit,
+    budget,
+    crowded_preference,
+    user_location=None,
+    top_k_candidates=3,
+    return_explanation_data=False,  # NEW: Return data for XAI explanation
+    catalog=None,  # Optional Catalog: reuse its precomputed text vectors and clusters
+    selection='greedy',  # One of SELECTION_METHODS: 'greedy', or exact 'dp' / 'cpsat'
+    departure_hour=None  # Hour of day the trip starts: time-of-day travel times (greedy only)
+):
+    with span('recommend', categories=len(selected_categories), catalog=catalog is not None):
+        prepared = prepare_candidates(
+            data, selected_categories, time_limit, budget, crowded_preference, user_location, catalog,
+            departure_hour
+        )
+        if prepared is None:
+            set_attrs(picks=0)
+            if return_explanation_data:
+                return pd.DataFrame([]), {}
+            return pd.DataFrame([])
+
+        candidates, start, explanation_data = prepared
+        explanation_data['selection'] = {'method': selection}
+        with span('recommend.greedy' if selection == 'greedy' else 'recommend.exact',
+                  candidates=len(candidates), method=selection):
+            selected = [
+                attraction for attraction, _ in iter_selection(
+                    candidates, start, time_limit, budget, selection, top_k_candidates,
+                    selection_steps=explanation_data['selection_steps'],
+                    info=explanation_data['selection'],
+                    departure_hour=departure_hour
+                )
+            ]
+        set_attrs(picks=len(selected))
+
     # Return results
-    if selected:
-        result = pd.DataFrame(selected)
-        # Clean up temporary columns
-        columns_to_drop = [
-            'cluster', 'content_score', 'hybrid_score', 'travel_time', 'total_time',
-            'value_time_ratio', 'value_cost_ratio', 'value_budget_ratio', 'efficiency_score'
-        ]
-        result = result.drop(columns=columns_to_drop, errors='ignore')
-        result = result.reset_index(drop=True)
-        
-        if return_explanation_data:
-            explanation_data['final_route'] = result
-            return result, explanation_data
-        return result
+    result = selection_to_frame(selected)
+    if return_explanation_data:
+        return result, explanation_data
+    return result
+
+
+def greedy_select_batch(
+    latitudes,
+    longitudes,
+    visit_hours,
+    costs,
+    hybrid_scores,
+    start_latitudes,
+    start_longitudes,
+    time_limits,
+    budgets,
+    active=None,
+    weights=None,
+    crowd_penalty=None,
+    crowded=None,
+    departure_hours=None,
+    open_hours=None,
+    close_hours=None
+):
+    """Vectorized version of the greedy selection loop in hybrid_recommend.
+
+    Runs the same efficiency-score greedy for many profiles at once over one
+    shared candidate set. `hybrid_scores` is (profiles x candidates); the start
+    arrays, time limits and budgets have one entry per profile.
+    Optional per-profile trade-offs: `weights` (profiles x 4) replaces
+    EFFICIENCY_WEIGHTS, and `crowd_penalty` (per profile, 0-1) scales down the
+    efficiency of candidates flagged in `crowded` (per candidate, 0/1).
+    With `departure_hours` (hour of day each profile starts) travel times follow
+    the time-of-day speed tables of travel_time.py, and `open_hours` /
+    `close_hours` (per candidate) limit picks to visits that fit opening hours.
+    Returns a list of picked candidate positions (in pick order) per profile.
+    """
+    hybrid_scores = np.asarray(hybrid_scores, dtype=float)
+    n_profiles, n_candidates = hybrid_scores.shape
+    time_limits = np.asarray(time_limits, dtype=float)[:, np.newaxis]
+    budgets = np.asarray(budgets, dtype=float)[:, np.newaxis]
+    cur_lat = np.asarray(start_latitudes, dtype=float).copy()
+    cur_lon = np.asarray(start_longitudes, dtype=float).copy()
+    active = np.ones(n_profiles, dtype=bool) if active is None else np.asarray(active, dtype=bool).copy()
+    if departure_hours is not None:
+        departure_hours = np.asarray(departure_hours, dtype=float)
+
+    total_time = np.zeros(n_profiles)
+    total_cost = np.zeros(n_profiles)
+    remaining = np.ones((n_profiles, n_candidates), dtype=bool)
+    picks = [[] for _ in range(n_profiles)]
+    rows = np.arange(n_profiles)
+
+    if weights is None:
+        time_weight, cost_weight, score_weight, budget_weight = EFFICIENCY_WEIGHTS
     else:
-        if return_explanation_data:
-            return pd.DataFrame([]), explanation_data
-        return pd.DataFrame([])
\ No newline at end of file
+        time_weight, cost_weight, score_weight, budget_weight = np.asarray(weights, dtype=float).T[:, :, np.newaxis]
+    crowd_factor = None
+    if crowd_penalty is not None:
+        crowd_factor = 1 - np.asarray(crowd_penalty, dtype=float)[:, np.newaxis] * np.asarray(crowded, dtype=float)
+
+    # Cost terms do not depend on the current position, so compute them once
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value_cost_ratio = hybrid_scores / (costs + 0.01)
+        value_budget_ratio = hybrid_scores / (costs / budgets + 0.01)
+    static_score = cost_weight * value_cost_ratio + score_weight * hybrid_scores + budget_weight * value_budget_ratio
+
+    for _ in range(n_candidates):
+        if not active.any():
+            break
+        travel_time = travel_hours(
+            haversine_vectorized(
+                cur_lat[:, np.newaxis], cur_lon[:, np.newaxis], latitudes[np.newaxis, :], longitudes[np.newaxis, :]
+            ),
+            cur_lon[:, np.newaxis], longitudes[np.newaxis, :],
+            None if departure_hours is None else departure_hours[:, np.newaxis] + total_time[:, np.newaxis]
+        )
+        step_time = travel_time + visit_hours
+        if departure_hours is not None and open_hours is not None:
+            # Waiting for opening counts; NaN (closed) steps are never feasible
+            step_time = step_time + wait_hours(
+                departure_hours[:, np.newaxis] + total_time[:, np.newaxis] + travel_time, visit_hours,
+                open_hours, close_hours
+            )
+        with np.errstate(divide='ignore', invalid='ignore'):
+            efficiency_score = time_weight * (hybrid_scores / step_time) + static_score
+        if crowd_factor is not None:
+            efficiency_score = efficiency_score * crowd_factor
+
+        feasible = (
+            remaining
+            & active[:, np.newaxis]
+            & (total_time[:, np.newaxis] + step_time <= time_limits)
+            & (total_cost[:, np.newaxis] + costs <= budgets)
+        )
+        has_pick = feasible.any(axis=1)
+        active &= has_pick
+        if not active.any():
+            break
+
+        # Like nlargest, NaN scores (e.g. zero budget) rank below every other feasible option
+        ranking = np.where(np.isnan(efficiency_score), -np.finfo(float).max, efficiency_score)
+        best = np.where(feasible, ranking, -np.inf).argmax(axis=1)
+        chosen = rows[active]
+        chosen_idx = best[active]
+        for profile, idx in zip(chosen, chosen_idx):
+            picks[profile].append(int(idx))
+        total_time[chosen] += step_time[chosen, chosen_idx]
+        total_cost[chosen] += costs[chosen_idx]
+        remaining[chosen, chosen_idx] = False
+        cur_lat[chosen] = latitudes[chosen_idx]
+        cur_lon[chosen] = longitudes[chosen_idx]
+
+    return picks
+
+def hybrid_recommend_batch(catalog, profiles, chunk_size=1024):
+    """Recommend itineraries for many user profiles in one pass.
+
+    - catalog: a Catalog (see catalog.py)
+    - profiles: iterable of (selected_categories, time_limit, budget, crowded_preference, user_location),
+      optionally followed by a departure hour (see greedy_select_batch)
+    Content scores for all profiles come from one sparse matrix product, cluster
+    results are shared per crowd filter and the greedy selection runs vectorized
+    across profiles. Returns one DataFrame per profile, like hybrid_recommend.
+    """
+    profiles = list(profiles)
+    with span('recommend.batch', profiles=len(profiles)):
+        return _hybrid_recommend_batch(catalog, profiles, chunk_size)
+
+def _hybrid_recommend_batch(catalog, profiles, chunk_size):
+    data = catalog.data
+    results = [pd.DataFrame([]) for _ in profiles]
+    if not profiles:
+        return results
+
+    categories = data['Category'].values
+    latitudes = data['Latitude'].values.astype(float)
+    longitudes = data['Longitude'].values.astype(float)
+    visit_hours = data['AvgVisitTimeHrs'].values.astype(float)
+    costs = data['Cost'].values.astype(float)
+    open_hours = data['OpenHour'].values.astype(float)
+    close_hours = data['CloseHour'].values.astype(float)
+
+    # Group profiles by crowd filter so each cluster result is looked up once,
+    # and by whether they give a departure hour (time-of-day travel times)
+    groups = {}
+    for i, profile in enumerate(profiles):
+        timed = len(profile) > 5 and profile[5] is not None
+        groups.setdefault((profile[3], timed), []).append(i)
+
+    for (crowded_preference, timed), members in groups.items():
+        cluster_state = catalog.cluster_state(crowded_preference)
+        candidate_pos = np.flatnonzero(crowd_mask(data, crowded_preference))
+        labels = cluster_state['labels'].loc[data.index[candidate_pos]]
+        cluster_bonus = 0.2 * (labels == labels.mode()[0]).values
+
+        for chunk_start in range(0, len(members), chunk_size):
+            chunk = members[chunk_start:chunk_start + chunk_size]
+
+            # Content scores for the whole chunk in one matrix product (TF-IDF or LSA)
+            category_masks = np.array([np.isin(categories, list(profiles[i][0])) for i in chunk])
+            with span('recommend.content_scores', source='batch', profiles=len(chunk)):
+                content_scores = catalog.profile_scores(category_masks, positions=candidate_pos)
+            hybrid_scores = content_scores + cluster_bonus
+
+            start_lat = np.empty(len(chunk))
+            start_lon = np.empty(len(chunk))
+            for j, i in enumerate(chunk):
+                user_location = profiles[i][4]
+                if user_location is not None:
+                    start_lat[j], start_lon[j] = user_location
+                else:
+                    start_lat[j], start_lon[j] = latitudes[candidate_pos[0]], longitudes[candidate_pos[0]]
+
+            with span('recommend.greedy_batch', profiles=len(chunk), candidates=len(candidate_pos)):
+                picks = greedy_select_batch(
+                    latitudes[candidate_pos],
+                    longitudes[candidate_pos],
+                    visit_hours[candidate_pos],
+                    costs[candidate_pos],
+                    hybrid_scores,
+                    start_lat,
+                    start_lon,
+                    time_limits=[profiles[i][1] for i in chunk],
+                    budgets=[profiles[i][2] for i in chunk],
+                    # Profiles whose categories match nothing get no itinerary
+                    active=category_masks.any(axis=1),
+                    departure_hours=[profiles[i][5] for i in chunk] if timed else None,
+                    open_hours=open_hours[candidate_pos],
+                    close_hours=close_hours[candidate_pos],
+                )
+            for i, profile_picks in zip(chunk, picks):
+                if profile_picks:
+                    results[i] = data.iloc[candidate_pos[profile_picks]].reset_index(drop=True)
+
+    return results
+
+def candidate_arrays(catalog, selected_categories, crowded_preference, user_location=None):
+    """Candidate positions in catalog.data with their hybrid scores, latitudes,
+    longitudes, visit hours and costs as arrays, plus the (lat, lon) start
+    """
+    data = catalog.data
+    candidate_pos = np.flatnonzero(crowd_mask(data, crowded_preference))
+    labels = catalog.cluster_state(crowded_preference)['labels'].loc[data.index[candidate_pos]]
+    hybrid_scores = (
+        catalog.content_scores(selected_categories)[candidate_pos]
+        + 0.2 * (labels == labels.mode()[0]).values
+    )
+    latitudes = data['Latitude'].values.astype(float)[candidate_pos]
+    longitudes = data['Longitude'].values.astype(float)[candidate_pos]
+    visit_hours = data['AvgVisitTimeHrs'].values.astype(float)[candidate_pos]
+    costs = data['Cost'].values.astype(float)[candidate_pos]
+    # Without a location the first candidate is the starting point, as in hybrid_recommend
+    start = tuple(user_location) if user_location is not None else (latitudes[0], longitudes[0])
+    return candidate_pos, hybrid_scores, latitudes, longitudes, visit_hours, costs, start
+
+def greedy_select_sweep(latitudes, longitudes, visit_hours, costs, hybrid_scores, start, time_limits, budget,
+                        departure_hour=None, open_hours=None, close_hours=None):
+    """Greedy selection (as in hybrid_recommend) for several time limits at one budget.
+
+    Runs share their state as long as they make the same picks: each node of the
+    search scores the remaining candidates once, and the time limits branch off
+    only where their best feasible pick differs. `start` is (lat, lon).
+    With departure_hour, travel times and opening hours are handled as in
+    greedy_select_batch.
+    Returns a list of picked candidate positions (in pick order) per time limit.
+    """
+    n_candidates = len(hybrid_scores)
+    results = [None] * len(time_limits)
+    time_weight, cost_weight, score_weight, budget_weight = EFFICIENCY_WEIGHTS
+    with np.errstate(divide='ignore', invalid='ignore'):
+        static_score = (
+            cost_weight * (hybrid_scores / (costs + 0.01))
+            + score_weight * hybrid_scores
+            + budget_weight * (hybrid_scores / (costs / budget + 0.01))
+        )
+
+    # Travel times from a position to every candidate, shared across branches
+    travel_rows = {}
+    def travel_from(position):
+        if position not in travel_rows:
+            lat, lon = start if position is None else (latitudes[position], longitudes[position])
+            travel_rows[position] = estimate_travel_time_km(haversine_vectorized(lat, lon, latitudes, longitudes))
+        return travel_rows[position]
+
+    def step_hours(position, total_time):
+        """Hours of travelling from position to each candidate and visiting it"""
+        if departure_hour is None:
+            return travel_from(position) + visit_hours
+        # Timed steps depend on the clock, so they are not shared
+        lat, lon = start if position is None else (latitudes[position], longitudes[position])
+        clock = departure_hour + total_time
+        travel = travel_hours(haversine_vectorized(lat, lon, latitudes, longitudes), lon, longitudes, clock)
+        # Waiting for opening counts; NaN (closed) steps are never feasible
+        return travel + visit_hours + wait_hours(clock + travel, visit_hours, open_hours, close_hours)
+
+    # Each node: (current position, remaining mask, total time, total cost, picks, time limit indices)
+    stack = [(None, np.ones(n_candidates, dtype=bool), 0.0, 0.0, [], list(range(len(time_limits))))]
+    while stack:
+        current, remaining, total_time, total_cost, picks, members = stack.pop()
+        step_time = step_hours(current, total_time)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            efficiency_score = time_weight * (hybrid_scores / step_time) + static_score
+        # Like nlargest, NaN scores (e.g. zero budget) rank below every other feasible option
+        ranking = np.where(np.isnan(efficiency_score), -np.finfo(float).max, efficiency_score)
+        affordable = remaining & (total_cost + costs <= budget)
+
+        branches = {}
+        for member in members:
+            feasible = affordable & (total_time + step_time <= time_limits[member])
+            if not feasible.any():
+                results[member] = picks
+                continue
+            best = int(np.where(feasible, ranking, -np.inf).argmax())
+            branches.setdefault(best, []).append(member)
+
+        for best, branch_members in branches.items():
+            next_remaining = remaining.copy()
+            next_remaining[best] = False
+            stack.append((
+                best, next_remaining, total_time + step_time[best], total_cost + costs[best],
+                picks + [best], branch_members
+            ))
+    return results
+
+def hybrid_recommend_sweep(
+    catalog,
+    selected_categories,
+    crowded_preference,
+    time_limits,
+    budgets,
+    user_location=None,
+    departure_hour=None
+):
+    """What-if sweep: the hybrid_recommend itinerary for every (time_limit, budget) pair.
+
+    Content scores, clusters and travel times are computed once for the whole
+    grid, and within a budget the greedy runs for all time limits share their
+    common prefix (see greedy_select_sweep). departure_hour applies time-of-day
+    speeds and opening hours, as in hybrid_recommend. Returns a compact frontier:
+    - 'time_limits', 'budgets': the grid axes
+    - 'itineraries': distinct results, each {'ids', 'score', 'cost', 'hours'},
+      where hours is visit plus estimated travel time (and waits for opening)
+    - 'grid': (budgets x time_limits) array of indices into itineraries (-1: none)
+    """
+    time_limits = [float(t) for t in time_limits]
+    budgets = [float(b) for b in budgets]
+    data = catalog.data
+    frontier = {
+        'time_limits': time_limits,
+        'budgets': budgets,
+        'itineraries': [],
+        'grid': np.full((len(budgets), len(time_limits)), -1, dtype=np.int32),
+    }
+    if not data['Category'].isin(selected_categories).any():
+        return frontier
+
+    with span('recommend.sweep', points=len(time_limits) * len(budgets)):
+        candidate_pos, hybrid_scores, latitudes, longitudes, visit_hours, costs, start = candidate_arrays(
+            catalog, selected_categories, crowded_preference, user_location
+        )
+        open_hours = data['OpenHour'].values.astype(float)[candidate_pos]
+        close_hours = data['CloseHour'].values.astype(float)[candidate_pos]
+
+        seen = {}
+        for b, budget in enumerate(budgets):
+            runs = greedy_select_sweep(
+                latitudes, longitudes, visit_hours, costs, hybrid_scores, start, time_limits, budget,
+                departure_hour, open_hours, close_hours
+            )
+            for t, picks in enumerate(runs):
+                if not picks:
+                    continue
+                key = tuple(picks)
+                if key not in seen:
+                    # Hours as accumulated by the greedy: travel to each pick, any wait and its visit
+                    legs, waits = route_timeline(
+                        latitudes, longitudes, visit_hours, start, picks, departure_hour, open_hours, close_hours
+                    )
+                    seen[key] = len(frontier['itineraries'])
+                    frontier['itineraries'].append({
+                        'ids': data.index[candidate_pos[picks]].tolist(),
+                        'score': float(hybrid_scores[picks].sum()),
+                        'cost': float(costs[picks].sum()),
+                        'hours': float((legs + waits + visit_hours[picks]).sum()),
+                    })
+                frontier['grid'][b, t] = seen[key]
+        set_attrs(itineraries=len(frontier['itineraries']))
+    return frontier
+
+# Trade-offs explored by hybrid_recommend_pareto: EFFICIENCY_WEIGHTS plus every
+# split of the four weights in quarters, each at these crowd penalties
+PARETO_WEIGHT_STEP = 0.25
+PARETO_CROWD_PENALTIES = (0.0, 0.5, 0.9)
+# Objectives of a Pareto itinerary, all minimized (the score negated)
+PARETO_OBJECTIVES = ('score', 'cost', 'travel_hours', 'crowded_stops')
+
+def pareto_weight_grid(step=PARETO_WEIGHT_STEP, crowd_penalties=PARETO_CROWD_PENALTIES):
+    """(weights, crowd_penalty) rows: the default weights first, then every
+    split of the four efficiency weights into multiples of step
+    """
+    units = int(round(1 / step))
+    splits = [EFFICIENCY_WEIGHTS] + [
+        (a * step, b * step, c * step, (units - a - b - c) * step)
+        for a in range(units + 1) for b in range(units + 1 - a) for c in range(units + 1 - a - b)
+    ]
+    return [(weights, penalty) for penalty in crowd_penalties for weights in splits]
+
+def pareto_mask(objectives):
+    """Rows of an (itineraries x objectives) array, all minimized, that no other row dominates"""
+    objectives = np.asarray(objectives, dtype=float)
+    no_worse = (objectives[:, np.newaxis, :] <= objectives[np.newaxis, :, :]).all(axis=2)
+    better = (objectives[:, np.newaxis, :] < objectives[np.newaxis, :, :]).any(axis=2)
+    return ~(no_worse & better).any(axis=0)
+
+def hybrid_recommend_pareto(
+    catalog,
+    selected_categories,
+    time_limit,
+    budget,
+    crowded_preference,
+    user_location=None,
+    weight_grid=None,
+    departure_hour=None
+):
+    """Pareto set of itineraries over total hybrid score, cost, travel time and
+    crowded stops, for one request.
+
+    The greedy runs once per trade-off of pareto_weight_grid (or weight_grid), all
+    in one greedy_select_batch call over shared scores; identical and dominated
+    itineraries are dropped. departure_hour applies time-of-day speeds and
+    opening hours, as in hybrid_recommend. Returns a list of {'ids', 'score', 'cost',
+    'travel_hours', 'visit_hours', 'crowded_stops', 'weights', 'crowd_penalty'},
+    best score first.
+    """
+    data = catalog.data
+    if not data['Category'].isin(selected_categories).any():
+        return []
+    grid = pareto_weight_grid() if weight_grid is None else list(weight_grid)
+
+    with span('recommend.pareto', profiles=len(grid)):
+        candidate_pos, hybrid_scores, latitudes, longitudes, visit_hours, costs, start = candidate_arrays(
+            catalog, selected_categories, crowded_preference, user_location
+        )
+        crowded = (data['Crowded'].values[candidate_pos] == 'Yes').astype(float)
+        open_hours = data['OpenHour'].values.astype(float)[candidate_pos]
+        close_hours = data['CloseHour'].values.astype(float)[candidate_pos]
+        runs = greedy_select_batch(
+            latitudes, longitudes, visit_hours, costs,
+            np.broadcast_to(hybrid_scores, (len(grid), len(hybrid_scores))),
+            np.full(len(grid), start[0]), np.full(len(grid), start[1]),
+            time_limits=np.full(len(grid), float(time_limit)),
+            budgets=np.full(len(grid), float(budget)),
+            weights=[weights for weights, _ in grid],
+            crowd_penalty=[penalty for _, penalty in grid],
+            crowded=crowded,
+            departure_hours=None if departure_hour is None else np.full(len(grid), float(departure_hour)),
+            open_hours=open_hours,
+            close_hours=close_hours,
+        )
+
+        itineraries = {}
+        for (weights, penalty), picks in zip(grid, runs):
+            # Sets rather than orders: the route is optimized afterwards anyway
+            key = frozenset(picks)
+            if not picks or key in itineraries:
+                continue
+            itineraries[key] = {
+                'ids': data.index[candidate_pos[picks]].tolist(),
+                'score': float(hybrid_scores[picks].sum()),
+                'cost': float(costs[picks].sum()),
+                'travel_hours': float(route_timeline(
+                    latitudes, longitudes, visit_hours, start, picks, departure_hour, open_hours, close_hours
+                )[0].sum()),
+                'visit_hours': float(visit_hours[picks].sum()),
+                'crowded_stops': int(crowded[picks].sum()),
+                'weights': tuple(float(w) for w in weights),
+                'crowd_penalty': float(penalty),
+            }
+        itineraries = list(itineraries.values())
+        if itineraries:
+            objectives = [
+                [-it['score'], it['cost'], it['travel_hours'], it['crowded_stops']] for it in itineraries
+            ]
+            itineraries = [it for it, keep in zip(itineraries, pareto_mask(objectives)) if keep]
+        itineraries.sort(key=lambda it: -it['score'])
+        set_attrs(itineraries=len(itineraries))
+    return itineraries
+
+# Selection methods of hybrid_recommend: the efficiency-score greedy, or the best
+# total hybrid score under the time and budget limits (see exact_selection.py)
+SELECTION_METHODS = ('greedy', 'dp', 'cpsat')
+
+def arrival_hours(latitudes, longitudes, start):
+    """Shortest possible travel time (hours) into each candidate, from the start
+    or any other candidate: a lower bound on its incoming leg in every route.
+    """
+    from scipy.spatial import cKDTree
+
+    # Nearest other candidate by chord length between points on the unit sphere,
+    # which ranks like the great-circle distance and converts to it exactly
+    lat, lon = np.radians(latitudes), np.radians(longitudes)
+    points = np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+    chords, _ = cKDTree(points).query(points, k=2)
+    nearest_km = 2 * 6371 * np.arcsin(np.clip(chords[:, 1] / 2, 0, 1))
+    from_start_km = haversine_vectorized(start[0], start[1], latitudes, longitudes)
+    return estimate_travel_time_km(np.minimum(nearest_km, from_start_km))
+
+def route_legs(latitudes, longitudes, start, order):
+    """Travel time (hours) of each leg when visiting candidates in order from start"""
+    lats = np.concatenate([[start[0]], latitudes[order]])
+    lons = np.concatenate([[start[1]], longitudes[order]])
+    return estimate_travel_time_km(haversine_vectorized(lats[:-1], lons[:-1], lats[1:], lons[1:]))
+
+def route_timeline(latitudes, longitudes, visit_hours, start, order, departure_hour=None,
+                   open_hours=None, close_hours=None):
+    """(travel hours of each leg, wait for opening at each stop) when visiting
+    candidates in order from start. Without departure_hour this is route_legs and
+    no waits; with it each leg uses the speed of the hour it starts and the wait
+    is NaN where the visit cannot end by closing time."""
+    if departure_hour is None:
+        return route_legs(latitudes, longitudes, start, order), np.zeros(len(order))
+    lats = np.concatenate([[start[0]], latitudes[order]])
+    lons = np.concatenate([[start[1]], longitudes[order]])
+    distances = haversine_vectorized(lats[:-1], lons[:-1], lats[1:], lons[1:])
+    legs = np.zeros(len(order))
+    waits = np.zeros(len(order))
+    clock = float(departure_hour)
+    for i, position in enumerate(order):
+        legs[i] = travel_hours(distances[i], lons[i], lons[i + 1], clock)
+        clock += legs[i]
+        waits[i] = wait_hours(clock, visit_hours[position], open_hours[position], close_hours[position])
+        if np.isnan(waits[i]):
+            waits[i:] = np.nan  # The rest of the route starts too late to tell
+            break
+        clock += waits[i] + visit_hours[position]
+    return legs, waits
+
+def insertion_hours(latitudes, longitudes, visit_hours, start, order, position):
+    """Extra route hours of visiting `position` at each insertion point of order
+    (index i: before order[i]; the last index appends it)
+    """
+    lats = np.concatenate([[start[0]], latitudes[order]])
+    lons = np.concatenate([[start[1]], longitudes[order]])
+    into = estimate_travel_time_km(haversine_vectorized(lats, lons, latitudes[position], longitudes[position]))
+    out_of = np.append(estimate_travel_time_km(haversine_vectorized(
+        latitudes[position], longitudes[position], lats[1:], lons[1:]
+    )), 0.0)
+    replaced = np.append(estimate_travel_time_km(haversine_vectorized(lats[:-1], lons[:-1], lats[1:], lons[1:])), 0.0)
+    return into + visit_hours[position] + out_of - replaced
+
+def fit_route(latitudes, longitudes, visit_hours, costs, values, start, picks, time_limit, budget,
+              departure_hour=None, open_hours=None, close_hours=None):
+    """Turn a knapsack selection into a visiting order that fits time_limit.
+
+    Picks are ordered by nearest neighbour from start; while the route (travel
+    plus visits, as counted by the greedy) is too long, the pick with the least
+    value per hour saved is dropped. Leftover candidates are then inserted at
+    their cheapest position, best value first, while they still fit.
+    With departure_hour, travel follows the time of day, waits for opening count
+    and a route that reaches a stop too late to finish the visit does not fit
+    (see route_timeline).
+    Returns (order, dropped, added).
+    """
+    order = []
+    remaining = list(picks)
+    current = start
+    while remaining:
+        distances = haversine_vectorized(current[0], current[1], latitudes[remaining], longitudes[remaining])
+        order.append(remaining.pop(int(np.argmin(distances))))
+        current = (latitudes[order[-1]], longitudes[order[-1]])
+
+    def route_hours(order):
+        legs, waits = route_timeline(
+            latitudes, longitudes, visit_hours, start, order, departure_hour, open_hours, close_hours
+        )
+        hours = float((legs + waits + visit_hours[order]).sum())
+        return np.inf if np.isnan(hours) else hours
+
+    dropped = 0
+    hours = route_hours(order)
+    while order and hours > time_limit + 1e-9:
+        if departure_hour is None:
+            saved = np.array([
+                insertion_hours(latitudes, longitudes, visit_hours, start, order[:i] + order[i + 1:], order[i])[i]
+                for i in range(len(order))
+            ])
+        else:
+            # Exact savings: infinite where dropping the stop lets a closed stop be reached in time
+            with np.errstate(invalid='ignore'):
+                saved = hours - np.array([route_hours(order[:i] + order[i + 1:]) for i in range(len(order))])
+            saved = np.where(np.isnan(saved), 0.0, saved)
+        with np.errstate(divide='ignore'):
+            order.pop(int(np.argmin(values[order] / saved)))
+        dropped += 1
+        hours = route_hours(order)
+
+    added = 0
+    cost = float(costs[order].sum())
+    in_route = np.zeros(len(values), dtype=bool)
+    in_route[order] = True
+    leftovers = np.flatnonzero(~in_route & np.isfinite(values) & (values > 0))
+    for position in leftovers[np.argsort(-values[leftovers], kind='stable')]:
+        if cost + costs[position] > budget or hours + visit_hours[position] > time_limit:
+            continue
+        extra = insertion_hours(latitudes, longitudes, visit_hours, start, order, position)
+        if departure_hour is None:
+            best = int(np.argmin(extra))
+            if hours + extra[best] <= time_limit:
+                order.insert(best, int(position))
+                hours += float(extra[best])
+                cost += float(costs[position])
+                added += 1
+            continue
+        # Timed: the cheapest insertion point that keeps every visit within opening hours
+        for best in np.argsort(extra, kind='stable'):
+            candidate = order[:best] + [int(position)] + order[best:]
+            candidate_hours = route_hours(candidate)
+            if candidate_hours <= time_limit:
+                order, hours = candidate, candidate_hours
+                cost += float(costs[position])
+                added += 1
+                break
+    return order, dropped, added
+
+def select_exact(latitudes, longitudes, visit_hours, costs, hybrid_scores, start, time_limit, budget,
+                 method='dp', max_seconds=None, departure_hour=None, open_hours=None, close_hours=None):
+    """Candidate positions (in visiting order) with the best total hybrid score
+    within time_limit and budget, chosen as a 2-D knapsack ('dp' or 'cpsat').
+
+    Travel depends on the order, so a candidate's time weight is its visit time
+    plus its shortest possible incoming leg (arrival_hours); fit_route then makes
+    the chosen set an actual route within the limits (and, with departure_hour,
+    within the opening hours).
+    Returns (positions, info) with the solver status and objective.
+    """
+    from exact_selection import CPSAT_MAX_SECONDS, knapsack_cpsat, knapsack_dp
+
+    hybrid_scores = np.asarray(hybrid_scores, dtype=float)
+    time_weights = visit_hours + arrival_hours(latitudes, longitudes, start)
+    if method == 'dp':
+        picks, info = knapsack_dp(hybrid_scores, time_weights, costs, time_limit, budget)
+    elif method == 'cpsat':
+        picks, info = knapsack_cpsat(
+            hybrid_scores, time_weights, costs, time_limit, budget,
+            max_seconds=CPSAT_MAX_SECONDS if max_seconds is None else max_seconds
+        )
+    else:
+        raise ValueError(f"Unknown selection method: {method!r}")
+    order, info['dropped'], info['added'] = fit_route(
+        latitudes, longitudes, visit_hours, costs, hybrid_scores, start, picks, time_limit, budget,
+        departure_hour, open_hours, close_hours
+    )
+    return order, info
+
+def iter_exact_selection(candidates, start, time_limit, budget, method='dp', selection_steps=None, info=None,
+                         departure_hour=None):
+    """Exact selection over prepared candidates, yielding (attraction, selection_step)
+    in visiting order like iter_greedy_selection. Solver details are added to info if given.
+    With departure_hour the route keeps to opening hours (see fit_route).
+    """
+    if selection_steps is None:
+        selection_steps = []
+    latitudes = candidates['Latitude'].to_numpy(dtype=float)
+    longitudes = candidates['Longitude'].to_numpy(dtype=float)
+    visit_hours = candidates['AvgVisitTimeHrs'].to_numpy(dtype=float)
+    costs = candidates['Cost'].to_numpy(dtype=float)
+    start_point = (float(start['Latitude']), float(start['Longitude']))
+    open_hours = close_hours = None
+    if departure_hour is not None:
+        open_hours = candidates['OpenHour'].to_numpy(dtype=float)
+        close_hours = candidates['CloseHour'].to_numpy(dtype=float)
+
+    order, result = select_exact(
+        latitudes, longitudes, visit_hours, costs, candidates['hybrid_score'].to_numpy(dtype=float),
+        start_point, time_limit, budget, method,
+        departure_hour=departure_hour, open_hours=open_hours, close_hours=close_hours
+    )
+    if info is not None:
+        info.update(result)
+
+    total_time = 0
+    total_cost = 0
+    current = start_point
+    unvisited = np.ones(len(candidates), dtype=bool)
+    legs, waits = route_timeline(
+        latitudes, longitudes, visit_hours, start_point, order, departure_hour, open_hours, close_hours
+    )
+    for number, (position, leg, wait) in enumerate(zip(order, legs, waits), 1):
+        # Options that would still have fit at this point of the route
+        distances = haversine_vectorized(current[0], current[1], latitudes, longitudes)
+        if departure_hour is None:
+            step_time = estimate_travel_time_km(distances) + visit_hours
+        else:
+            # As in the greedy: speeds for the hour we leave, plus any wait for opening (NaN never fits)
+            clock = departure_hour + total_time
+            travel = travel_hours(distances, current[1], longitudes, clock)
+            step_time = travel + visit_hours + wait_hours(clock + travel, visit_hours, open_hours, close_hours)
+        feasible_options = int((
+            unvisited & (total_time + step_time <= time_limit) & (total_cost + costs <= budget)
+        ).sum())
+
+        attraction = candidates.iloc[position].copy()
+        attraction['travel_time'] = leg
+        attraction['wait_time'] = wait
+        attraction['total_time'] = leg + wait + visit_hours[position]
+        step = selection_step(
+            number, attraction, total_time, total_cost, time_limit, budget,
+            feasible_options, candidates.iloc[[position]]
+        )
+        selection_steps.append(step)
+        total_time += attraction['total_time']
+        total_cost += attraction['Cost']
+        current = (latitudes[position], longitudes[position])
+        unvisited[position] = False
+        yield attraction, step
+
+def iter_selection(candidates, start, time_limit, budget, selection='greedy', top_k_candidates=3,
+                   selection_steps=None, info=None, departure_hour=None):
+    """iter_greedy_selection or iter_exact_selection, by selection method"""
+    if selection == 'greedy':
+        return iter_greedy_selection(
+            candidates, start, time_limit, budget, top_k_candidates, selection_steps, departure_hour
+        )
+    if selection in SELECTION_METHODS:
+        return iter_exact_selection(
+            candidates, start, time_limit, budget, selection, selection_steps, info, departure_hour
+        )
+    raise ValueError(f"Unknown selection method: {selection!r}")
+
+def compare_selection(
+    data,
+    selected_categories,
+    time_limit,
+    budget,
+    crowded_preference,
+    user_location=None,
+    methods=SELECTION_METHODS,
+    catalog=None,
+    departure_hour=None
+):
+    """Run each selection method on the same prepared candidates and report one
+    row per method: attractions, total hybrid score, cost, hours (travel, waits
+    and visits in pick order), runtime_ms and solver status.
+    """
+    prepared = prepare_candidates(
+        data, selected_categories, time_limit, budget, crowded_preference, user_location, catalog,
+        departure_hour
+    )
+    if prepared is None:
+        return []
+    candidates, start, _ = prepared
+    rows = []
+    for method in methods:
+        info = {'status': 'HEURISTIC'} if method == 'greedy' else {}
+        began = time.perf_counter()
+        with span('recommend.compare', method=method):
+            picked = [attraction for attraction, _ in iter_selection(
+                candidates, start, time_limit, budget, method, info=info, departure_hour=departure_hour
+            )]
+        runtime_ms = (time.perf_counter() - began) * 1000
+        rows.append({
+            'method': method,
+            'attractions': len(picked),
+            'score': float(sum(a['hybrid_score'] for a in picked)),
+            'cost': float(sum(a['Cost'] for a in picked)),
+            'hours': float(sum(a['total_time'] for a in picked)),
+            'runtime_ms': runtime_ms,
+            'status': info.get('status'),
+        })
+    return rows
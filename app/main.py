@@ -1,10 +1,18 @@
+import os
+import pandas as pd
 import streamlit as st
-from data_loader import load_data
-from route_optimizer import optimize_route
+from catalog import load_catalog
 from map_visualizer import display_map
+from metrics import collect, counters
+from profiling import profile_request, profiling_enabled
+from opening_hours import always_open, format_opening_hours
+from pipeline import iterate_stream, plan_itinerary_stream
+from popular import POPULAR_ENABLED, PopularItineraries, budget_band
+from result_cache import ResultCache
+from hybrid_recommender import compare_selection, hybrid_recommend_pareto, hybrid_recommend_sweep
+from route_result import route_frame, route_result, stop_columns
 from streamlit_geolocation import streamlit_geolocation
-from hybrid_recommender import hybrid_recommend
-from xai import XAIExplainer
+from xai import XAIExplainer, greedy_plan, selected_ids
 
 # Page configuration with custom theme
 st.set_page_config(
@@ -229,8 +237,32 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Load data
-data = load_data()
+# Load the catalog once per server process; its derived models are shared across sessions
+@st.cache_resource
+def get_catalog():
+    return load_catalog()
+
+# Itineraries for the most common requests, planned in the background once per process
+# (opt-in with PLANNER_POPULAR=1: a build takes tens of CPU seconds)
+@st.cache_resource
+def get_popular_itineraries():
+    return PopularItineraries(get_catalog()).start()
+
+# Recommendation results keyed by the snapped location and rounded request, shared by sessions
+@st.cache_resource
+def get_result_cache():
+    return ResultCache()
+
+catalog = get_catalog()
+data = catalog.data
+popular = get_popular_itineraries() if POPULAR_ENABLED else None
+
+# Sidebar labels of hybrid_recommender.SELECTION_METHODS
+SELECTION_OPTIONS = {
+    "Quick pick (greedy)": 'greedy',
+    "Best fit (dynamic programming)": 'dp',
+    "Best fit (CP-SAT solver)": 'cpsat',
+}
 
 # Sidebar for mobile-friendly input organization
 with st.sidebar:
@@ -253,6 +285,14 @@ with st.sidebar:
         index=0,
         help="Select your available time for sightseeing"
     )
+    start_options = ["Not sure"] + [f"{hour}:00" for hour in range(5, 21)]
+    start_label = st.selectbox(
+        "When do you set off?",
+        start_options,
+        index=start_options.index("9:00"),
+        help="Travel times account for rush-hour traffic at this time of day"
+    )
+    start_hour = None if start_label == "Not sure" else int(start_label.split(':')[0])
     
     # Budget input
     st.markdown("#### 💰 **Budget**")
@@ -272,6 +312,17 @@ with st.sidebar:
         help="Choose based on your preference for tourist density"
     )
 
+    # Selection method
+    st.markdown("#### 🧮 **Selection**")
+    selection_label = st.selectbox(
+        "How should attractions be chosen?",
+        list(SELECTION_OPTIONS),
+        index=0,
+        help="Best fit searches for the highest total match within your time and budget; "
+             "it can take a little longer than the quick pick"
+    )
+    selection = SELECTION_OPTIONS[selection_label]
+
 # Convert crowded preference to boolean
 crowded_bool = None
 if crowded_preference == "Yes":
@@ -318,6 +369,7 @@ with col2:
         st.markdown(f"**Duration:** {time_limit} hours")
     else:
         st.markdown("**Duration:** Not set")
+    st.markdown(f"**Start:** {start_label}")
     
     st.markdown(f"**Budget:** LKR {budget:,}")
     st.markdown(f"**Crowd Preference:** {crowded_preference}")
@@ -332,25 +384,71 @@ if st.button("🚀 Generate Personalized Itinerary", key="generate_btn"):
     elif time_limit == 0:
         st.error("⚠️ Please set your available time")
     else:
-        with st.spinner("🔍 Finding the perfect attractions for you..."):
-            recs, explanation_data = hybrid_recommend(
-                data, category, time_limit, budget, crowded_bool, user_location,
-                return_explanation_data=True
-            )
-            
-            if recs.empty:
-                st.warning("😔 No attractions found matching your preferences. Try adjusting your filters!")
-                st.session_state['route'] = None
-                st.session_state['explanation_data'] = None
-            else:
-                with st.spinner("🗺️ Optimizing your route..."):
-                    st.session_state['route'] = optimize_route(recs, time_limit, start_location=user_location)
-                    st.session_state['explanation_data'] = explanation_data  # NEW: Store explanation data
-                    attractionCount = len(st.session_state['route'])
-                    # if Your Location is included, remove it from count
-                    if 'Your Location' in st.session_state['route']['Name'].values:
-                        attractionCount -= 1
-                st.success(f"🎉 Found {attractionCount} amazing places for you!")
+        popular_plan = popular.lookup(
+            category, time_limit, budget, crowded_bool, user_location, selection, start_hour
+        ) if popular is not None else None
+        if popular_plan is not None:
+            # Common request: planned in advance for this catalog version
+            st.session_state['route'] = popular_plan['route']
+            st.session_state['route_geometry'] = popular_plan['geometry']
+            st.session_state['explanation_data'] = popular_plan['explanation_data']
+            st.session_state['selection_comparison'] = None
+            st.session_state['trace'] = []
+            st.caption(f"⚡ Ready-made plan for a popular trip (planned for a LKR {budget_band(budget):,} budget)")
+        else:
+            # Stream stages as they finish: picks are shown as soon as they are made and
+            # road geometry is prefetched while selection and routing are still running
+            st.session_state['route'] = None
+            st.session_state['route_geometry'] = None
+            st.session_state['explanation_data'] = None
+            st.session_state['selection_comparison'] = None
+            with st.status("🔍 Finding the perfect attractions for you...", expanded=True) as status:
+                # Clicking stop reruns the script, which ends planning and keeps the picks so far
+                st.button("⏹️ Stop and keep current picks", key="stop_btn")
+                # Stage timings of this request, shown in the debug panel; with PLANNER_PROFILE=1
+                # or ?profile=1 the request is also profiled (CPU and memory) to profiles/
+                with collect() as spans, profile_request(
+                    'plan', enabled=profiling_enabled(st.query_params), include_threads=True
+                ) as profile_report:
+                    stream = plan_itinerary_stream(
+                        catalog, category, time_limit, budget, crowded_bool, user_location, selection=selection,
+                        departure_hour=start_hour, result_cache=get_result_cache()
+                    )
+                    picked_ids = []
+                    for stage, payload in iterate_stream(stream):
+                        if stage == 'candidates':
+                            st.session_state['explanation_data'] = payload  # NEW: Store explanation data
+                        elif stage == 'pick':
+                            attraction, step = payload
+                            # Picks so far, in pick order, kept if the user stops planning
+                            picked_ids.append(step['attraction_id'])
+                            st.session_state['route'] = route_result(catalog, picked_ids, user_location, start_hour)
+                            st.markdown(
+                                f"**{step['step']}. {step['selected_attraction']}** ({step['category']}) "
+                                f"· {step['visit_time']} · {step['cost']} · 🚗 {step['travel_time']}"
+                            )
+                        elif stage == 'recommendations':
+                            recs, explanation_data = payload
+                            if recs.empty:
+                                break
+                            st.session_state['explanation_data'] = explanation_data
+                            status.update(label="🗺️ Optimizing your route...")
+                        elif stage == 'route':
+                            st.session_state['route'] = payload
+                            status.update(label="🛣️ Fetching road directions...")
+                        elif stage == 'geometry':
+                            st.session_state['route_geometry'] = payload
+                st.session_state['trace'] = spans
+                if profile_report:
+                    st.caption(f"🧪 Profile saved to {profile_report['summary']}")
+                status.update(label="✅ Itinerary ready", state="complete", expanded=False)
+
+        if st.session_state['route'] is None:
+            st.warning("😔 No attractions found matching your preferences. Try adjusting your filters!")
+            st.session_state['explanation_data'] = None
+        else:
+            attractionCount = st.session_state['route']['totals']['attractions']
+            st.success(f"🎉 Found {attractionCount} amazing places for you!")
 
 st.markdown('</div>', unsafe_allow_html=True)
 
@@ -360,20 +458,22 @@ if st.session_state['route'] is not None:
     st.markdown("### 🗺️ Your Personalized Itinerary")
     
     # Create tabs for different views
-    tab1, tab2, tab3 = st.tabs(["📍 Attraction Details", "🗺️ Route Map", "🤖 AI Explanation"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(
+        ["📍 Attraction Details", "🗺️ Route Map", "🤖 AI Explanation", "🔀 What If?", "⚖️ Trade-offs"]
+    )
 
     with tab1:
         # NEW: Attraction Details Tab
         st.markdown("### 📍 Your Selected Attractions")
         st.markdown("*Detailed information about each attraction in your itinerary*")
         
-        if len(st.session_state['route']) > 0:
-            # Create info cards for each attraction
-            for idx, attraction in st.session_state['route'].iterrows():
-                # Skip if this is the starting location marker
-                if attraction['Name'] == 'Your Location':
-                    continue
-                    
+        route = st.session_state['route']
+        if route['totals']['attractions'] > 0:
+            # Create info cards for each attraction, read by position from the shared catalog arrays
+            stops = stop_columns(catalog, route)
+            for i in range(len(stops['Name'])):
+                attraction = {column: values[i] for column, values in stops.items()}
+
                 # Create expandable card for each attraction
                 with st.expander(f"🏛️ **{attraction['Name']}** - {attraction['Category']}", expanded=True):
                     # Create columns for better layout
@@ -383,6 +483,10 @@ if st.session_state['route'] is not None:
                         # Description
                         st.markdown("**📖 Description:**")
                         st.markdown(f"{attraction['Description']}")
+                        if not always_open(attraction.get('OpenHour', 0), attraction.get('CloseHour', 24)):
+                            st.caption(f"🕘 Open {format_opening_hours(attraction['OpenHour'], attraction['CloseHour'])}")
+                        if attraction['leg_hours'] > 0:
+                            st.caption(f"🚗 {attraction['leg_hours']:.1f} hours from the previous stop")
                         
                     
                     with col2:
@@ -425,15 +529,12 @@ if st.session_state['route'] is not None:
             st.markdown("---")
             st.markdown("### 📊 Trip Summary")
 
-            route_excl_location = st.session_state['route']
-            # create a new dataframe excluding 'Your Location'
-            if 'Your Location' in st.session_state['route']['Name'].values:
-                route_excl_location = st.session_state['route'][st.session_state['route']['Name'] != 'Your Location']
-            # Calculate totals
-            total_cost = route_excl_location['Cost'].sum()
-            total_time = route_excl_location['AvgVisitTimeHrs'].sum()
-            avg_popularity = route_excl_location['Popularity'].mean()
-            total_attractions = len(route_excl_location)
+            # Totals are computed once, when the route is made
+            totals = route['totals']
+            total_cost = totals['cost']
+            total_time = totals['visit_hours']
+            avg_popularity = totals['avg_popularity']
+            total_attractions = totals['attractions']
 
             
             # Display summary metrics
@@ -474,7 +575,9 @@ if st.session_state['route'] is not None:
 
     with tab2:
         # Map display
-        display_map(st.session_state['route'])
+        with collect() as map_spans, profile_request('map', enabled=profiling_enabled(st.query_params)):
+            display_map(route_frame(catalog, st.session_state['route']), st.session_state.get('route_geometry'))
+        st.session_state['map_trace'] = map_spans
     
     with tab3:
         # NEW: XAI Explanation Tab
@@ -484,13 +587,41 @@ if st.session_state['route'] is not None:
             
             st.markdown("## 🤖 How the AI Made Your Recommendations")
             
-            # Decision factors
-            explainer.show_decision_factors(
-                st.session_state['route'],
-                explanation_data['filtered_data']
-            )
+            # Decision factors; computed once per itinerary from ids and scores over the shared catalog
+            explainer.show_decision_factors(catalog.data, explanation_data, catalog.version)
+
+            # Detailed view: every candidate's scores, rebuilt from the catalog only when opened
+            with st.expander("🔬 All scored candidates"):
+                explainer.show_candidate_scores(catalog.data, explanation_data)
             
             st.markdown("---")
+
+            # Quick pick vs. best fit on the same request: quality and runtime side by side
+            with st.expander("⚖️ Compare selection methods"):
+                if st.button("Run comparison", key="compare_btn"):
+                    st.session_state['selection_comparison'] = compare_selection(
+                        catalog.data, explanation_data['selected_categories'], explanation_data['time_limit'],
+                        explanation_data['budget'], explanation_data['crowded_preference'],
+                        explanation_data['user_location'], catalog=catalog,
+                        departure_hour=explanation_data.get('departure_hour')
+                    )
+                comparison = st.session_state.get('selection_comparison')
+                if comparison:
+                    labels = {method: label for label, method in SELECTION_OPTIONS.items()}
+                    st.table([
+                        {
+                            "Method": labels.get(row['method'], row['method']),
+                            "Attractions": row['attractions'],
+                            "Total match": f"{row['score']:.2f}",
+                            "Cost": f"LKR {row['cost']:,.0f}",
+                            "Hours": f"{row['hours']:.1f}",
+                            "Runtime": f"{row['runtime_ms']:.0f} ms",
+                            "Status": row['status'],
+                        }
+                        for row in comparison
+                    ])
+
+            st.markdown("---")
             
             # Selection process explanation
             if 'selection_steps' in explanation_data:
@@ -508,6 +639,7 @@ if st.session_state['route'] is not None:
                             - ⭐ **Popularity**: {step['popularity']}
                             - 👥 **Crowded**: {step['crowded']}
                             - 🚗 **Travel Time**: {step['travel_time']}
+                            - ⏳ **Wait for Opening**: {step['wait_time']}
 
                             """)
                         
@@ -531,8 +663,162 @@ if st.session_state['route'] is not None:
         else:
             st.info("🤖 Generate an itinerary first to see AI explanations!")
 
+    with tab4:
+        # What-if sweep: itineraries for nearby time/budget values, computed once per itinerary
+        explanation_data = st.session_state.get('explanation_data')
+        if explanation_data and greedy_plan(explanation_data):
+            base_time = explanation_data['time_limit']
+            base_budget = explanation_data['budget']
+            hour_steps = [-2, -1, 0, 1, 2, 3, 4]
+            budget_steps = [-2000, -1000, 0, 1000, 2000, 5000]
+            sweep_key = (catalog.version, base_time, base_budget, tuple(explanation_data['selected_categories']),
+                         explanation_data['crowded_preference'], explanation_data['user_location'],
+                         explanation_data.get('departure_hour'))
+            if st.session_state.get('what_if_key') != sweep_key:
+                st.session_state['what_if'] = hybrid_recommend_sweep(
+                    catalog,
+                    explanation_data['selected_categories'],
+                    explanation_data['crowded_preference'],
+                    time_limits=[max(base_time + h, 1) for h in hour_steps],
+                    budgets=[max(base_budget + b, 0) for b in budget_steps],
+                    user_location=explanation_data['user_location'],
+                    departure_hour=explanation_data.get('departure_hour'),
+                )
+                st.session_state['what_if_key'] = sweep_key
+            frontier = st.session_state['what_if']
+
+            st.markdown("### 🔀 What would I get with more (or less)?")
+            col1, col2 = st.columns(2)
+            with col1:
+                extra_hours = st.select_slider(
+                    "⏰ Extra hours", options=hour_steps, value=0, format_func=lambda h: f"{h:+d} h"
+                )
+            with col2:
+                extra_budget = st.select_slider(
+                    "💰 Extra budget", options=budget_steps, value=0, format_func=lambda b: f"LKR {b:+,}"
+                )
+
+            current = frontier['grid'][budget_steps.index(0), hour_steps.index(0)]
+            chosen = frontier['grid'][budget_steps.index(extra_budget), hour_steps.index(extra_hours)]
+            if chosen < 0:
+                st.info("😔 No attractions fit these limits.")
+            else:
+                itinerary = frontier['itineraries'][chosen]
+                current_ids = frontier['itineraries'][current]['ids'] if current >= 0 else []
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("🏛️ Attractions", len(itinerary['ids']),
+                              f"{len(itinerary['ids']) - len(current_ids):+d} vs current")
+                with col2:
+                    st.metric("💰 Total Cost", f"LKR {itinerary['cost']:,.0f}")
+                with col3:
+                    st.metric("⏱️ Time incl. travel", f"{itinerary['hours']:.1f} hours")
+
+                names = catalog.data['Name']
+                added = [names.at[i] for i in itinerary['ids'] if i not in current_ids]
+                dropped = [names.at[i] for i in current_ids if i not in itinerary['ids']]
+                st.markdown("**Itinerary:** " + " → ".join(names.at[i] for i in itinerary['ids']))
+                if added:
+                    st.markdown("➕ **Added:** " + ", ".join(added))
+                if dropped:
+                    st.markdown("➖ **Dropped:** " + ", ".join(dropped))
+                if chosen == current:
+                    st.caption("Same itinerary as your current plan.")
+        elif explanation_data:
+            st.info("🔀 What-if scenarios follow the default (greedy) selection. Switch to it to explore them!")
+        else:
+            st.info("🔀 Generate an itinerary first to explore what-if scenarios!")
+
+    with tab5:
+        # Pareto set over match, cost, driving and crowds, computed once per itinerary
+        explanation_data = st.session_state.get('explanation_data')
+        if explanation_data and greedy_plan(explanation_data):
+            pareto_key = (catalog.version, explanation_data['time_limit'], explanation_data['budget'],
+                          tuple(explanation_data['selected_categories']),
+                          explanation_data['crowded_preference'], explanation_data['user_location'],
+                          explanation_data.get('departure_hour'))
+            if st.session_state.get('pareto_key') != pareto_key:
+                st.session_state['pareto'] = hybrid_recommend_pareto(
+                    catalog,
+                    explanation_data['selected_categories'],
+                    explanation_data['time_limit'],
+                    explanation_data['budget'],
+                    explanation_data['crowded_preference'],
+                    user_location=explanation_data['user_location'],
+                    departure_hour=explanation_data.get('departure_hour'),
+                )
+                st.session_state['pareto_key'] = pareto_key
+            options = st.session_state['pareto']
+
+            st.markdown("### ⚖️ Other ways to spend your day")
+            st.markdown("*None of these is beaten by another on every count: match, cost, driving and crowds.*")
+            if not options:
+                st.info("😔 No alternative itineraries fit your limits.")
+            else:
+                # Name each option after the objective it is best at; number the others
+                labels = [None] * len(options)
+                for name, best in [
+                    ("Fewest crowds", min(range(len(options)), key=lambda i: options[i]['crowded_stops'])),
+                    ("Least driving", min(range(len(options)), key=lambda i: options[i]['travel_hours'])),
+                    ("Lowest cost", min(range(len(options)), key=lambda i: options[i]['cost'])),
+                    ("Best match", 0),
+                ]:
+                    labels[best] = name
+                balanced = iter(range(1, len(options) + 1))
+                labels = [label or f"Balanced option {next(balanced)}" for label in labels]
+                choice = st.radio(
+                    "Pick a trade-off",
+                    range(len(options)),
+                    format_func=lambda i: (
+                        f"{labels[i]} · {len(options[i]['ids'])} stops · LKR {options[i]['cost']:,.0f} · "
+                        f"🚗 {options[i]['travel_hours']:.1f} h · 👥 {options[i]['crowded_stops']} crowded"
+                    ),
+                )
+                option = options[choice]
+                current_ids = selected_ids(explanation_data)
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("🎯 Match score", f"{option['score']:.2f}")
+                with col2:
+                    st.metric("💰 Total Cost", f"LKR {option['cost']:,.0f}")
+                with col3:
+                    st.metric("🚗 Driving", f"{option['travel_hours']:.1f} hours")
+                with col4:
+                    st.metric("👥 Crowded stops", option['crowded_stops'])
+
+                names = catalog.data['Name']
+                st.markdown("**Attractions:** " + ", ".join(names.at[i] for i in option['ids'] if i in names.index))
+                added = [names.at[i] for i in option['ids'] if i not in current_ids and i in names.index]
+                dropped = [names.at[i] for i in current_ids if i not in option['ids'] and i in names.index]
+                if added:
+                    st.markdown("➕ **Not in your plan:** " + ", ".join(added))
+                if dropped:
+                    st.markdown("➖ **Left out:** " + ", ".join(dropped))
+                if not added and not dropped:
+                    st.caption("Same attractions as your current plan.")
+        elif explanation_data:
+            st.info("⚖️ Trade-offs are explored with the default (greedy) selection. Switch to it to compare them!")
+        else:
+            st.info("⚖️ Generate an itinerary first to compare trade-offs!")
+
     st.markdown('</div>', unsafe_allow_html=True)
 
+# Debug panel: per-stage timings and counters, enabled with PLANNER_DEBUG=1 or ?debug=1
+if os.getenv('PLANNER_DEBUG') == '1' or st.query_params.get('debug') == '1':
+    with st.sidebar:
+        with st.expander("🛠️ Debug: stage timings", expanded=False):
+            trace = st.session_state.get('trace', []) + st.session_state.get('map_trace', [])
+            if trace:
+                st.dataframe(pd.DataFrame([
+                    {'stage': s['span'], 'parent': s['parent'], 'ms': s['duration_ms'],
+                     'details': ", ".join(f"{k}={v}" for k, v in s['attrs'].items())}
+                    for s in trace
+                ]), hide_index=True)
+            else:
+                st.caption("Generate an itinerary to see its stage timings.")
+            st.markdown("**Counters (this server process)**")
+            st.json(counters())
+
 # Footer
 st.markdown("---")
 st.markdown("""
@@ -1,42 +1,123 @@
-import folium
-import streamlit as st
-import openrouteservice as ors
+import logging
 import os
-from dotenv import load_dotenv
+import threading
+from collections import OrderedDict
+from metrics import increment, span
 
-load_dotenv()
+# folium, openrouteservice and dotenv are imported on first use to keep startup fast
+
+logger = logging.getLogger(__name__)
+
+_env_loaded = False
+
+def load_env():
+    """Load .env (ORS settings) once, on the first ORS request"""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+def ors_configured():
+    """True if an ORS API key or base URL is set (in the environment or .env)"""
+    load_env()
+    return bool(os.getenv('OPENROUTESERVICE_API_KEY') or os.getenv('OPENROUTESERVICE_BASE_URL'))
+
+# LRU cache of road geometry per leg; only successful ORS responses are stored
+GEOMETRY_CACHE_SIZE = 4096
+_geometry_cache = OrderedDict()
+_geometry_cache_lock = threading.Lock()
+
+def geometry_cache_key(start_coords, end_coords):
+    """Cache key for a leg; ~1 m precision so float noise does not cause misses"""
+    return (round(float(start_coords[0]), 5), round(float(start_coords[1]), 5),
+            round(float(end_coords[0]), 5), round(float(end_coords[1]), 5))
+
+def cached_route_between_points(start_coords, end_coords):
+    """Cached geometry for a leg, or None if it has not been fetched yet"""
+    key = geometry_cache_key(start_coords, end_coords)
+    with _geometry_cache_lock:
+        if key in _geometry_cache:
+            _geometry_cache.move_to_end(key)
+            increment('geometry_cache', result='hit')
+            return _geometry_cache[key]
+    increment('geometry_cache', result='miss')
+    return None
+
+def clear_geometry_cache():
+    with _geometry_cache_lock:
+        _geometry_cache.clear()
 
 def get_route_between_points(start_coords, end_coords):
     """
     Get actual road route between two points using OpenRouteService
     """
+    cached = cached_route_between_points(start_coords, end_coords)
+    if cached is not None:
+        return cached
+    return fetch_route_between_points(start_coords, end_coords)
+
+def fetch_route_between_points(start_coords, end_coords):
+    """Road route between two points from OpenRouteService, without looking in the
+    cache first (for callers that already did); the response is cached"""
+    route_coords = try_route_between_points(start_coords, end_coords)
+    # Fallback to straight line if API fails
+    return route_coords if route_coords is not None else [start_coords, end_coords]
+
+def try_route_between_points(start_coords, end_coords):
+    """fetch_route_between_points, but None if the ORS request fails"""
     try:
+        import openrouteservice as ors
+
+        load_env()
         api_key = os.getenv('OPENROUTESERVICE_API_KEY') 
-        client = ors.Client(key=api_key)
+        # OPENROUTESERVICE_BASE_URL points at a self-hosted ORS or a local stand-in
+        base_url = os.getenv('OPENROUTESERVICE_BASE_URL')
+        client = ors.Client(key=api_key, base_url=base_url) if base_url else ors.Client(key=api_key)
         
         # Get route
         coords = [start_coords[::-1], end_coords[::-1]]  # ORS uses [lon, lat]
-        route = client.directions(
-            coordinates=coords,
-            profile='driving-car',
-            format='geojson'
-        )
+        with span('map.ors_request'):
+            route = client.directions(
+                coordinates=coords,
+                profile='driving-car',
+                format='geojson'
+            )
         
         # Extract coordinates
         route_coords = route['features'][0]['geometry']['coordinates']
         # Convert back to [lat, lon]
         route_coords = [[coord[1], coord[0]] for coord in route_coords]
+
+        with _geometry_cache_lock:
+            _geometry_cache[geometry_cache_key(start_coords, end_coords)] = route_coords
+            if len(_geometry_cache) > GEOMETRY_CACHE_SIZE:
+                _geometry_cache.popitem(last=False)
         
         return route_coords
     except Exception as e:
-        # Fallback to straight line if API fails
-        print(f"Route API error: {e}")
-        return [start_coords, end_coords]
+        increment('ors_errors', error=type(e).__name__)
+        logger.warning(f"Route API error: {e}")
+        return None
 
-def display_map(route):
+def route_geometry(points):
+    """Road geometry for consecutive legs of a route.
+    - points: list of [lat, lon]
+    Returns one list of [lat, lon] coordinates per leg.
     """
-    Clean, single implementation of map display with proper sizing
+    with span('map.geometry', legs=max(len(points) - 1, 0)):
+        return [get_route_between_points(points[i], points[i+1]) for i in range(len(points) - 1)]
+
+def build_map(route, geometry=None):
+    """
+    Build the folium map for a route; geometry defaults to route_geometry of its stops
     """
+    with span('map.build', stops=len(route), prefetched=geometry is not None):
+        return _build_map(route, geometry)
+
+def _build_map(route, geometry=None):
+    import folium
+
     # Use the correct column names (case-sensitive)
     lat_col = 'Latitude' if 'Latitude' in route.columns else 'latitude'
     lon_col = 'Longitude' if 'Longitude' in route.columns else 'longitude'
@@ -69,13 +150,9 @@ def display_map(route):
         m = folium.Map(location=[center_lat, center_lon], zoom_start=zoom_level)
         
         # Add actual road routes between consecutive locations
-        for i in range(len(route) - 1):
-            start_point = [route.iloc[i][lat_col], route.iloc[i][lon_col]]
-            end_point = [route.iloc[i+1][lat_col], route.iloc[i+1][lon_col]]
-            
-            # Get actual road route
-            road_route = get_route_between_points(start_point, end_point)
-            
+        if geometry is None:
+            geometry = route_geometry(route[[lat_col, lon_col]].values.tolist())
+        for i, road_route in enumerate(geometry):
             folium.PolyLine(
                 locations=road_route,
                 color='blue',
@@ -104,17 +181,28 @@ def display_map(route):
             tooltip=f"Stop {idx+1}: {row.get('Name', 'Attraction')}",
             icon=folium.Icon(icon='info-sign', color='blue')
         ).add_to(m)
-    
-    # Use st_folium for better integration (if available) or fallback to components
-    try:
-        from streamlit_folium import st_folium
-        # This provides better sizing control
-        st_folium(m, width=None, height=500, returned_objects=["last_clicked"])
-    except ImportError:
-        # Fallback to components with explicit sizing
-        st.components.v1.html(
-            m._repr_html_(),
-            height=600,
-            width=700,
-            scrolling=False
-        )
\ No newline at end of file
+    return m
+
+def display_map(route, geometry=None):
+    """
+    Clean, single implementation of map display with proper sizing
+    """
+    import streamlit as st
+
+    with span('map.display', stops=len(route)):
+        m = build_map(route, geometry)
+
+        # Use st_folium for better integration (if available) or fallback to components
+        with span('map.render'):
+            try:
+                from streamlit_folium import st_folium
+                # This provides better sizing control
+                st_folium(m, width=None, height=500, returned_objects=["last_clicked"])
+            except ImportError:
+                # Fallback to components with explicit sizing
+                st.components.v1.html(
+                    m._repr_html_(),
+                    height=600,
+                    width=700,
+                    scrolling=False
+                )
\ No newline at end of file
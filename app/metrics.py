@@ -0,0 +1,184 @@
+"""Lightweight tracing spans and counters for the planning pipeline.
+
+    with span('route.solve', stops=5):
+        ...
+        set_attrs(status='SUCCESS', objective=1234)
+    increment('geometry_cache', result='hit')
+
+Every finished span is added to a per-name duration histogram, logged as one
+JSON line on the 'planner.trace' logger and, inside `collect()`, appended to
+the list of spans for the current request (used by the Streamlit debug panel).
+`prometheus_text()` renders all histograms and counters in Prometheus text format.
+Worker processes send what they recorded to the parent with `drain()`, and the
+parent adds it to its own registry with `merge()`.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+trace_logger = logging.getLogger('planner.trace')
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_histograms = {}  # span name -> {'buckets': [...], 'count': n, 'sum': s}
+_counters = {}  # (name, sorted label items) -> value
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+_collected = contextvars.ContextVar('collected_spans', default=None)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time a block as a named stage; attributes can be added with set_attrs"""
+    parent = _current_span.get()
+    record = {
+        'span': name,
+        'parent': parent['span'] if parent else None,
+        'attrs': dict(attrs),
+    }
+    token = _current_span.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record['attrs']['error'] = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _current_span.reset(token)
+        record['duration_ms'] = round(duration * 1000, 3)
+        _observe(name, duration)
+        collected = _collected.get()
+        if collected is not None:
+            collected.append(record)
+        if trace_logger.isEnabledFor(logging.INFO):
+            trace_logger.info(json.dumps(record, default=str))
+
+
+def set_attrs(**attrs):
+    """Attach attributes (cache results, solver statistics...) to the current span"""
+    record = _current_span.get()
+    if record is not None:
+        record['attrs'].update(attrs)
+
+
+def increment(name, amount=1, **labels):
+    """Increase a counter, e.g. increment('geometry_cache', result='hit')"""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def _observe(name, seconds):
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = {'buckets': [0] * len(BUCKETS), 'count': 0, 'sum': 0.0}
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram['buckets'][i] += 1
+        histogram['count'] += 1
+        histogram['sum'] += seconds
+
+
+@contextmanager
+def collect():
+    """Collect the spans finished inside this block (including worker threads
+    started with asyncio.to_thread, which copy the context) into a list"""
+    spans = []
+    token = _collected.set(spans)
+    try:
+        yield spans
+    finally:
+        _collected.reset(token)
+
+
+def counters():
+    """Snapshot of all counters as {name: {label string: value}}"""
+    with _lock:
+        items = list(_counters.items())
+    snapshot = {}
+    for (name, labels), value in items:
+        label_text = ",".join(f"{k}={v}" for k, v in labels)
+        snapshot.setdefault(name, {})[label_text] = value
+    return snapshot
+
+
+def drain():
+    """Histograms and counters recorded since the last drain, removed from this
+    process's registry (e.g. returned by a worker process with its result)"""
+    with _lock:
+        delta = {
+            'histograms': {name: dict(h, buckets=list(h['buckets'])) for name, h in _histograms.items()},
+            'counters': dict(_counters),
+        }
+        _histograms.clear()
+        _counters.clear()
+    return delta
+
+
+def merge(delta):
+    """Add a drain() result from another process to this process's registry"""
+    with _lock:
+        for name, other in delta['histograms'].items():
+            histogram = _histograms.get(name)
+            if histogram is None:
+                histogram = _histograms[name] = {'buckets': [0] * len(BUCKETS), 'count': 0, 'sum': 0.0}
+            histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], other['buckets'])]
+            histogram['count'] += other['count']
+            histogram['sum'] += other['sum']
+        for key, value in delta['counters'].items():
+            _counters[key] = _counters.get(key, 0) + value
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text():
+    """All stage histograms and counters in Prometheus text exposition format"""
+    with _lock:
+        histograms = {name: dict(h, buckets=list(h['buckets'])) for name, h in _histograms.items()}
+        counter_items = sorted(_counters.items())
+
+    lines = [
+        '# HELP planner_stage_duration_seconds Duration of pipeline stages.',
+        '# TYPE planner_stage_duration_seconds histogram',
+    ]
+    for name in sorted(histograms):
+        histogram = histograms[name]
+        stage = _escape(name)
+        for bound, count in zip(BUCKETS, histogram['buckets']):
+            lines.append(f'planner_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+        lines.append(f'planner_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'planner_stage_duration_seconds_sum{{stage="{stage}"}} {histogram["sum"]:.6f}')
+        lines.append(f'planner_stage_duration_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+
+    seen = set()
+    for (name, labels), value in counter_items:
+        metric = f"planner_{name}_total"
+        if metric not in seen:
+            lines.append(f'# TYPE {metric} counter')
+            seen.add(metric)
+        label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+        lines.append(f'{metric}{{{label_text}}} {value}' if label_text else f'{metric} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def configure_trace_logging(stream=None):
+    """Emit one JSON line per finished span; on by default when PLANNER_TRACE_LOG=1"""
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    trace_logger.addHandler(handler)
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+
+
+if os.getenv('PLANNER_TRACE_LOG') == '1' and not trace_logger.handlers:
+    configure_trace_logging()
@@ -0,0 +1,53 @@
+"""Opening hours of attractions: OpenHour / CloseHour columns (hours of day).
+
+Values missing from the catalog default by category (DEFAULT_OPENING_HOURS),
+else to 0-24 (always open). Windows only apply to trips with a known start
+hour; clock hours past 24 (after midnight) fall outside every window except
+the always-open one.
+"""
+import numpy as np
+import pandas as pd
+
+OPENING_COLUMNS = ('OpenHour', 'CloseHour')
+ALWAYS_OPEN = (0.0, 24.0)
+# Typical hours by category, for rows without their own
+DEFAULT_OPENING_HOURS = {
+    'Historical': (8.0, 17.0),
+    'Cultural': (8.0, 18.0),
+    'Wildlife': (6.0, 18.0),
+    'Bird Sanctuary': (6.0, 18.0),
+    'Turtle Conservation': (8.0, 18.0),
+    'Water Activity': (7.0, 17.0),
+    'Adventure': (7.0, 18.0),
+    'Surf Camp': (7.0, 19.0),
+}
+
+
+def fill_opening_hours(data):
+    """Add or complete the OpenHour / CloseHour columns of data (in place), returns data"""
+    defaults = data['Category'].map(lambda category: DEFAULT_OPENING_HOURS.get(category, ALWAYS_OPEN))
+    for i, column in enumerate(OPENING_COLUMNS):
+        default = defaults.str[i].astype(float)
+        if column in data.columns:
+            data[column] = pd.to_numeric(data[column], errors='coerce').fillna(default)
+        else:
+            data[column] = default
+    return data
+
+
+def always_open(open_hours, close_hours):
+    """True where the hours cover the whole day"""
+    return (open_hours <= ALWAYS_OPEN[0]) & (close_hours >= ALWAYS_OPEN[1])
+
+
+def wait_hours(arrival_hours, visit_hours, open_hours, close_hours):
+    """Hours to wait for opening after arriving at each clock hour, vectorized;
+    NaN where the visit cannot end by closing time"""
+    wait = np.maximum(open_hours - arrival_hours, 0.0)
+    fits = always_open(open_hours, close_hours) | (arrival_hours + wait + visit_hours <= close_hours)
+    return np.where(fits, wait, np.nan)
+
+
+def format_opening_hours(open_hour, close_hour):
+    """e.g. '08:00–17:30'"""
+    return "–".join(f"{int(h):02d}:{int(round(h % 1 * 60)):02d}" for h in (open_hour, close_hour))
@@ -0,0 +1,239 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+from hybrid_recommender import crowd_mask, iter_selection, prepare_candidates, selection_to_frame
+from map_visualizer import cached_route_between_points, fetch_route_between_points, geometry_cache_key
+from metrics import span
+from result_cache import canonical_request
+from route_optimizer import route_order
+from route_result import route_points, route_result
+
+# Geometry requests run on their own threads so prefetches outlive the event loop
+# that started them and land in map_visualizer's cache either way.
+_geometry_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='geometry')
+_legs_in_flight = {}
+_legs_lock = threading.Lock()
+
+
+def fetch_leg(start_coords, end_coords):
+    """Future with the road geometry of one leg; shares in-flight and cached fetches"""
+    cached = cached_route_between_points(start_coords, end_coords)
+    if cached is not None:
+        future = Future()
+        future.set_result(cached)
+        return future
+
+    key = geometry_cache_key(start_coords, end_coords)
+    with _legs_lock:
+        future = _legs_in_flight.get(key)
+        if future is not None:
+            return future
+        future = _geometry_pool.submit(fetch_route_between_points, list(start_coords), list(end_coords))
+        _legs_in_flight[key] = future
+    # Outside the lock: the callback runs immediately if the fetch already finished
+    future.add_done_callback(lambda _: _legs_done(key))
+    return future
+
+
+def _legs_done(key):
+    with _legs_lock:
+        _legs_in_flight.pop(key, None)
+
+
+def prefetch_legs(points):
+    """Start fetching geometry for consecutive legs of points without waiting"""
+    for i in range(len(points) - 1):
+        fetch_leg(points[i], points[i+1])
+
+
+def _next_pick(picks):
+    """Next greedy pick (or None), timed as its own span"""
+    with span('recommend.pick'):
+        return next(picks, None)
+
+
+def nearest_neighbour_order(points):
+    """Visiting order by nearest neighbour from points[0]; a cheap guess of the solved route"""
+    coords = np.radians(np.asarray(points, dtype=float))
+    order = [0]
+    remaining = list(range(1, len(points)))
+    while remaining:
+        lat, lon = coords[order[-1]]
+        # Equirectangular distance is enough to rank neighbours
+        dx = (coords[remaining, 1] - lon) * np.cos((coords[remaining, 0] + lat) / 2)
+        dy = coords[remaining, 0] - lat
+        order.append(remaining.pop(int(np.argmin(dx**2 + dy**2))))
+    return order
+
+
+def likely_candidates(catalog, selected_categories, time_limit, budget, crowded_preference, top_n):
+    """Coordinates of the attractions most likely to be picked, by content score"""
+    data = catalog.data
+    scores = catalog.content_scores(selected_categories)
+    fits = (
+        crowd_mask(data, crowded_preference)
+        & (data['Cost'].values <= budget)
+        & (data['AvgVisitTimeHrs'].values <= time_limit)
+    )
+    scores = np.where(fits, scores, -np.inf)
+    best = np.argsort(-scores)[:top_n]
+    best = best[np.isfinite(scores[best])]
+    return data[['Latitude', 'Longitude']].values[best].tolist()
+
+
+async def plan_itinerary_stream(
+    catalog,
+    selected_categories,
+    time_limit,
+    budget,
+    crowded_preference,
+    user_location=None,
+    prefetch_top_n=4,
+    selection='greedy',
+    departure_hour=None,
+    result_cache=None
+):
+    """Plan an itinerary, yielding (stage, payload) as soon as each stage is ready.
+
+    Stages, in order:
+    - 'candidates': explanation_data (its selection_steps list grows with each pick)
+    - 'pick': (attraction, selection_step), once per attraction as it is chosen
+    - 'recommendations': (recs, explanation_data), the same result as hybrid_recommend
+    - 'route': the optimized route as a compact route_result.route_result dict
+    - 'geometry': road geometry for each leg of the route
+    Closing the stream early (e.g. the user cancels) stops selection after the
+    current pick. Road geometry for likely legs is prefetched while selection
+    and routing run, so the final geometry stage is mostly cache hits.
+    selection is a hybrid_recommender.SELECTION_METHODS entry; exact methods
+    solve the whole selection in the first pick. departure_hour (hour of day
+    the trip starts) switches travel times to the time-of-day tables.
+    With a result_cache (result_cache.ResultCache), the canonical request (snapped
+    location, time and budget rounded down) is planned and cached; on a hit the
+    stored picks are replayed. The route always starts at user_location.
+    """
+    cached = None
+    planning_location = user_location
+    if result_cache is not None:
+        request = canonical_request({
+            'selected_categories': selected_categories, 'time_limit': time_limit, 'budget': budget,
+            'crowded_preference': crowded_preference, 'user_location': user_location,
+            'selection': selection, 'departure_hour': departure_hour,
+        })
+        selected_categories, time_limit, budget = request['selected_categories'], request['time_limit'], request['budget']
+        planning_location, departure_hour = request['user_location'], request['departure_hour']
+        cache_key = result_cache.key(catalog, request)
+        cached = await asyncio.to_thread(result_cache.get, cache_key)
+        if cached is not None and cached['explanation_data'] is None:
+            cached = None  # Stored without explanation data (by the service)
+
+    if cached is not None:
+        recs, explanation_data = cached['recommendations'], cached['explanation_data']
+        if not recs.empty:
+            yield 'candidates', explanation_data
+            for (_, attraction), step in zip(recs.iterrows(), explanation_data['selection_steps']):
+                yield 'pick', (attraction, step)
+    else:
+        # Speculative prefetch: legs from the start to the best-scoring candidates
+        if user_location is not None:
+            start = list(user_location)
+            for candidate in likely_candidates(
+                catalog, selected_categories, time_limit, budget, crowded_preference, prefetch_top_n
+            ):
+                fetch_leg(start, candidate)
+
+        recs, explanation_data = selection_to_frame([]), {}
+        selection_stream = _select_stream(
+            catalog, selected_categories, time_limit, budget, crowded_preference,
+            planning_location, selection, departure_hour
+        )
+        try:
+            async for stage, payload in selection_stream:
+                if stage == 'selected':
+                    recs, explanation_data = payload
+                else:
+                    yield stage, payload
+        finally:
+            await selection_stream.aclose()
+        if result_cache is not None:
+            # Only reached when selection ran to the end (closing the stream stops it earlier)
+            await asyncio.to_thread(
+                result_cache.put, cache_key, {'recommendations': recs, 'explanation_data': explanation_data}
+            )
+
+    yield 'recommendations', (recs, explanation_data)
+    if recs.empty:
+        return
+
+    # Solve the route and, meanwhile, prefetch legs of the most likely visiting order
+    route_task = asyncio.ensure_future(asyncio.to_thread(
+        route_order, recs, time_limit, start_location=user_location, departure_hour=departure_hour
+    ))
+    points = recs[['Latitude', 'Longitude']].values.tolist()
+    if user_location is not None:
+        points = [list(user_location)] + points
+    prefetch_legs([points[i] for i in nearest_neighbour_order(points)])
+
+    order = await route_task
+    # Rows of recs follow the selection steps, which carry the attraction ids
+    ids = [explanation_data['selection_steps'][i]['attraction_id'] for i in order]
+    route = route_result(catalog, ids, user_location, departure_hour)
+    yield 'route', route
+
+    points = route_points(catalog, route)
+    legs = await asyncio.gather(*(
+        asyncio.wrap_future(fetch_leg(points[i], points[i+1]))
+        for i in range(len(points) - 1)
+    ))
+    yield 'geometry', list(legs)
+
+
+async def _select_stream(
+    catalog, selected_categories, time_limit, budget, crowded_preference, user_location, selection, departure_hour
+):
+    """The 'candidates' and 'pick' stages of plan_itinerary_stream, then
+    ('selected', (recs, explanation_data)) once selection is done"""
+    prepared = await asyncio.to_thread(
+        prepare_candidates, catalog.data, selected_categories, time_limit, budget,
+        crowded_preference, user_location, catalog, departure_hour
+    )
+    if prepared is None:
+        yield 'selected', (selection_to_frame([]), {})
+        return
+    candidates, start, explanation_data = prepared
+    explanation_data['selection'] = {'method': selection}
+    yield 'candidates', explanation_data
+
+    # Each pick is computed off the event loop and streamed as soon as it is made
+    picks = iter_selection(
+        candidates, start, time_limit, budget, selection,
+        selection_steps=explanation_data['selection_steps'],
+        info=explanation_data['selection'],
+        departure_hour=departure_hour
+    )
+    selected = []
+    while True:
+        pick = await asyncio.to_thread(_next_pick, picks)
+        if pick is None:
+            break
+        selected.append(pick[0])
+        yield 'pick', pick
+
+    yield 'selected', (selection_to_frame(selected), explanation_data)
+
+
+def iterate_stream(async_gen):
+    """Consume an async generator from synchronous code (e.g. a Streamlit script)"""
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(async_gen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(async_gen.aclose())
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
@@ -0,0 +1,131 @@
+"""Headless batch planner: JSONL planning requests in, JSONL itineraries out.
+
+Usage:
+    python app/plan_batch.py requests.jsonl results.jsonl [--workers N] [--chunk-size N]
+
+Each input line is a JSON object such as
+    {"id": "guest-1", "categories": ["Beach", "Historical"], "time_limit": 8,
+     "budget": 5000, "crowded": null, "location": [6.03, 80.22]}
+Use "-" for stdin/stdout. Results are written in input order.
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from catalog import load_catalog
+from planning import plan_requests
+
+# Catalog shared by worker processes. With the fork start method it is built once
+# in the parent and inherited copy-on-write; otherwise each worker loads its own.
+_CATALOG = None
+
+
+def warm_catalog(catalog):
+    """Build the catalog's lazy structures before workers start sharing it"""
+    return catalog.warm()
+
+
+def _init_worker():
+    global _CATALOG
+    if _CATALOG is None:
+        _CATALOG = warm_catalog(load_catalog())
+
+
+def _plan_chunk(lines):
+    records = []
+    errors = {}
+    for i, line in enumerate(lines):
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            errors[i] = {'error': f"Invalid JSON: {e}"}
+            continue
+        if not isinstance(record, dict):
+            errors[i] = {'error': "Request must be a JSON object"}
+            continue
+        records.append(record)
+    planned = iter(plan_requests(_CATALOG, records))
+    return [json.dumps(errors[i] if i in errors else next(planned)) for i in range(len(lines))]
+
+
+def read_chunks(stream, chunk_size):
+    """Yield lists of non-empty lines without reading the whole input"""
+    chunk = []
+    for line in stream:
+        if line.strip():
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def run(input_stream, output_stream, workers, chunk_size, max_in_flight, progress_every=5.0):
+    """Plan every request from input_stream and write results to output_stream in order.
+
+    At most max_in_flight chunks are queued or running at once, so memory stays
+    bounded regardless of input size.
+    """
+    global _CATALOG
+    start = time.time()
+    _CATALOG = warm_catalog(load_catalog())
+    print(f"Catalog loaded ({len(_CATALOG.data)} attractions) in {time.time() - start:.1f}s", file=sys.stderr)
+
+    start = time.time()
+    last_report = start
+    done = 0
+    pending = deque()
+
+    def drain_one():
+        nonlocal done, last_report
+        lines = pending.popleft().result()
+        output_stream.write("\n".join(lines) + "\n")
+        done += len(lines)
+        now = time.time()
+        if now - last_report >= progress_every:
+            print(f"{done} requests planned, {done / (now - start):.1f} req/s", file=sys.stderr)
+            last_report = now
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for chunk in read_chunks(input_stream, chunk_size):
+            if len(pending) >= max_in_flight:
+                drain_one()
+            pending.append(pool.submit(_plan_chunk, chunk))
+        while pending:
+            drain_one()
+
+    elapsed = time.time() - start
+    print(f"Done: {done} requests in {elapsed:.1f}s ({done / max(elapsed, 1e-9):.1f} req/s)", file=sys.stderr)
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plan itineraries for a JSONL file of requests")
+    parser.add_argument('input', help="JSONL request file ('-' for stdin)")
+    parser.add_argument('output', help="JSONL result file ('-' for stdout)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes (default: all cores)")
+    parser.add_argument('--chunk-size', type=int, default=32, help="requests per worker task")
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help="max queued chunks (default: 4 x workers)")
+    args = parser.parse_args(argv)
+
+    max_in_flight = args.max_in_flight or 4 * args.workers
+    with contextlib.ExitStack() as stack:
+        input_stream = sys.stdin if args.input == '-' else stack.enter_context(open(args.input, encoding='utf-8'))
+        output_stream = sys.stdout if args.output == '-' else stack.enter_context(
+            open(args.output, 'w', encoding='utf-8'))
+        run(input_stream, output_stream, args.workers, args.chunk_size, max_in_flight)
+
+
+if __name__ == '__main__':
+    # Prefer fork so workers share the parent's catalog copy-on-write
+    if 'fork' in multiprocessing.get_all_start_methods():
+        multiprocessing.set_start_method('fork')
+    main()
@@ -0,0 +1,299 @@
+import math
+import numbers
+
+import pandas as pd
+
+from hybrid_recommender import SELECTION_METHODS, hybrid_recommend, hybrid_recommend_batch
+from map_visualizer import route_geometry
+from result_cache import canonical_request
+from route_optimizer import optimize_route
+
+# Columns returned for each stop of a planned itinerary
+STOP_COLUMNS = ['Name', 'Category', 'Latitude', 'Longitude', 'Cost', 'AvgVisitTimeHrs', 'Popularity', 'Crowded']
+
+CROWDED_VALUES = {None: None, 'No preference': None, 'Yes': True, 'No': False, True: True, False: False}
+# Numeric stop fields of optimize requests and their values when missing (always open by default)
+STOP_NUMBER_DEFAULTS = {'Cost': 0, 'AvgVisitTimeHrs': 0, 'Popularity': 0, 'OpenHour': 0, 'CloseHour': 24}
+
+
+class InvalidRequest(ValueError):
+    """A request record that does not have the expected shape (the service answers 400)"""
+
+
+def parse_number(value, name):
+    """A JSON number of a request record as a float"""
+    if isinstance(value, bool) or not isinstance(value, numbers.Real) or not math.isfinite(value):
+        raise InvalidRequest(f"{name} must be a number, got {value!r}")
+    return float(value)
+
+
+def parse_location(value, name='location'):
+    """A [lat, lon] pair of a request record as a (lat, lon) tuple of floats"""
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise InvalidRequest(f"{name} must be a [lat, lon] pair, got {value!r}")
+    return parse_number(value[0], name), parse_number(value[1], name)
+
+
+def parse_strings(value, name):
+    """A string or list of strings of a request record as a list"""
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise InvalidRequest(f"{name} must be a list of strings, got {value!r}")
+    return list(value)
+
+
+def parse_stop(stop):
+    """A stop of an optimize request with its coordinates and numeric fields checked
+    and missing fields filled in"""
+    if not isinstance(stop, dict):
+        raise InvalidRequest("stops must be a list of objects")
+    parsed = dict(stop)
+    parsed['Latitude'], parsed['Longitude'] = parse_location(
+        [stop.get('Latitude'), stop.get('Longitude')], 'stop Latitude/Longitude'
+    )
+    for column, default in STOP_NUMBER_DEFAULTS.items():
+        value = stop.get(column)
+        parsed[column] = default if value is None else parse_number(value, f"stop {column}")
+    for column in ('Name', 'Category', 'Crowded'):
+        if parsed.get(column) is None:
+            parsed[column] = ''
+    return parsed
+
+
+def parse_request(record):
+    """Normalize a planning request record (e.g. one JSONL line) into recommender arguments.
+
+    Expected keys: categories (list), time_limit (hours), budget (LKR),
+    optional crowded (true/false/"Yes"/"No"/null), location ([lat, lon]),
+    selection ("greedy" (default), or exact "dp" / "cpsat") and start_hour
+    (hour of day the trip starts, 0-24: time-of-day travel times).
+    Raises InvalidRequest if a value is missing or has the wrong type.
+    """
+    if not isinstance(record, dict):
+        raise InvalidRequest("Request must be a JSON object")
+    categories = parse_strings(record.get('categories') or [], 'categories')
+    crowded = record.get('crowded')
+    if not isinstance(crowded, (str, bool, type(None))) or crowded not in CROWDED_VALUES:
+        raise InvalidRequest(f"Invalid crowded preference: {crowded!r}")
+    location = record.get('location')
+    if location is not None:
+        location = parse_location(location)
+    selection = record.get('selection') or 'greedy'
+    if selection not in SELECTION_METHODS:
+        raise InvalidRequest(f"Invalid selection method: {selection!r}")
+    for key in ('time_limit', 'budget'):
+        if key not in record:
+            raise InvalidRequest(f"Missing {key}")
+    return {
+        'selected_categories': categories,
+        'time_limit': parse_number(record['time_limit'], 'time_limit'),
+        'budget': parse_number(record['budget'], 'budget'),
+        'crowded_preference': CROWDED_VALUES[crowded],
+        'user_location': location,
+        'selection': selection,
+        'departure_hour': parse_start_hour(record),
+    }
+
+
+def parse_start_hour(record):
+    """Optional start_hour of a request record as a float in [0, 24], or None"""
+    start_hour = record.get('start_hour')
+    if start_hour is None:
+        return None
+    start_hour = parse_number(start_hour, 'start_hour')
+    if not 0 <= start_hour <= 24:
+        raise InvalidRequest(f"Invalid start hour: {start_hour!r}")
+    return start_hour
+
+
+def recommend_one(catalog, request):
+    """Itinerary for one parsed request: batched greedy, or hybrid_recommend for exact selection"""
+    if request['selection'] != 'greedy':
+        return hybrid_recommend(
+            catalog.data, request['selected_categories'], request['time_limit'], request['budget'],
+            request['crowded_preference'], request['user_location'],
+            catalog=catalog, selection=request['selection'], departure_hour=request['departure_hour']
+        )
+    return hybrid_recommend_batch(catalog, [(
+        request['selected_categories'], request['time_limit'], request['budget'],
+        request['crowded_preference'], request['user_location'], request['departure_hour'],
+    )])[0]
+
+
+def route_to_stops(route):
+    """JSON-friendly list of stops from a route DataFrame"""
+    if route is None or route.empty:
+        return []
+    columns = [c for c in STOP_COLUMNS if c in route.columns]
+    stops = route[columns].to_dict(orient='records')
+    # numpy scalars -> plain Python values, missing values (NaN) -> null
+    return [{k: json_value(v) for k, v in stop.items()} for stop in stops]
+
+
+def json_value(value):
+    value = value.item() if hasattr(value, 'item') else value
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+def summarize_route(route):
+    """Totals for a route, excluding the 'Your Location' start marker"""
+    if route is None or route.empty:
+        return {'attractions': 0, 'total_cost': 0.0, 'total_visit_hours': 0.0}
+    stops = route[route['Name'] != 'Your Location']
+    return {
+        'attractions': int(len(stops)),
+        'total_cost': float(stops['Cost'].sum()),
+        'total_visit_hours': float(stops['AvgVisitTimeHrs'].sum()),
+    }
+
+
+def plan_requests(catalog, records):
+    """Recommend and route a list of request records.
+
+    Greedy recommendations for the whole list come from hybrid_recommend_batch
+    (requests with exact selection are solved one by one); each non-empty
+    itinerary is then ordered with optimize_route. Returns one result dict per
+    record (with an 'error' key for records that could not be parsed).
+    """
+    results = [None] * len(records)
+    parsed = []
+    for i, record in enumerate(records):
+        try:
+            parsed.append((i, parse_request(record)))
+        except InvalidRequest as e:
+            results[i] = {'id': record.get('id') if isinstance(record, dict) else None, 'error': str(e)}
+
+    greedy = [p for _, p in parsed if p['selection'] == 'greedy']
+    batched = iter(hybrid_recommend_batch(catalog, [
+        (p['selected_categories'], p['time_limit'], p['budget'], p['crowded_preference'], p['user_location'],
+         p['departure_hour'])
+        for p in greedy
+    ]))
+    recommendations = [
+        next(batched) if p['selection'] == 'greedy' else recommend_one(catalog, p)
+        for _, p in parsed
+    ]
+
+    for (i, request), recs in zip(parsed, recommendations):
+        if recs.empty:
+            route = recs
+        else:
+            route = optimize_route(
+                recs, request['time_limit'], start_location=request['user_location'],
+                departure_hour=request['departure_hour']
+            )
+        results[i] = {
+            'id': records[i].get('id'),
+            'stops': route_to_stops(route),
+            **summarize_route(route),
+        }
+    return results
+
+
+def cached_recommend(catalog, request, result_cache, explain=False):
+    """{'recommendations': recs, 'explanation_data': ...} for the canonical form of a
+    parsed request (see result_cache.canonical_request), from result_cache when possible.
+    Results computed here without explain store explanation_data None.
+    """
+    request = canonical_request(request)
+    key = result_cache.key(catalog, request)
+    value = result_cache.get(key)
+    if value is None or (explain and value['explanation_data'] is None):
+        if explain:
+            recs, explanation_data = hybrid_recommend(
+                catalog.data, request['selected_categories'], request['time_limit'], request['budget'],
+                request['crowded_preference'], request['user_location'], return_explanation_data=True,
+                catalog=catalog, selection=request['selection'], departure_hour=request['departure_hour']
+            )
+        else:
+            recs, explanation_data = recommend_one(catalog, request), None
+        value = {'recommendations': recs, 'explanation_data': explanation_data}
+        result_cache.put(key, value)
+    return value
+
+
+def recommend_request(catalog, record, result_cache=None):
+    """Recommended attractions (unordered) for one request record"""
+    request = parse_request(record)
+    if result_cache is None:
+        recs = recommend_one(catalog, request)
+    else:
+        recs = cached_recommend(catalog, request, result_cache)['recommendations']
+    return {'id': record.get('id'), 'stops': route_to_stops(recs), **summarize_route(recs)}
+
+
+def popular_request(popular, record):
+    """recommend_request result for a record served from a PopularItineraries store,
+    or None if the record is not a stored popular request (or is invalid)"""
+    try:
+        request = parse_request(record)
+    except InvalidRequest:
+        return None
+    entry = popular.lookup(
+        request['selected_categories'], request['time_limit'], request['budget'],
+        request['crowded_preference'], request['user_location'], request['selection'],
+        request['departure_hour']
+    )
+    if entry is None:
+        return None
+    recs = entry['recommendations']
+    return {'id': record.get('id'), 'stops': route_to_stops(recs), **summarize_route(recs)}
+
+
+def similar_request(catalog, record):
+    """Attractions most similar to free text ("query") or categories ("categories"),
+    from the catalog's embedding index. Optional top_n (default 10).
+    """
+    query = record.get('query')
+    if query is None:
+        query = parse_strings(record.get('categories') or [], 'categories')
+    elif not isinstance(query, str):
+        raise InvalidRequest("query must be a string")
+    top_n = record.get('top_n') or 10
+    if isinstance(top_n, bool) or not isinstance(top_n, int) or top_n < 1:
+        raise InvalidRequest(f"top_n must be a positive integer, got {top_n!r}")
+    matches = []
+    for attraction_id, similarity in catalog.nearest(query, top_n):
+        row = catalog.data.loc[attraction_id]
+        matches.append({
+            'id': attraction_id.item() if hasattr(attraction_id, 'item') else attraction_id,
+            'Name': row['Name'],
+            'Category': row['Category'],
+            'similarity': round(similarity, 4),
+        })
+    return {'id': record.get('id'), 'matches': matches}
+
+
+def optimize_request(record):
+    """Visiting order for the stops of one request record.
+
+    Expected keys: stops (list of dicts with at least Name, Latitude, Longitude),
+    time_limit (hours), optional location ([lat, lon]) and start_hour (hour of day).
+    """
+    stops = record.get('stops') or []
+    if not isinstance(stops, list):
+        raise InvalidRequest("stops must be a list of objects")
+    stops = [parse_stop(stop) for stop in stops]
+    time_limit = record.get('time_limit')
+    time_limit = parse_number(time_limit, 'time_limit') if time_limit is not None else None
+    stops = pd.DataFrame(stops)
+    if stops.empty:
+        return {'id': record.get('id'), 'stops': [], **summarize_route(stops)}
+    location = record.get('location')
+    if location is not None:
+        location = parse_location(location)
+    route = optimize_route(
+        stops, time_limit or None, start_location=location,
+        departure_hour=parse_start_hour(record)
+    )
+    return {'id': record.get('id'), 'stops': route_to_stops(route), **summarize_route(route)}
+
+
+def geometry_request(record):
+    """Road geometry per leg for a list of points ([[lat, lon], ...])"""
+    points = record.get('points') or []
+    if not isinstance(points, list):
+        raise InvalidRequest("points must be a list of [lat, lon] pairs")
+    points = [list(parse_location(p, 'points')) for p in points]
+    return {'id': record.get('id'), 'legs': route_geometry(points)}
@@ -0,0 +1,224 @@
+"""Warm store of precomputed itineraries for the most common requests.
+
+Much of the traffic is the same few category combinations with the sidebar's
+default options and no location. PopularItineraries plans every combination of
+POPULAR_CATEGORIES x POPULAR_TIME_LIMITS x BUDGET_BANDS x crowd preference x
+POPULAR_START_HOURS in a background thread: the recommendations with their
+explanation data, the optimized route and, when ORS is configured, its road
+geometry. Matching requests are served from the store. When the catalog
+version changes the store misses until a rebuild for the new version is done.
+
+A build plans several hundred itineraries (tens of CPU seconds), so the store is
+opt-in (PLANNER_POPULAR=1, or service.py --popular) and rebuilt at most once per
+POPULAR_REBUILD_SECONDS. Road geometry is fetched at most once per
+POPULAR_ORS_INTERVAL_SECONDS, and legs ORS could not route are not asked for
+again until POPULAR_FAILED_LEG_SECONDS have passed.
+
+Budgets are matched by band: a request gets the itinerary planned for the
+highest band edge that does not exceed its budget, so a served plan never
+costs more than the request allows.
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+
+from hybrid_recommender import hybrid_recommend
+from map_visualizer import (
+    cached_route_between_points, geometry_cache_key, ors_configured, try_route_between_points,
+)
+from metrics import increment, set_attrs, span
+from route_optimizer import route_order
+from route_result import route_points, route_result
+
+logger = logging.getLogger(__name__)
+
+POPULAR_CATEGORIES = (
+    ('Beach',),
+    ('Historical',),
+    ('Beach', 'Historical'),
+    ('Wildlife',),
+    ('Nature',),
+    ('Beach', 'Nature'),
+    ('Cultural', 'Historical'),
+    ('Surf Spot',),
+)
+POPULAR_TIME_LIMITS = (2, 4, 6, 8)
+# Lower edges (LKR) of the budget bands
+BUDGET_BANDS = (0, 2000, 5000, 10000)
+CROWD_PREFERENCES = (None, True, False)
+# None: no start time given; 9: the sidebar's default start
+POPULAR_START_HOURS = (None, 9)
+
+POPULAR_ENABLED = os.getenv('PLANNER_POPULAR') == '1'
+# Catalog changes within this long of the last build start share one rebuild
+POPULAR_REBUILD_SECONDS = float(os.getenv('PLANNER_POPULAR_REBUILD_SECONDS', '600'))
+# Spacing of the build's ORS requests (the public ORS allows 40 directions a minute)
+POPULAR_ORS_INTERVAL_SECONDS = float(os.getenv('PLANNER_POPULAR_ORS_INTERVAL_SECONDS', '1.5'))
+# How long a leg ORS failed to route is skipped by later builds
+POPULAR_FAILED_LEG_SECONDS = 3600
+
+
+def budget_band(budget):
+    """Highest BUDGET_BANDS edge not above budget, or None below the lowest"""
+    edges = [edge for edge in BUDGET_BANDS if edge <= budget]
+    return max(edges) if edges else None
+
+
+def popular_key(selected_categories, time_limit, budget, crowded_preference, departure_hour=None):
+    """Store key of a request, or None if its budget is below every band"""
+    band = budget_band(budget)
+    if band is None:
+        return None
+    return (
+        tuple(sorted(selected_categories)), float(time_limit), band, crowded_preference,
+        None if departure_hour is None else float(departure_hour),
+    )
+
+
+class PopularItineraries:
+    """Itineraries for the popular requests of one catalog, kept in step with its version"""
+
+    def __init__(self, catalog, with_geometry=None):
+        self.catalog = catalog
+        # Fetch road geometry while warming (default: when ORS is configured)
+        self.with_geometry = with_geometry
+        self.version = None  # Catalog version the entries were planned for
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._build_started = None  # time.monotonic() of the last build start
+        self._last_fetch = None  # time.monotonic() of the last ORS request
+        self._failed_legs = {}  # geometry_cache_key -> time.monotonic() of the failure
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def ready(self):
+        return self.version is not None and self.version == self.catalog.version
+
+    @staticmethod
+    def combinations():
+        return itertools.product(
+            POPULAR_CATEGORIES, POPULAR_TIME_LIMITS, BUDGET_BANDS, CROWD_PREFERENCES, POPULAR_START_HOURS
+        )
+
+    def plan(self, selected_categories, time_limit, budget, crowded_preference, departure_hour=None):
+        """Stored entry for one combination: recommendations, explanation data,
+        route (a compact route_result, None if nothing fits) and geometry"""
+        recs, explanation_data = hybrid_recommend(
+            self.catalog.data, list(selected_categories), time_limit, budget, crowded_preference,
+            return_explanation_data=True, catalog=self.catalog, departure_hour=departure_hour
+        )
+        route = None
+        if not recs.empty:
+            steps = explanation_data['selection_steps']
+            order = route_order(recs, time_limit, departure_hour=departure_hour)
+            route = route_result(self.catalog, [steps[i]['attraction_id'] for i in order], None, departure_hour)
+        geometry = None
+        if self.with_geometry and route is not None and len(route['ids']) > 1:
+            points = route_points(self.catalog, route)
+            # Only keep real road geometry: a route with a failed leg gets none
+            legs = [self.leg_geometry(start, end) for start, end in zip(points, points[1:])]
+            geometry = legs if all(leg is not None for leg in legs) else None
+        return {
+            'recommendations': recs,
+            'explanation_data': explanation_data,
+            'route': route,
+            'geometry': geometry,
+        }
+
+    def leg_geometry(self, start, end):
+        """Road geometry of one leg, or None: from the geometry cache, else from a
+        throttled ORS request unless the leg failed recently"""
+        cached = cached_route_between_points(start, end)
+        if cached is not None:
+            return cached
+        key = geometry_cache_key(start, end)
+        failed = self._failed_legs.get(key)
+        if failed is not None and time.monotonic() - failed < POPULAR_FAILED_LEG_SECONDS:
+            increment('popular_geometry', result='failed_before')
+            return None
+        if self._last_fetch is not None:
+            time.sleep(max(0.0, self._last_fetch + POPULAR_ORS_INTERVAL_SECONDS - time.monotonic()))
+        self._last_fetch = time.monotonic()
+        leg = try_route_between_points(start, end)
+        if leg is None:
+            self._failed_legs[key] = time.monotonic()
+        increment('popular_geometry', result='fetched' if leg is not None else 'failed')
+        return leg
+
+    def build(self):
+        """Plan every popular combination for the current catalog version (blocking).
+        Returns False if the catalog changed while building (nothing is stored then).
+        """
+        if self.with_geometry is None:
+            self.with_geometry = ors_configured()
+        version = self.catalog.version
+        entries = {}
+        with span('popular.build', catalog_version=version, geometry=self.with_geometry):
+            for categories, time_limit, band, crowded_preference, hour in self.combinations():
+                if self.catalog.version != version:
+                    set_attrs(interrupted=True)
+                    return False
+                key = popular_key(categories, time_limit, band, crowded_preference, hour)
+                entries[key] = self.plan(categories, time_limit, band, crowded_preference, hour)
+            set_attrs(entries=len(entries))
+        with self._lock:
+            self._entries = entries
+            self.version = version
+        return True
+
+    def start(self):
+        """Build in a background thread, unless a build is already running; a rebuild
+        waits until POPULAR_REBUILD_SECONDS after the last build started. Returns self."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='popular-itineraries', daemon=True)
+                self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            while True:
+                if self._build_started is not None:
+                    # Later catalog changes in the wait are picked up by this one build
+                    time.sleep(max(0.0, self._build_started + POPULAR_REBUILD_SECONDS - time.monotonic()))
+                self._build_started = time.monotonic()
+                # False if the catalog changed mid-build: plan again for the new version
+                if self.build():
+                    break
+        except Exception:
+            logger.exception("Building popular itineraries failed")
+
+    def wait(self, timeout=None):
+        """Wait for a running build to finish"""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.ready
+
+    def lookup(self, selected_categories, time_limit, budget, crowded_preference, user_location=None,
+               selection='greedy', departure_hour=None):
+        """Stored entry for a request, or None. Only greedy requests without a location
+        are served; a store behind the catalog version misses and starts a rebuild.
+        Entries are shared: treat them as read-only.
+        """
+        if user_location is not None or selection != 'greedy':
+            return None
+        key = popular_key(selected_categories, time_limit, budget, crowded_preference, departure_hour)
+        if key is None:
+            return None
+        if not self.ready:
+            if self.version is not None:
+                self.start()
+            increment('popular_itineraries', result='not_ready')
+            return None
+        entry = self._entries.get(key)
+        increment('popular_itineraries', result='hit' if entry is not None else 'miss')
+        if entry is None:
+            return None
+        # The UI caches decision statistics in explanation_data: give each caller its own dict
+        return dict(entry, explanation_data=dict(entry['explanation_data']))
@@ -0,0 +1,161 @@
+"""Opt-in CPU and memory profiling of single planning requests.
+
+    with profile_request('streamlit', enabled=profiling_enabled(st.query_params)) as report:
+        ...plan...
+    report['summary']  # path of the text summary, once the block has finished
+
+When enabled, the block runs under cProfile and tracemalloc. On exit a .prof file
+(load it with pstats or snakeviz) and a text summary of the hot functions in
+hybrid_recommender, route_optimizer and map_visualizer plus the top allocation
+sites are written to PLANNER_PROFILE_DIR (default: profiles/). When disabled the
+context manager does nothing.
+"""
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+PROFILE_DIR = os.getenv('PLANNER_PROFILE_DIR', 'profiles')
+FOCUS_MODULES = ('hybrid_recommender', 'route_optimizer', 'map_visualizer')
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 25
+TRACEBACK_FRAMES = 10
+
+# tracemalloc is process-wide; count the requests using it so overlapping ones share it
+_tracemalloc_users = 0
+_tracemalloc_lock = threading.Lock()
+
+
+def profiling_enabled(query_params=None):
+    """True if PLANNER_PROFILE=1 is set or the request has ?profile=1"""
+    if os.getenv('PLANNER_PROFILE') == '1':
+        return True
+    return query_params is not None and query_params.get('profile') == '1'
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEBACK_FRAMES)
+        tracemalloc.reset_peak()
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    """Snapshot and peak traced memory, stopping tracemalloc once no request uses it"""
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+    return snapshot, peak
+
+
+def _artifact_base(label):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe_label = re.sub(r'[^A-Za-z0-9_.-]+', '-', label)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return os.path.join(PROFILE_DIR, f"{stamp}-{os.getpid()}-{threading.get_ident()}-{safe_label}")
+
+
+def write_summary(stats, snapshot, peak, wall_seconds, stream):
+    """Hot functions of the planning modules and the top allocation sites"""
+    stream.write(f"wall time: {wall_seconds:.3f}s, peak traced memory: {peak / 1e6:.1f} MB\n\n")
+
+    stream.write(f"=== Hot functions in {', '.join(FOCUS_MODULES)} (by cumulative time) ===\n")
+    stats.stream = stream
+    stats.sort_stats('cumulative').print_stats('|'.join(FOCUS_MODULES), TOP_FUNCTIONS)
+
+    stream.write("=== All functions (by internal time) ===\n")
+    stats.sort_stats('tottime').print_stats(TOP_FUNCTIONS)
+
+    stream.write(f"=== Top {TOP_ALLOCATIONS} allocation sites (live at the end of the request) ===\n")
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    ])
+    for i, stat in enumerate(snapshot.statistics('lineno')[:TOP_ALLOCATIONS], 1):
+        frame = stat.traceback[0]
+        stream.write(f"{i:>3}. {frame.filename}:{frame.lineno}: {stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+
+
+@contextmanager
+def profile_request(label, enabled=True, include_threads=False):
+    """Profile the enclosed block and save its artifacts; yields a report dict
+    (filled with 'profile', 'summary', 'wall_seconds' and 'peak_bytes' on exit).
+    include_threads also profiles threads started inside the block (e.g. the
+    asyncio.to_thread calls of the streaming pipeline); pools started earlier are not seen.
+    A thread that outlives the block (e.g. a long-lived pool worker) stops its
+    profiler itself at its first function call after the block.
+    """
+    report = {}
+    if not enabled:
+        yield report
+        return
+
+    thread_profiles = []
+    previous_thread_hook = threading.getprofile()
+    finished = threading.Event()
+
+    def start_thread_profile(frame, event, arg):
+        # Runs once in each new thread, then cProfile replaces this hook
+        sys.setprofile(None)
+        if finished.is_set():
+            return
+        profile = cProfile.Profile()
+        previous_trace = sys.gettrace()
+
+        def stop_when_finished(frame, event, arg):
+            # A profiler can only be disabled from its own thread: do it at the
+            # thread's first call once the block is over, then remove this hook
+            if finished.is_set():
+                profile.disable()
+                sys.settrace(previous_trace)
+            return None
+
+        thread_profiles.append(profile)
+        sys.settrace(stop_when_finished)
+        profile.enable()
+
+    if include_threads:
+        threading.setprofile(start_thread_profile)
+    _start_tracemalloc()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield report
+    finally:
+        profiler.disable()
+        wall_seconds = time.perf_counter() - start
+        if include_threads:
+            threading.setprofile(previous_thread_hook)
+            finished.set()
+        snapshot, peak = _stop_tracemalloc()
+
+        stats = pstats.Stats(profiler)
+        for profile in thread_profiles:
+            stats.add(profile)
+
+        base = _artifact_base(label)
+        stats.dump_stats(base + '.prof')
+        summary = io.StringIO()
+        write_summary(stats, snapshot, peak, wall_seconds, summary)
+        with open(base + '.txt', 'w', encoding='utf-8') as f:
+            f.write(summary.getvalue())
+        report.update({
+            'profile': base + '.prof',
+            'summary': base + '.txt',
+            'wall_seconds': wall_seconds,
+            'peak_bytes': peak,
+        })
@@ -0,0 +1,220 @@
+"""Cache of recommendation results keyed by a normalized request.
+
+Recommendations are deterministic given their inputs, but GPS jitter makes
+every request from the same hotel look unique. canonical_request() snaps the
+location to a grid (PLANNER_LOCATION_GRID_DEG, ~500 m by default), sorts the
+categories and rounds time and budget down to buckets, so the same trip maps
+to one key; results are computed for the canonical request, which never asks
+for more time or money than the original.
+
+ResultCache has two tiers:
+- an in-process LRU of pickled results, capped in bytes (PLANNER_RESULT_CACHE_MB)
+- an optional SQLite file shared by all processes on the host
+  (PLANNER_RESULT_CACHE_DB, '' to disable), with its own byte cap and LRU eviction;
+  triggers keep the total size in the file, and rows are evicted in batches once it
+  goes over the cap
+Keys include a fingerprint of the catalog contents, so results from another
+catalog version (or another process's catalog) never hit.
+"""
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from metrics import increment
+
+LOCATION_GRID_DEG = float(os.getenv('PLANNER_LOCATION_GRID_DEG', '0.005'))
+TIME_BUCKET_HOURS = 0.5
+BUDGET_BUCKET_LKR = 500
+MEMORY_MAX_BYTES = int(float(os.getenv('PLANNER_RESULT_CACHE_MB', '64')) * 2**20)
+SHARED_PATH = os.getenv('PLANNER_RESULT_CACHE_DB', 'artifacts/result_cache.sqlite')
+SHARED_MAX_BYTES = 16 * MEMORY_MAX_BYTES
+# The shared tier evicts down to this fraction of its cap, so the next inserts do not evict again
+SHARED_EVICT_TO = 0.9
+
+
+def snap(value, step):
+    """value rounded to a multiple of step"""
+    return round(round(value / step) * step, 6)
+
+
+def bucket(value, step):
+    """value rounded down to a multiple of step"""
+    return round((value // step) * step, 6)
+
+
+def canonical_request(request, grid=None):
+    """Normalized copy of a parsed request (see planning.parse_request)"""
+    grid = LOCATION_GRID_DEG if grid is None else grid
+    location = request.get('user_location')
+    departure_hour = request.get('departure_hour')
+    return {
+        'selected_categories': sorted(set(request['selected_categories'])),
+        'time_limit': bucket(float(request['time_limit']), TIME_BUCKET_HOURS),
+        'budget': bucket(float(request['budget']), BUDGET_BUCKET_LKR),
+        'crowded_preference': request.get('crowded_preference'),
+        'user_location': None if location is None else (snap(location[0], grid), snap(location[1], grid)),
+        'selection': request.get('selection') or 'greedy',
+        'departure_hour': None if departure_hour is None else bucket(float(departure_hour), TIME_BUCKET_HOURS),
+    }
+
+
+class ResultCache:
+    """Two-tier (process LRU + shared SQLite) cache of recommendation results"""
+
+    def __init__(self, max_bytes=MEMORY_MAX_BYTES, shared_path=SHARED_PATH, shared_max_bytes=SHARED_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.shared_path = shared_path or None
+        self.shared_max_bytes = shared_max_bytes
+        self.bytes = 0
+        self.stats = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'evictions': 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprint = None  # (catalog id, version, content hash)
+        self._db = None
+        self._db_pid = None
+
+    # ===== KEYS =====
+
+    def catalog_fingerprint(self, catalog):
+        """Hash of the catalog rows and content model, recomputed when the version changes"""
+        cached = self._fingerprint
+        if cached is None or cached[0] != id(catalog) or cached[1] != catalog.version:
+            digest = hashlib.sha1(pd.util.hash_pandas_object(catalog.data).values.tobytes())
+            digest.update(catalog.content_model.encode())
+            cached = (id(catalog), catalog.version, digest.hexdigest())
+            self._fingerprint = cached
+        return cached[2]
+
+    def key(self, catalog, request):
+        """Cache key of a canonical request against a catalog"""
+        parts = (self.catalog_fingerprint(catalog), sorted(request.items()))
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    # ===== SHARED TIER =====
+
+    def _connection(self):
+        """SQLite connection of this process (reopened after a fork)"""
+        if self._db is None or self._db_pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.shared_path)), exist_ok=True)
+            db = sqlite3.connect(self.shared_path, timeout=5, check_same_thread=False, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                db.execute(
+                    'CREATE TABLE IF NOT EXISTS results '
+                    '(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)'
+                )
+                # Running total of results.size, kept up to date by triggers in every process
+                db.execute('CREATE TABLE IF NOT EXISTS results_size (bytes INTEGER NOT NULL)')
+                db.execute(
+                    'INSERT INTO results_size SELECT COALESCE(SUM(size), 0) FROM results '
+                    'WHERE NOT EXISTS (SELECT 1 FROM results_size)'
+                )
+                db.execute(
+                    'CREATE TRIGGER IF NOT EXISTS results_insert AFTER INSERT ON results '
+                    'BEGIN UPDATE results_size SET bytes = bytes + NEW.size; END'
+                )
+                db.execute(
+                    'CREATE TRIGGER IF NOT EXISTS results_update AFTER UPDATE OF size ON results '
+                    'BEGIN UPDATE results_size SET bytes = bytes + NEW.size - OLD.size; END'
+                )
+                db.execute(
+                    'CREATE TRIGGER IF NOT EXISTS results_delete AFTER DELETE ON results '
+                    'BEGIN UPDATE results_size SET bytes = bytes - OLD.size; END'
+                )
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            self._db, self._db_pid = db, os.getpid()
+        return self._db
+
+    def _shared_get(self, key):
+        db = self._connection()
+        row = db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            db.execute('UPDATE results SET accessed = ? WHERE key = ?', (time.time(), key))
+        return row[0] if row is not None else None
+
+    def _shared_put(self, key, blob):
+        db = self._connection()
+        # An upsert rather than INSERT OR REPLACE, whose deletes would not fire the size trigger
+        db.execute(
+            'INSERT INTO results (key, value, size, accessed) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size, '
+            'accessed = excluded.accessed',
+            (key, blob, len(blob), time.time())
+        )
+        (total,) = db.execute('SELECT bytes FROM results_size').fetchone()
+        if total > self.shared_max_bytes:
+            # Drop the least recently used rows in one batch, down to SHARED_EVICT_TO of the cap
+            db.execute(
+                'DELETE FROM results WHERE key IN (SELECT key FROM ('
+                'SELECT key, SUM(size) OVER (ORDER BY accessed DESC) AS running FROM results'
+                ') WHERE running > ?)',
+                (int(self.shared_max_bytes * SHARED_EVICT_TO),)
+            )
+            increment('result_cache_evictions', tier='shared')
+
+    # ===== LOOKUPS =====
+
+    def _remember(self, key, blob):
+        """Store in the process LRU, evicting the oldest entries beyond max_bytes"""
+        if len(blob) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old)
+        self._entries[key] = blob
+        self.bytes += len(blob)
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.stats['evictions'] += 1
+
+    def get(self, key):
+        """Cached value for key, or None"""
+        with self._lock:
+            blob = self._entries.get(key)
+            if blob is not None:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                increment('result_cache', result='hit')
+                return pickle.loads(blob)
+            if self.shared_path:
+                try:
+                    blob = self._shared_get(key)
+                except sqlite3.Error:
+                    increment('result_cache_errors', op='get')
+                    blob = None
+                if blob is not None:
+                    self._remember(key, blob)
+                    self.stats['shared_hits'] += 1
+                    increment('result_cache', result='shared_hit')
+                    return pickle.loads(blob)
+            self.stats['misses'] += 1
+            increment('result_cache', result='miss')
+            return None
+
+    def put(self, key, value):
+        """Store value (any picklable object) in both tiers"""
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._remember(key, blob)
+            if self.shared_path:
+                try:
+                    self._shared_put(key, blob)
+                except sqlite3.Error:
+                    increment('result_cache_errors', op='put')
+
+    def clear(self):
+        """Empty the process tier"""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
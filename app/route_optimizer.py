@@ -1,70 +1,208 @@
-from utils import haversine_distance
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
+from utils import haversine_vectorized
 import pandas as pd
-
-# NEW: Import Google OR-Tools
-from ortools.constraint_solver import pywrapcp, routing_enums_pb2
 import numpy as np
+from metrics import increment, set_attrs, span
+from opening_hours import OPENING_COLUMNS, always_open
+from travel_time import AVG_SPEED_KMH, hourly_time_matrices
+
+# Re-solves with per-stop departure hours when travel times depend on the time of day
+TIME_DEPENDENT_PASSES = 3
+
+# Portfolio mode (PLANNER_ROUTE_PORTFOLIO=1): each solve runs these (name, first solution
+# strategy, metaheuristic) searches at once in a process pool and keeps the best route.
+# The first one is the single-solve default, so the portfolio is never worse than it.
+PORTFOLIO = (
+    ('cheapest_arc', 'PATH_CHEAPEST_ARC', 'AUTOMATIC'),
+    ('savings_gls', 'SAVINGS', 'GUIDED_LOCAL_SEARCH'),
+    ('christofides_gls', 'CHRISTOFIDES', 'GUIDED_LOCAL_SEARCH'),
+    ('cheapest_arc_sa', 'PATH_CHEAPEST_ARC', 'SIMULATED_ANNEALING'),
+)
+ROUTE_PORTFOLIO = os.getenv('PLANNER_ROUTE_PORTFOLIO') == '1'
+# Shared deadline of all portfolio searches
+PORTFOLIO_DEADLINE_SECONDS = float(os.getenv('PLANNER_ROUTE_PORTFOLIO_SECONDS', '1'))
+# Metaheuristics end early once they have not improved their route for this long
+PORTFOLIO_STALL_SECONDS = PORTFOLIO_DEADLINE_SECONDS / 5
+PORTFOLIO_WORKERS = min(len(PORTFOLIO), os.cpu_count() or 1)
+# Routes this short have one sensible order: not worth a pool round trip
+PORTFOLIO_MIN_NODES = 5
+# Stop flags shared with the pool processes, one slot per concurrent portfolio solve
+PORTFOLIO_SLOTS = 64
+_portfolio_pool = None
+_portfolio_pool_lock = threading.Lock()
+_portfolio_stops = None
+_portfolio_next_slot = 0
 
 def haversine_matrix(locations):
     """Compute a matrix of Haversine distances between all pairs of locations."""
-    n = len(locations)
-    matrix = np.zeros((n, n))
-    for i in range(n):
-        for j in range(n):
-            if i == j:
-                matrix[i][j] = 0
-            else:
-                matrix[i][j] = haversine_distance(locations.iloc[i], locations.iloc[j])
+    lat = locations['Latitude'].values.astype(float)
+    lon = locations['Longitude'].values.astype(float)
+    matrix = haversine_vectorized(lat[:, np.newaxis], lon[:, np.newaxis], lat[np.newaxis, :], lon[np.newaxis, :])
+    np.fill_diagonal(matrix, 0)
     return matrix
 
-def solve_tsp(distance_matrix, visit_durations=None, time_limit=None):
+def solve_tsp(distance_matrix, visit_durations=None, time_limit=None, time_matrices=None, departure_hour=None,
+              time_windows=None, portfolio=None, search=None):
     """Solves the TSP using Google OR-Tools, optionally respecting visit durations and time limits.
        Returns the order of indices to visit.
+       - time_matrices: optional (24 x n x n) travel hours per departure hour of day
+         (see travel_time.hourly_time_matrices), used with departure_hour (at node 0)
+       - time_windows: optional (earliest, latest) start of the visit at each node,
+         in minutes after departure, or None for nodes that are always open
+       - portfolio: run the PORTFOLIO searches in parallel (default: ROUTE_PORTFOLIO)
+       - search: run this one search instead (see _solve_tsp), e.g. a metaheuristic with a deadline
+    """
+    portfolio = ROUTE_PORTFOLIO if portfolio is None else portfolio
+    if search is not None:
+        solve = partial(_solve_tsp, search=search)
+    elif portfolio and len(distance_matrix) >= PORTFOLIO_MIN_NODES:
+        solve = _solve_portfolio
+    else:
+        solve = _solve_tsp
+    if time_matrices is None or departure_hour is None:
+        return solve(distance_matrix, visit_durations, time_limit, time_windows=time_windows)
+
+    # Time-dependent travel: each stop's outgoing legs use the hour the route leaves it.
+    # Solve, re-estimate those hours along the solution and solve again until they settle
+    n = len(distance_matrix)
+
+    def leave_hours_along(order):
+        """Hours at which the route leaves each stop: travel there, wait for opening, then the visit"""
+        leave_hours = np.full(n, float(departure_hour))
+        clock = float(departure_hour)
+        for prev, node in zip(order, order[1:]):
+            leave_hours[prev] = clock
+            clock += time_matrices[int(np.floor(clock)) % 24, prev, node]
+            if time_windows is not None and time_windows[node] is not None:
+                clock = max(clock, departure_hour + time_windows[node][0] / 60)
+            clock += visit_durations[node] / 60 if visit_durations is not None else 0
+        leave_hours[order[-1]] = clock
+        return leave_hours
+
+    # Start from the input order (the greedy's pick order, which fits the limits at
+    # these hours); departure-hour speeds everywhere can make it look infeasible
+    order = list(range(n))
+    for pass_number in range(TIME_DEPENDENT_PASSES):
+        hour_of_day = np.floor(leave_hours_along(order)).astype(int) % 24
+        # Row i uses the hour the route leaves node i
+        travel = time_matrices[hour_of_day[:, np.newaxis], np.arange(n)[:, np.newaxis], np.arange(n)[np.newaxis, :]]
+        # Later passes only adjust the first pass's route to the new hours: one plain solve from it
+        pass_solve = solve if pass_number == 0 else _solve_tsp
+        new_order = pass_solve(distance_matrix, visit_durations, time_limit, travel * 60, time_windows, hint=order)
+        if new_order == order:
+            break
+        order = new_order
+    set_attrs(departure_hour=departure_hour)
+    return order
+
+def _solve_tsp(distance_matrix, visit_durations=None, time_limit=None, time_matrix=None, time_windows=None,
+               hint=None, search=None, info=None):
+    """One OR-Tools solve. time_matrix: travel minutes between nodes (default: flat
+    AVG_SPEED_KMH); hint: a previous visiting order to start the search from.
+    If the time windows cannot all be met, solves again without them.
+    - search: optional {'first_solution', 'metaheuristic', 'deadline'} (strategy
+      names and a time.time() to stop at), else PATH_CHEAPEST_ARC with a 10 s cap.
+      With 'stall_seconds' the search also ends once its route has not improved
+      for that long, or when its optional 'should_stop' callable returns True
+    - info: optional dict, receives the 'objective' (None without a solution)
+      and 'windows_relaxed'
     """
+    # NEW: Import Google OR-Tools (on first use, to keep startup fast)
+    from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+
     n = len(distance_matrix)
     manager = pywrapcp.RoutingIndexManager(n, 1, 0)  # 1 vehicle, depot at 0
     routing = pywrapcp.RoutingModel(manager)
 
-    def distance_callback(from_index, to_index):
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return int(distance_matrix[from_node][to_node] * 1000)  # Convert to meters for better granularity
-
-    transit_callback_idx = routing.RegisterTransitCallback(distance_callback)
+    # Arc costs and times are registered as matrices: the solver reads them in C++
+    # instead of calling back into Python for every arc
+    distance_meters = (np.asarray(distance_matrix, dtype=float) * 1000).astype(np.int64)  # Convert to meters for better granularity
+    # Itineraries end at the last stop: the solver's return to the depot is free
+    distance_meters[:, 0] = 0
+    transit_callback_idx = routing.RegisterTransitMatrix(distance_meters.tolist())
     routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_idx)
 
     # If visit durations are provided, set up time windows
-    if visit_durations is not None or time_limit is not None:
-        time_matrix = distance_matrix / 40.0  # Assume average speed 40 km/h -> hours
-        time_matrix = time_matrix * 60  # Convert to minutes
-        def time_callback(from_index, to_index):
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            travel_time = time_matrix[from_node][to_node]
-            visit_time = visit_durations[to_node] if visit_durations is not None else 0
-            return int(travel_time + visit_time)
-        time_callback_idx = routing.RegisterTransitCallback(time_callback)
+    if visit_durations is not None or time_limit is not None or time_windows is not None:
+        if time_matrix is None:
+            time_matrix = np.asarray(distance_matrix, dtype=float) / AVG_SPEED_KMH  # Assume average speed -> hours
+            time_matrix = time_matrix * 60  # Convert to minutes
+        # Travel to a node plus the visit there
+        step_minutes = time_matrix + (np.asarray(visit_durations, dtype=float)[np.newaxis, :] if visit_durations is not None else 0)
+        # As in the greedy: travel, waits and visits count towards the time limit, the return does not
+        step_minutes[:, 0] = 0
+        time_callback_idx = routing.RegisterTransitMatrix(step_minutes.astype(np.int64).tolist())
+        horizon = int((time_limit or 24*60))  # max route time in minutes, default 24h
         routing.AddDimension(
             time_callback_idx,
-            30,  # allow waiting time ("slack")
-            int((time_limit or 24*60)),  # max route time in minutes, default 24h
+            30 if time_windows is None else horizon,  # allow waiting time ("slack"), e.g. for opening time
+            horizon,
             True,
             "Time"
         )
+        time_dimension = routing.GetDimensionOrDie("Time")
         if time_limit is not None:
-            time_dimension = routing.GetDimensionOrDie("Time")
             for idx in range(n):
                 time_dimension.CumulVar(idx).SetRange(0, int(time_limit))
+        if time_windows is not None:
+            # Cumul values are the times each visit ends
+            for node, window in enumerate(time_windows):
+                if node == 0 or window is None:
+                    continue
+                visit = visit_durations[node] if visit_durations is not None else 0
+                earliest = max(0, int(np.ceil(window[0] + visit)))
+                latest = min(horizon, int(np.floor(window[1] + visit)))
+                if earliest <= latest:
+                    time_dimension.CumulVar(manager.NodeToIndex(node)).SetRange(earliest, latest)
 
     # Set search parameters
     search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
-    search_parameters.time_limit.seconds = 10  # Safety timeout
+    if search is None:
+        search_parameters.first_solution_strategy = (
+            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
+        search_parameters.time_limit.seconds = 10  # Safety timeout
+    else:
+        search_parameters.first_solution_strategy = getattr(
+            routing_enums_pb2.FirstSolutionStrategy, search['first_solution'])
+        search_parameters.local_search_metaheuristic = getattr(
+            routing_enums_pb2.LocalSearchMetaheuristic, search['metaheuristic'])
+        remaining = max(search['deadline'] - time.time(), 0.05)
+        search_parameters.time_limit.FromMilliseconds(int(remaining * 1000))
+        if search.get('stall_seconds'):
+            _add_stall_limit(routing, search['stall_seconds'], search.get('should_stop'))
 
-    solution = routing.SolveWithParameters(search_parameters)
+    if hint is not None:
+        routing.CloseModelWithParameters(search_parameters)
+        initial = routing.ReadAssignmentFromRoutes([list(hint[1:])], True)
+        solution = routing.SolveFromAssignmentWithParameters(initial, search_parameters) if initial else None
+        if solution is None:
+            solution = routing.SolveWithParameters(search_parameters)
+    else:
+        solution = routing.SolveWithParameters(search_parameters)
+    # Solver statistics for the enclosing 'route.solve' span, and solve outcomes for /metrics
+    increment('route_solver_status', status=routing_enums_pb2.RoutingSearchStatus.Value.Name(routing.status()))
+    set_attrs(
+        status=routing_enums_pb2.RoutingSearchStatus.Value.Name(routing.status()),
+        objective=solution.ObjectiveValue() if solution else None,
+        solver_wall_ms=routing.solver().WallTime(),
+        branches=routing.solver().Branches(),
+    )
+    if info is not None:
+        info['objective'] = solution.ObjectiveValue() if solution else None
+    if not solution and time_windows is not None:
+        increment('route_windows_relaxed')
+        if info is not None:
+            info['windows_relaxed'] = True
+        return _solve_tsp(distance_matrix, visit_durations, time_limit, time_matrix, hint=hint,
+                          search=search, info=info)
     if not solution:
         # Fallback: Return indices in input order
+        increment('route_fallback', reason='no_solution')
         return list(range(n))
 
     # Extract route
@@ -76,12 +214,148 @@ def solve_tsp(distance_matrix, visit_durations=None, time_limit=None):
         index = solution.Value(routing.NextVar(index))
     return route_indices
 
-def optimize_route(attractions, time_limit, start_location=None):
+def _add_stall_limit(routing, stall_seconds, should_stop=None):
+    """End the search once its best route has not improved for stall_seconds (after
+    the first solution), or when should_stop() returns True"""
+    best = {'cost': None, 'time': time.time(), 'checks': 0}
+
+    def on_solution():
+        cost = routing.CostVar().Value()
+        if best['cost'] is None or cost < best['cost']:
+            best['cost'], best['time'] = cost, time.time()
+
+    def limit_reached():
+        # Called for every search node: only look at the clock and the flag now and then
+        best['checks'] += 1
+        if best['checks'] % 256:
+            return False
+        if should_stop is not None and should_stop():
+            return True
+        return best['cost'] is not None and time.time() - best['time'] > stall_seconds
+
+    routing.AddAtSolutionCallback(on_solution)
+    routing.AddSearchMonitor(routing.solver().CustomLimit(limit_reached))
+
+def _portfolio_member(name, search, distance_matrix, visit_durations, time_limit, time_matrix, time_windows,
+                      hint, slot):
+    """One portfolio search (runs in a pool process); stops early when its slot's flag is set"""
+    info = {'name': name, 'windows_relaxed': False}
+    search = dict(search, should_stop=lambda: _portfolio_stops[slot] != 0)
+    info['order'] = _solve_tsp(
+        distance_matrix, visit_durations, time_limit, time_matrix, time_windows, hint, search, info
+    )
+    return info
+
+def _init_member(stops):
+    global _portfolio_stops
+    _portfolio_stops = stops
+
+def _warm_up():
+    from ortools.constraint_solver import pywrapcp  # noqa: F401
+
+def portfolio_pool():
+    """The portfolio's process pool, started (and its workers warmed up) on first use.
+    Workers are spawned, not forked: the app and service parents run threads."""
+    global _portfolio_pool, _portfolio_stops
+    with _portfolio_pool_lock:
+        if _portfolio_pool is None:
+            context = multiprocessing.get_context('spawn')
+            _portfolio_stops = context.RawArray('b', PORTFOLIO_SLOTS)
+            pool = ProcessPoolExecutor(
+                max_workers=PORTFOLIO_WORKERS, mp_context=context,
+                initializer=_init_member, initargs=(_portfolio_stops,)
+            )
+            wait([pool.submit(_warm_up) for _ in range(PORTFOLIO_WORKERS)])
+            _portfolio_pool = pool
+    return _portfolio_pool
+
+def _portfolio_slot():
+    """A stop flag slot (cleared) for one portfolio solve"""
+    global _portfolio_next_slot
+    with _portfolio_pool_lock:
+        slot = _portfolio_next_slot
+        _portfolio_next_slot = (slot + 1) % PORTFOLIO_SLOTS
+        _portfolio_stops[slot] = 0
+    return slot
+
+def _members_agree(futures):
+    """True once two finished searches found routes of the same cost (both keeping
+    the time windows, or both without them)"""
+    costs = [
+        (future.result()['windows_relaxed'], future.result()['objective']) for future in futures
+        if future.done() and not future.cancelled() and future.exception() is None
+    ]
+    costs = [cost for cost in costs if cost[1] is not None]
+    return len(costs) > len(set(costs))
+
+def _solve_portfolio(distance_matrix, visit_durations=None, time_limit=None, time_matrix=None, time_windows=None,
+                     hint=None):
+    """_solve_tsp with every PORTFOLIO search in parallel under one deadline. Returns the
+    best order: routes that keep the time windows first, then the lowest objective.
+    Metaheuristics end early when they stall. The solve returns once every search
+    has finished, two of them agree on the route cost, or the deadline passes; the
+    other searches are then told to stop, and ones still queued are cancelled."""
+    pool = portfolio_pool()
+    slot = _portfolio_slot()
+    deadline = time.time() + PORTFOLIO_DEADLINE_SECONDS
+    futures = [
+        pool.submit(
+            _portfolio_member, name,
+            {'first_solution': first, 'metaheuristic': meta, 'deadline': deadline,
+             'stall_seconds': PORTFOLIO_STALL_SECONDS},
+            distance_matrix, visit_durations, time_limit, time_matrix, time_windows, hint, slot
+        )
+        for name, first, meta in PORTFOLIO
+    ]
+    pending = futures
+    while pending and not _members_agree(futures) and time.time() < deadline:
+        _, pending = wait(pending, timeout=deadline - time.time(), return_when=FIRST_COMPLETED)
+    _portfolio_stops[slot] = 1
+    # A little grace for the stopped solvers to send back their routes
+    done, pending = wait(futures, timeout=0.5)
+    for future in pending:
+        future.cancel()
+    # In PORTFOLIO order, so ties go to the earlier search
+    results = [future.result() for future in futures if future in done and future.exception() is None]
+    if not results:
+        increment('route_portfolio', strategy='none')
+        return _solve_tsp(distance_matrix, visit_durations, time_limit, time_matrix, time_windows, hint)
+    best = min(results, key=lambda result: (
+        result['objective'] is None, result['windows_relaxed'], result['objective'] or 0
+    ))
+    if best['windows_relaxed']:
+        increment('route_windows_relaxed')
+    increment('route_portfolio', strategy=best['name'])
+    set_attrs(
+        portfolio=len(futures), portfolio_done=len(results), portfolio_best=best['name'],
+        objective=best['objective'],
+    )
+    return best['order']
+
+def optimize_route(attractions, time_limit, start_location=None, departure_hour=None):
     """Returns an efficient sequence of attractions, minimizing travel time and distance.
     Uses nearest neighbor for fallback, Google OR-Tools for optimal routing (TSP).
     - start_location: (lat, lon) tuple. If given, used as starting point.
     - time_limit: in hours.
+    - departure_hour: hour of day the trip starts; travel times then follow the
+      time-of-day speed tables in travel_time.py instead of a flat average speed,
+      and stops with OpenHour / CloseHour columns get time windows.
     """
+    with span('route', attractions=len(attractions), from_location=start_location is not None):
+        attractions_cp, order = _solve_route(attractions, time_limit, start_location, departure_hour)
+        return attractions_cp.iloc[order].reset_index(drop=True)
+
+def route_order(attractions, time_limit, start_location=None, departure_hour=None):
+    """The visiting order optimize_route would choose, as row positions of attractions
+    (the start location is not included)"""
+    with span('route', attractions=len(attractions), from_location=start_location is not None):
+        _, order = _solve_route(attractions, time_limit, start_location, departure_hour)
+    if start_location is not None:
+        return [node - 1 for node in order if node > 0]
+    return list(order)
+
+def _solve_route(attractions, time_limit, start_location=None, departure_hour=None):
+    """(attractions with the start row prepended if given, visiting order of its rows)"""
     # Prepare DataFrame
     attractions_cp = attractions.copy()
     if start_location is not None:
@@ -95,31 +369,54 @@ def optimize_route(attractions, time_limit, start_location=None):
         start['AvgVisitTimeHrs'] = 0
         start['Popularity'] = 0
         start['Crowded'] = ""
+        for column, hour in zip(OPENING_COLUMNS, (0, 24)):
+            if column in start.index:
+                start[column] = hour
         attractions_cp = pd.concat([pd.DataFrame([start]), attractions_cp], ignore_index=True)
     else:
         start = attractions_cp.iloc[0]
 
     # Build distance matrix (in km)
-    distance_matrix = haversine_matrix(attractions_cp[['Latitude', 'Longitude', 'Name']])
+    with span('route.distance_matrix', stops=len(attractions_cp)):
+        distance_matrix = haversine_matrix(attractions_cp[['Latitude', 'Longitude', 'Name']])
 
     # Prepare visit durations (in minutes)
     if 'Visit_Duration' in attractions_cp.columns:
         visit_durations = attractions_cp['Visit_Duration'].fillna(0).astype(float).values
     else:
-        visit_durations = None
+        # Visits count towards the time limit, as they do in the greedy selection
+        visit_durations = attractions_cp['AvgVisitTimeHrs'].fillna(0).astype(float).values * 60
 
     # Convert time_limit to minutes
     time_limit_minutes = time_limit * 60 if time_limit else None
 
+    # Opening hours as time windows (minutes after departure) for the visit at each stop
+    time_windows = None
+    if departure_hour is not None and set(OPENING_COLUMNS) <= set(attractions_cp.columns):
+        open_hours = attractions_cp['OpenHour'].astype(float).values
+        close_hours = attractions_cp['CloseHour'].astype(float).values
+        time_windows = [
+            None if always_open(open_hour, close_hour)
+            else ((open_hour - departure_hour) * 60, (close_hour - departure_hour) * 60 - visit)
+            for open_hour, close_hour, visit in zip(open_hours, close_hours, visit_durations)
+        ]
+
     # Try TSP optimization
     try:
-        order = solve_tsp(
-            distance_matrix,
-            visit_durations=visit_durations,
-            time_limit=time_limit_minutes
-        )
+        with span('route.solve', stops=len(attractions_cp)):
+            order = solve_tsp(
+                distance_matrix,
+                visit_durations=visit_durations,
+                time_limit=time_limit_minutes,
+                time_matrices=None if departure_hour is None else hourly_time_matrices(
+                    distance_matrix, attractions_cp['Longitude'].values
+                ),
+                departure_hour=departure_hour,
+                time_windows=time_windows
+            )
     except Exception as e:
         # If OR-Tools fails, fallback to nearest neighbor
+        increment('route_fallback', reason=type(e).__name__)
         order = [0]
         remaining = set(range(1, len(attractions_cp)))
         current = 0
@@ -129,5 +426,4 @@ def optimize_route(attractions, time_limit, start_location=None):
             current = next_idx
             remaining.remove(next_idx)
 
-    route_df = attractions_cp.iloc[order].reset_index(drop=True)
-    return route_df
\ No newline at end of file
+    return attractions_cp, order
@@ -0,0 +1,116 @@
+"""Compact route results: attraction ids in visiting order plus precomputed legs and totals.
+
+A route result holds no attraction rows. It is a small dict of arrays that
+refers to rows of the shared catalog by id:
+- 'ids': attraction ids in visiting order (the start location is not a stop)
+- 'start': (lat, lon) the route leaves from, or None
+- 'leg_km' / 'leg_hours': distance and driving time of the leg into each stop
+  (the first stop's leg is 0 without a start location)
+- 'wait_hours': wait for opening at each stop (0 without a departure hour)
+- 'totals': attractions, cost, visit/travel/wait hours and average popularity
+- 'catalog_version': the catalog version it was made from
+Render from it with stop_columns() and route_points(), which read the catalog
+arrays by position.
+"""
+import numpy as np
+import pandas as pd
+
+from opening_hours import OPENING_COLUMNS, wait_hours
+from travel_time import travel_hours
+from utils import haversine_vectorized
+
+# Catalog columns of a stop shown in the itinerary
+STOP_DISPLAY_COLUMNS = (
+    'Name', 'Category', 'Description', 'Cost', 'AvgVisitTimeHrs', 'Popularity', 'Crowded'
+) + OPENING_COLUMNS
+
+
+def route_result(catalog, ids, start_location=None, departure_hour=None):
+    """Compact route result for attraction ids in visiting order"""
+    ids = np.asarray(ids, dtype=np.int64)
+    data = catalog.data
+    positions = catalog.positions(ids)
+    lat = data['Latitude'].values[positions].astype(float)
+    lon = data['Longitude'].values[positions].astype(float)
+    visit = data['AvgVisitTimeHrs'].values[positions].astype(float)
+    cost = data['Cost'].values[positions]
+
+    # Leg into each stop: from the start location, else the first stop has none
+    if start_location is not None:
+        from_lat = np.concatenate(([start_location[0]], lat[:-1]))
+        from_lon = np.concatenate(([start_location[1]], lon[:-1]))
+    else:
+        from_lat = np.concatenate((lat[:1], lat[:-1]))
+        from_lon = np.concatenate((lon[:1], lon[:-1]))
+    leg_km = haversine_vectorized(from_lat, from_lon, lat, lon) if len(ids) else np.zeros(0)
+
+    waits = np.zeros(len(ids))
+    if departure_hour is None:
+        leg_hours = travel_hours(leg_km, from_lon, lon, None)
+    else:
+        # Time-of-day speeds depend on when each leg starts: walk the clock along the route
+        open_hours = data['OpenHour'].values[positions].astype(float)
+        close_hours = data['CloseHour'].values[positions].astype(float)
+        leg_hours = np.zeros(len(ids))
+        clock = float(departure_hour)
+        for i in range(len(ids)):
+            leg_hours[i] = travel_hours(leg_km[i], from_lon[i], lon[i], clock)
+            clock += leg_hours[i]
+            wait = wait_hours(clock, visit[i], open_hours[i], close_hours[i])
+            waits[i] = 0.0 if np.isnan(wait) else wait
+            clock += waits[i] + visit[i]
+
+    return {
+        'ids': ids,
+        'start': None if start_location is None else (float(start_location[0]), float(start_location[1])),
+        'leg_km': np.asarray(leg_km, dtype=np.float32),
+        'leg_hours': np.asarray(leg_hours, dtype=np.float32),
+        'wait_hours': waits.astype(np.float32),
+        'totals': {
+            'attractions': len(ids),
+            'cost': int(cost.sum()),
+            'visit_hours': float(visit.sum()),
+            'travel_hours': float(np.sum(leg_hours)),
+            'wait_hours': float(waits.sum()),
+            'avg_popularity': float(data['Popularity'].values[positions].mean()) if len(ids) else 0.0,
+        },
+        'catalog_version': catalog.version,
+    }
+
+
+def present_positions(catalog, result):
+    """(catalog row positions, mask over result['ids']) of the stops still in the catalog"""
+    positions = catalog.data.index.get_indexer(result['ids'])
+    present = positions >= 0
+    return positions[present], present
+
+
+def stop_columns(catalog, result, columns=STOP_DISPLAY_COLUMNS):
+    """{column: array} of the result's stops in visiting order, read from the catalog
+    arrays, with their 'leg_hours' and 'wait_hours'. Stops removed from the catalog
+    since the route was made are skipped."""
+    positions, present = present_positions(catalog, result)
+    data = catalog.data
+    stops = {column: data[column].values[positions] for column in columns if column in data.columns}
+    stops['leg_hours'] = result['leg_hours'][present]
+    stops['wait_hours'] = result['wait_hours'][present]
+    return stops
+
+
+def route_points(catalog, result):
+    """[lat, lon] of the start (if any) and each stop, in visiting order"""
+    positions, _ = present_positions(catalog, result)
+    points = catalog.data[['Latitude', 'Longitude']].values[positions].tolist()
+    if result['start'] is not None:
+        points = [list(result['start'])] + points
+    return points
+
+
+def route_frame(catalog, result):
+    """Small Name / Latitude / Longitude frame of the route for the map
+    (the start, if any, is the 'Your Location' row)"""
+    points = route_points(catalog, result)
+    names = list(stop_columns(catalog, result, ('Name',))['Name'])
+    if result['start'] is not None:
+        names = ['Your Location'] + names
+    return pd.DataFrame(points, columns=['Latitude', 'Longitude']).assign(Name=names)
@@ -0,0 +1,315 @@
+"""Headless HTTP planning service.
+
+Usage:
+    python app/service.py [--host 0.0.0.0] [--port 8080] [--workers N] [--max-pending N]
+
+Endpoints (JSON in, JSON out):
+    POST /recommend  {"categories": [...], "time_limit": 8, "budget": 5000, "crowded": null, "location": [lat, lon],
+                      "selection": "greedy" | "dp" | "cpsat", "start_hour": 9}
+    POST /optimize   {"stops": [{"Name": ..., "Latitude": ..., "Longitude": ...}, ...], "time_limit": 8, "location": [lat, lon],
+                      "start_hour": 9}
+    POST /geometry   {"points": [[lat, lon], ...]}
+    POST /similar    {"query": "free text"} or {"categories": [...]}, optional "top_n": 10
+    Add ?profile=1 to any POST (or set PLANNER_PROFILE=1) to save a CPU/memory profile to profiles/
+    GET  /health
+    GET  /metrics    stage timings and counters in Prometheus text format
+
+The catalog is loaded once before the worker pool starts. Recommendation and
+routing run in a bounded process pool; identical requests already in flight
+share one result; when more than --max-pending jobs are queued the service
+answers 503 with Retry-After instead of queueing more work. Popular /recommend
+requests can be answered from a store planned in the background at startup
+(see popular.py; --popular or PLANNER_POPULAR=1 turns it on) without using the pool. Other
+recommendations are cached per worker and in a SQLite file shared by the workers
+(see result_cache.py; --no-result-cache turns it off).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from catalog import load_catalog
+from metrics import drain, increment, merge, prometheus_text, span
+from planning import (
+    InvalidRequest, geometry_request, optimize_request, parse_request, popular_request, recommend_request,
+    similar_request
+)
+from popular import POPULAR_ENABLED, PopularItineraries
+from result_cache import ResultCache, canonical_request
+from profiling import profile_request, profiling_enabled
+
+# Catalog used inside worker processes (inherited copy-on-write under fork)
+_CATALOG = None
+# Recommendation cache of each worker process; its SQLite tier is shared by all of them
+_RESULT_CACHE = None
+
+
+def _init_worker(use_result_cache=True):
+    global _CATALOG, _RESULT_CACHE
+    drain()  # Forked workers start with a copy of the parent's metrics: do not send them back
+    if _CATALOG is None:
+        _CATALOG = load_catalog().warm()
+    if use_result_cache and _RESULT_CACHE is None:
+        _RESULT_CACHE = ResultCache()
+
+
+def _recommend_job(record, profile=False):
+    with profile_request('recommend', enabled=profile):
+        return recommend_request(_CATALOG, record, _RESULT_CACHE)
+
+
+def _optimize_job(record, profile=False):
+    with profile_request('optimize', enabled=profile):
+        return optimize_request(record)
+
+
+def _similar_job(record, profile=False):
+    with profile_request('similar', enabled=profile):
+        return similar_request(_CATALOG, record)
+
+
+def _geometry_job(record, profile=False):
+    with profile_request('geometry', enabled=profile):
+        return geometry_request(record)
+
+
+def _run_job(job, record, profile=False):
+    """Run a job in a worker: (result, exception, metrics recorded meanwhile).
+    The parent merges the metrics into its own registry (see _unwrap)."""
+    try:
+        result = job(record, profile)
+    except Exception as e:
+        return None, e, drain()
+    return result, None, drain()
+
+
+def _unwrap(job_future, future):
+    """Complete future from a _run_job future, merging the worker's metrics once"""
+    try:
+        result, error, delta = job_future.result()
+    except BaseException as e:  # The job never ran (e.g. cancelled or a broken pool)
+        future.set_exception(e)
+        return
+    merge(delta)
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class Saturated(Exception):
+    """Raised when the service already has max_pending jobs queued"""
+
+
+class PlannerService:
+    """Worker pools plus in-flight request coalescing and admission control"""
+
+    def __init__(self, workers, max_pending, geometry_threads=16, popular=None, result_cache=True):
+        self.cpu_pool = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(result_cache,)
+        )
+        # ORS calls are network-bound, so geometry runs on threads
+        self.io_pool = ThreadPoolExecutor(max_workers=geometry_threads)
+        self.max_pending = max_pending
+        self.result_cache = result_cache
+        self.popular = popular  # Optional PopularItineraries, set once the pool is running
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.stats = {'requests': 0, 'coalesced': 0, 'rejected': 0, 'errors': 0, 'popular': 0}
+        # Start the worker processes now, while the parent is still single-threaded
+        self.cpu_pool.submit(int).result()
+
+    @property
+    def pending(self):
+        return len(self._in_flight)
+
+    def submit(self, endpoint, record, profile=False):
+        """Future for the result of endpoint(record), shared with identical in-flight requests"""
+        if endpoint == 'recommend' and self.popular is not None and not profile:
+            result = popular_request(self.popular, record)
+            if result is not None:
+                with self._lock:
+                    self.stats['requests'] += 1
+                    self.stats['popular'] += 1
+                future = Future()
+                future.set_result(result)
+                return future
+        key = (endpoint, self.request_key(endpoint, record), profile)
+        with self._lock:
+            self.stats['requests'] += 1
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.stats['coalesced'] += 1
+                return future
+            if len(self._in_flight) >= self.max_pending:
+                self.stats['rejected'] += 1
+                raise Saturated()
+            if endpoint == 'geometry':
+                # Runs on a thread of this process: its metrics land here directly
+                future = self.io_pool.submit(_geometry_job, record, profile)
+            else:
+                job = {'recommend': _recommend_job, 'optimize': _optimize_job, 'similar': _similar_job}[endpoint]
+                future = Future()
+                job_future = self.cpu_pool.submit(_run_job, job, record, profile)
+                job_future.add_done_callback(lambda done, future=future: _unwrap(done, future))
+            self._in_flight[key] = future
+        future.add_done_callback(lambda _: self._done(key))
+        return future
+
+    def request_key(self, endpoint, record):
+        """Key shared by identical requests, whatever their client id. Recommendations
+        use the parsed request, canonical when results are cached (the result is then
+        planned for the canonical request anyway)."""
+        if endpoint == 'recommend':
+            request = parse_request(record)
+            return json.dumps(canonical_request(request) if self.result_cache else request, sort_keys=True)
+        return json.dumps({k: v for k, v in record.items() if k != 'id'}, sort_keys=True)
+
+    def _done(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def count_error(self):
+        with self._lock:
+            self.stats['errors'] += 1
+
+    def shutdown(self):
+        self.cpu_pool.shutdown(cancel_futures=True)
+        self.io_pool.shutdown(cancel_futures=True)
+
+
+class PlannerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive connections
+    endpoints = ('recommend', 'optimize', 'geometry', 'similar')
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, allow_nan=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.rstrip('/')
+        if path == '/metrics':
+            body = prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if path != '/health':
+            self._send_json(404, {'error': 'Not found'})
+            return
+        service = self.server.service
+        self._send_json(200, {
+            'status': 'ok',
+            'catalog_version': self.server.catalog.version,
+            'pending': service.pending,
+            'popular_ready': service.popular is not None and service.popular.ready,
+            **service.stats,
+        })
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        endpoint = url.path.strip('/')
+        profile = profiling_enabled(dict(parse_qsl(url.query)))
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        if endpoint not in self.endpoints:
+            self._send_json(404, {'error': 'Not found'})
+            return
+        try:
+            record = json.loads(raw or b'{}')
+            if not isinstance(record, dict):
+                raise ValueError("Request body must be a JSON object")
+        except ValueError as e:
+            self._send_json(400, {'error': f"Invalid JSON: {e}"})
+            return
+
+        service = self.server.service
+        # Timed in the parent process: queueing plus the worker's run time
+        with span(f'service.{endpoint}'):
+            try:
+                result = service.submit(endpoint, record, profile).result(timeout=self.server.request_timeout)
+            except Saturated:
+                status = 503
+                self._send_json(503, {'error': 'Service saturated, retry later'}, {'Retry-After': '1'})
+            except InvalidRequest as e:
+                status = 400
+                self._send_json(400, {'error': str(e)})
+            except Exception as e:
+                status = 500
+                service.count_error()
+                self._send_json(500, {'error': str(e)})
+            else:
+                status = 200
+                # Coalesced requests share a result: answer with this request's own id
+                self._send_json(200, dict(result, id=record.get('id')))
+        increment('service_responses', endpoint=endpoint, status=status)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class PlannerServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, catalog, service, request_timeout=30.0, verbose=False):
+        super().__init__(address, PlannerHandler)
+        self.catalog = catalog
+        self.service = service
+        self.request_timeout = request_timeout
+        self.verbose = verbose
+
+
+def main(argv=None):
+    global _CATALOG
+    parser = argparse.ArgumentParser(description="Run the itinerary planning HTTP service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes (default: all cores)")
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help="queued jobs before answering 503 (default: 8 x workers)")
+    parser.add_argument('--timeout', type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument('--verbose', action='store_true', help="log every request")
+    parser.add_argument('--popular', action='store_true', default=POPULAR_ENABLED,
+                        help="precompute popular itineraries (default: PLANNER_POPULAR=1)")
+    parser.add_argument('--no-result-cache', action='store_true', help="do not cache recommendation results")
+    args = parser.parse_args(argv)
+
+    # Preload before the pool forks so workers inherit the warmed catalog
+    _CATALOG = load_catalog().warm()
+    service = PlannerService(
+        args.workers, args.max_pending or 8 * args.workers, result_cache=not args.no_result_cache
+    )
+    if args.popular:
+        # Started after the pool so workers fork from a single-threaded parent
+        service.popular = PopularItineraries(_CATALOG).start()
+    server = PlannerServer((args.host, args.port), _CATALOG, service, args.timeout, args.verbose)
+    print(f"Planner service on http://{args.host}:{args.port} ({args.workers} workers)", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == '__main__':
+    # Prefer fork so workers share the parent's catalog copy-on-write
+    if 'fork' in multiprocessing.get_all_start_methods():
+        multiprocessing.set_start_method('fork')
+    main()
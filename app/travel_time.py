@@ -0,0 +1,77 @@
+"""Travel-time model: driving speed by distance band, region and hour of day.
+
+Speeds come from a precomputed (regions x distance bands x 24 hours) lookup
+table, so whole distance matrices are converted to hours with one indexed
+gather instead of per-leg Python calls. Without a departure hour the model
+falls back to the flat AVG_SPEED_KMH used before it existed.
+
+Distances are straight-line (Haversine) km, so the speeds are effective speeds
+over the straight line: short legs crawl through towns, long legs use the
+A2 / expressway, and the Galle road corridor slows down most at rush hour.
+"""
+import numpy as np
+
+# Flat average speed (km/h), used when no departure hour is known
+AVG_SPEED_KMH = 40
+
+# Regions along the south coast, split by longitude: Hikkaduwa-Galle-Ahangama,
+# Weligama-Mirissa-Matara, Tangalle-Hambantota-Tissamaharama
+REGIONS = ('galle', 'matara', 'east')
+REGION_EDGES_LON = np.array([80.35, 80.65])
+# Lower edges (km) of the distance bands: town streets, local roads, coast road, long distance
+DISTANCE_BANDS_KM = np.array([0.0, 3.0, 15.0, 40.0])
+
+# Off-peak effective speed (km/h) per region (rows) and distance band (columns)
+BASE_SPEED_KMH = np.array([
+    [20.0, 28.0, 35.0, 45.0],
+    [22.0, 30.0, 38.0, 48.0],
+    [28.0, 36.0, 45.0, 55.0],
+])
+# Speed factor per hour of day: free-flowing nights, morning and evening rush hours
+HOUR_FACTORS = np.array([
+    1.2, 1.2, 1.2, 1.2, 1.2, 1.2,        # 00-05
+    1.0, 0.7, 0.7, 0.7, 0.95, 0.95,      # 06-11
+    0.95, 0.95, 0.95, 0.95, 0.65, 0.65,  # 12-17
+    0.65, 0.65, 0.9, 0.9, 1.1, 1.1,      # 18-23
+])
+# How much of the rush-hour slowdown applies per region (the east has lighter traffic)
+RUSH_SEVERITY = np.array([1.0, 0.8, 0.5])
+
+# SPEED_KMH[region, band, hour]
+SPEED_KMH = BASE_SPEED_KMH[:, :, np.newaxis] * (
+    1 - (1 - HOUR_FACTORS[np.newaxis, np.newaxis, :]) * RUSH_SEVERITY[:, np.newaxis, np.newaxis]
+)
+
+
+def region_index(longitude):
+    """Region (index into REGIONS) of each longitude"""
+    return np.searchsorted(REGION_EDGES_LON, longitude, side='right')
+
+
+def band_index(distance_km):
+    """Distance band (index into DISTANCE_BANDS_KM) of each distance"""
+    return np.searchsorted(DISTANCE_BANDS_KM, distance_km, side='right') - 1
+
+
+def travel_hours(distance_km, from_lon=None, to_lon=None, hour=None):
+    """Driving time (hours) for distances (km), vectorized over broadcastable arrays.
+
+    With hour (hour of day at departure, may be fractional or past 24) the
+    speed is looked up by band, region (of the leg's midpoint) and hour;
+    without it every leg uses AVG_SPEED_KMH.
+    """
+    if hour is None:
+        return distance_km / AVG_SPEED_KMH
+    distance_km = np.asarray(distance_km, dtype=float)
+    region = region_index((np.asarray(from_lon, dtype=float) + np.asarray(to_lon, dtype=float)) / 2)
+    hour_of_day = np.floor(hour).astype(int) % 24
+    return distance_km / SPEED_KMH[region, band_index(distance_km), hour_of_day]
+
+
+def hourly_time_matrices(distance_matrix, longitudes):
+    """(24 x n x n) driving times (hours) between n points for departures at each hour of day"""
+    distance_matrix = np.asarray(distance_matrix, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    region = region_index((longitudes[:, np.newaxis] + longitudes[np.newaxis, :]) / 2)
+    speeds = SPEED_KMH[region, band_index(distance_matrix)]  # (n x n x 24)
+    return distance_matrix[np.newaxis, :, :] / np.moveaxis(speeds, 2, 0)
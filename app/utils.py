@@ -1,4 +1,5 @@
 from math import radians, cos, sin, asin, sqrt
+import numpy as np
 
 def haversine_distance(a, b):
     lat1, lon1 = a['Latitude'], a['Longitude']
@@ -10,3 +11,13 @@ def haversine_distance(a, b):
     c = 2 * asin(sqrt(a))
     r = 6371
     return c * r
+
+def haversine_vectorized(lat1, lon1, lat2, lon2):
+    """Vectorized Haversine distance (km); inputs broadcast like numpy arrays."""
+    lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    c = 2 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    r = 6371
+    return c * r
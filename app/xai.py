@@ -1,62 +1,148 @@
-import streamlit as st
+import numpy as np
+import pandas as pd
+
+# Columns compared between selected and non-selected attractions
+DECISION_FACTOR_COLUMNS = ['AvgVisitTimeHrs', 'Cost', 'Popularity']
+
+def selected_ids(explanation_data):
+    """Ids of the picked attractions, in pick order"""
+    return [step['attraction_id'] for step in explanation_data.get('selection_steps', [])]
+
+def greedy_plan(explanation_data):
+    """True if the attractions were picked by the efficiency-score greedy (the default)"""
+    return explanation_data.get('selection', {}).get('method', 'greedy') == 'greedy'
+
+def explanation_frame(data, explanation_data):
+    """Candidate rows of an explanation record with their content_score, cluster and
+    hybrid_score columns, rebuilt from the attraction data (e.g. catalog.data).
+    Candidates removed from the data since the record was made are skipped.
+    """
+    ids = explanation_data['candidate_ids']
+    present = np.isin(ids, data.index)
+    frame = data.loc[ids[present]].copy()
+    frame['content_score'] = explanation_data['content_scores'][present]
+    frame['cluster'] = explanation_data['clusters'][present]
+    frame['hybrid_score'] = explanation_data['hybrid_scores'][present]
+    return frame
+
+def decision_statistics(data, explanation_data):
+    """Comparison statistics of the selected attractions vs. the other candidates,
+    computed in one vectorized pass over id masks:
+    - 'factors': {column: {'selected', 'alternatives', 'difference'}} of the
+      DECISION_FACTOR_COLUMNS means, or None without both selected and other candidates
+    - 'by_category' / 'by_cluster': one row per group with candidate and selected
+      counts and the mean hybrid score of its selected and other candidates
+    """
+    ids = explanation_data['candidate_ids']
+    present = np.isin(ids, data.index)
+    positions = data.index.get_indexer(ids[present])
+    selected = np.isin(ids[present], selected_ids(explanation_data))
+    hybrid_scores = explanation_data['hybrid_scores'][present].astype(float)
+    n_selected = int(selected.sum())
+    n_alternatives = len(selected) - n_selected
+
+    factors = None
+    if n_selected and n_alternatives:
+        columns = [c for c in DECISION_FACTOR_COLUMNS if c in data.columns]
+        values = data[columns].to_numpy(dtype=float)[positions]
+        # Sums for both groups at once: (2 x candidates) @ (candidates x columns)
+        groups = np.vstack([selected, ~selected]).astype(float)
+        means = (groups @ values) / np.array([[n_selected], [n_alternatives]])
+        factors = {
+            column: {
+                'selected': float(means[0, j]),
+                'alternatives': float(means[1, j]),
+                'difference': float(means[0, j] - means[1, j]),
+            }
+            for j, column in enumerate(columns)
+        }
+
+    def breakdown(codes, labels):
+        n_groups = len(labels)
+        candidates = np.bincount(codes, minlength=n_groups)
+        picked = np.bincount(codes, weights=selected, minlength=n_groups)
+        picked_score = np.bincount(codes, weights=hybrid_scores * selected, minlength=n_groups)
+        other_score = np.bincount(codes, weights=hybrid_scores * ~selected, minlength=n_groups)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            picked_mean = picked_score / picked
+            other_mean = other_score / (candidates - picked)
+        return [
+            {
+                'group': labels[g],
+                'candidates': int(candidates[g]),
+                'selected': int(picked[g]),
+                'selected_score': None if np.isnan(picked_mean[g]) else float(picked_mean[g]),
+                'other_score': None if np.isnan(other_mean[g]) else float(other_mean[g]),
+            }
+            for g in np.argsort(-picked, kind='stable') if candidates[g]
+        ]
+
+    category_codes, categories = pd.factorize(data['Category'].to_numpy()[positions])
+    cluster_codes, clusters = pd.factorize(explanation_data['clusters'][present])
+    return {
+        'factors': factors,
+        'by_category': breakdown(category_codes, list(categories)),
+        'by_cluster': breakdown(cluster_codes, [int(c) for c in clusters]),
+    }
+
+def cached_decision_statistics(data, explanation_data, data_version=None):
+    """decision_statistics, computed once per itinerary and kept in its explanation record"""
+    cached = explanation_data.get('decision_stats')
+    if cached is None or cached[0] != data_version:
+        cached = (data_version, decision_statistics(data, explanation_data))
+        explanation_data['decision_stats'] = cached
+    return cached[1]
 
 class XAIExplainer:
     """Simplified XAI focused on user-friendly explanations for tourists"""
     def __init__(self):
         pass
     
-    def show_decision_factors(self, selected_route, all_filtered_data):
-        """Show why specific attractions were selected vs others"""
+    def show_decision_factors(self, data, explanation_data, data_version=None):
+        """Show why specific attractions were selected vs others.
+        Statistics come from cached_decision_statistics, so reruns only render.
+        """
+        import streamlit as st
+
         st.markdown("### 🤔 **Decision Factors**: Why These Attractions?")
         
-        if len(selected_route) > 0 and len(all_filtered_data) > len(selected_route):
-            selected_names = selected_route['Name'].tolist()
-            selected_data = all_filtered_data[all_filtered_data['Name'].isin(selected_names)]
-            not_selected_data = all_filtered_data[~all_filtered_data['Name'].isin(selected_names)]
-            
+        stats = cached_decision_statistics(data, explanation_data, data_version)
+        factors = stats['factors']
+        if factors is not None:
             st.markdown("**🎯 Selection Analysis:** Here's how your chosen attractions compare to alternatives:")
             
             col1, col2, col3 = st.columns(3)
             
             # Time comparison
-            if 'AvgVisitTimeHrs' in selected_data.columns:
+            if 'AvgVisitTimeHrs' in factors:
                 with col1:
-                    selected_time = selected_data['AvgVisitTimeHrs'].mean()
-                    rejected_time = not_selected_data['AvgVisitTimeHrs'].mean()
-                    time_diff = selected_time - rejected_time
-                    
+                    time_factor = factors['AvgVisitTimeHrs']
                     st.metric(
                         "⏱️ Visit Duration",
-                        f"{selected_time:.1f} hours",
-                        f"{time_diff:+.1f}h vs alternatives",
+                        f"{time_factor['selected']:.1f} hours",
+                        f"{time_factor['difference']:+.1f}h vs alternatives",
                         delta_color="normal"
                     )
             
             # Cost comparison  
-            if 'Cost' in selected_data.columns:
+            if 'Cost' in factors:
                 with col2:
-                    selected_cost = selected_data['Cost'].mean()
-                    rejected_cost = not_selected_data['Cost'].mean()
-                    cost_diff = selected_cost - rejected_cost
-                    
+                    cost_factor = factors['Cost']
                     st.metric(
                         "💰 Average Cost",
-                        f"LKR {selected_cost:,.0f}",
-                        f"LKR {cost_diff:+,.0f} vs alternatives",
+                        f"LKR {cost_factor['selected']:,.0f}",
+                        f"LKR {cost_factor['difference']:+,.0f} vs alternatives",
                         delta_color="inverse"  # Lower cost is better
                     )
             
             # Popularity comparison
-            if 'Popularity' in selected_data.columns:
+            if 'Popularity' in factors:
                 with col3:
-                    selected_pop = selected_data['Popularity'].mean()
-                    rejected_pop = not_selected_data['Popularity'].mean()
-                    pop_diff = selected_pop - rejected_pop
-                    
+                    pop_factor = factors['Popularity']
                     st.metric(
                         "⭐ Popularity Rating", 
-                        f"{selected_pop:.1f}/10",
-                        f"{pop_diff:+.1f} vs alternatives",
+                        f"{pop_factor['selected']:.1f}/10",
+                        f"{pop_factor['difference']:+.1f} vs alternatives",
                         delta_color="normal"
                     )
             
@@ -75,4 +161,52 @@ class XAIExplainer:
             """)
         
         else:
-            st.info("📊 Decision factor analysis requires multiple alternative attraction options to compare.")
\ No newline at end of file
+            st.info("📊 Decision factor analysis requires multiple alternative attraction options to compare.")
+
+        # Where the picks came from: per-category and per-cluster breakdowns
+        if stats['by_category']:
+            col1, col2 = st.columns(2)
+            with col1:
+                st.markdown("**📂 By category**")
+                st.table(self._breakdown_rows(stats['by_category'], "Category"))
+            with col2:
+                st.markdown("**🧩 By cluster** (similar location, duration and cost)")
+                st.table(self._breakdown_rows(stats['by_cluster'], "Cluster"))
+
+    def show_candidate_scores(self, data, explanation_data):
+        """Table of every scored candidate (picked ones first, then by hybrid score),
+        rebuilt from the data with explanation_frame when the user asks for it."""
+        import streamlit as st
+
+        if not st.checkbox("Show every candidate's scores", key='show_candidate_scores'):
+            return
+        frame = explanation_frame(data, explanation_data)
+        columns = [c for c in ['Name', 'Category', 'Cost', 'AvgVisitTimeHrs', 'Popularity'] if c in frame.columns]
+        frame = frame[columns + ['content_score', 'cluster', 'hybrid_score']]
+        frame.insert(0, 'Picked', frame.index.isin(selected_ids(explanation_data)))
+        frame = frame.sort_values(['Picked', 'hybrid_score'], ascending=False)
+        st.dataframe(
+            frame.rename(columns={
+                'AvgVisitTimeHrs': 'Visit hours', 'content_score': 'Match', 'cluster': 'Cluster',
+                'hybrid_score': 'Hybrid score',
+            }),
+            hide_index=True,
+            column_config={
+                'Match': st.column_config.NumberColumn(format="%.3f"),
+                'Hybrid score': st.column_config.NumberColumn(format="%.3f"),
+            },
+        )
+
+    @staticmethod
+    def _breakdown_rows(groups, label):
+        def score(value):
+            return "–" if value is None else f"{value:.2f}"
+        return [
+            {
+                label: group['group'],
+                "Picked": f"{group['selected']} of {group['candidates']}",
+                "Avg score (picked)": score(group['selected_score']),
+                "Avg score (others)": score(group['other_score']),
+            }
+            for group in groups
+        ]
\ No newline at end of file
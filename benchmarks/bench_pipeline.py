@@ -0,0 +1,283 @@
+"""Benchmark every pipeline stage on synthetic catalogs.
+
+Usage:
+    python benchmarks/bench_pipeline.py --sizes 100 1000 10000 --save benchmarks/results/latest.json
+    python benchmarks/bench_pipeline.py --sizes 100 1000 10000 --compare benchmarks/results/latest.json
+
+Generates reproducible attraction catalogs (coordinates spread around real
+south-coast towns, templated descriptions), then times each stage and records
+its peak traced memory. Results are written as JSON; --compare flags stages
+that got slower or bigger than a previous run by more than --tolerance and
+exits non-zero if any did. Road geometry is served by a local ORS stand-in.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'app'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sklearn.feature_extraction.text import TfidfVectorizer  # noqa: E402
+
+from catalog import Catalog  # noqa: E402
+from data_loader import load_data  # noqa: E402
+from hybrid_recommender import (  # noqa: E402
+    find_optimal_k_simple,
+    iter_greedy_selection,
+    prepare_candidates,
+    prepare_kmeans_features_v3,
+)
+from map_visualizer import build_map, clear_geometry_cache  # noqa: E402
+from ors_stub import start_ors_stub  # noqa: E402
+from route_optimizer import haversine_matrix, solve_tsp  # noqa: E402
+
+# (name, lat, lon) of towns attractions cluster around
+TOWNS = [
+    ('Galle', 6.0329, 80.2168), ('Unawatuna', 6.0106, 80.2496), ('Weligama', 5.9749, 80.4297),
+    ('Mirissa', 5.9483, 80.4716), ('Matara', 5.9549, 80.5550), ('Tangalle', 6.0243, 80.7941),
+    ('Hambantota', 6.1241, 81.1185), ('Tissamaharama', 6.2783, 81.2870), ('Hikkaduwa', 6.1395, 80.1063),
+]
+CATEGORIES = ['Beach', 'Historical', 'Wildlife', 'Nature', 'Cultural', 'Adventure', 'Surf Spot', 'Landmark']
+WORDS = {
+    'Beach': ['golden', 'sands', 'coral', 'reef', 'snorkeling', 'sunset', 'palm', 'lagoon', 'swimming', 'waves'],
+    'Historical': ['colonial', 'fort', 'ancient', 'ruins', 'dutch', 'temple', 'heritage', 'museum', 'ramparts'],
+    'Wildlife': ['leopards', 'elephants', 'birds', 'safari', 'turtles', 'sanctuary', 'crocodiles', 'jungle'],
+    'Nature': ['waterfall', 'rainforest', 'hiking', 'tea', 'mountain', 'river', 'mangroves', 'views'],
+    'Cultural': ['festival', 'masks', 'crafts', 'buddhist', 'village', 'market', 'dance', 'cuisine'],
+    'Adventure': ['kayaking', 'zipline', 'diving', 'rafting', 'climbing', 'cycling', 'trekking'],
+    'Surf Spot': ['surf', 'breaks', 'lessons', 'swell', 'boards', 'reef', 'beginners'],
+    'Landmark': ['lighthouse', 'bridge', 'clock', 'tower', 'viewpoint', 'harbour', 'statue'],
+}
+FILLER = ['a', 'popular', 'spot', 'known', 'for', 'its', 'and', 'with', 'scenic', 'local', 'visitors', 'famous']
+
+ROUTE_SIZE = 12
+# Stages whose cost is quadratic in rows run on a capped sample
+STAGE_MAX_ROWS = {'haversine_matrix': 2000}
+
+
+def make_synthetic_catalog(n, seed=0):
+    """Attraction catalog with n rows in the same schema as data/attractions.csv"""
+    rng = np.random.default_rng(seed)
+    towns = rng.integers(len(TOWNS), size=n)
+    town_lat = np.array([t[1] for t in TOWNS])[towns]
+    town_lon = np.array([t[2] for t in TOWNS])[towns]
+    categories = rng.choice(CATEGORIES, size=n)
+
+    descriptions = []
+    for category in categories:
+        words = list(rng.choice(WORDS[category], size=rng.integers(3, 7))) + list(rng.choice(FILLER, size=6))
+        rng.shuffle(words)
+        descriptions.append(" ".join(words).capitalize() + ".")
+
+    is_free = rng.random(n) < 0.45
+    return pd.DataFrame({
+        'Name': [f"{TOWNS[t][0]} {c} {i}" for i, (t, c) in enumerate(zip(towns, categories))],
+        'Category': categories,
+        'Latitude': np.round(town_lat + rng.normal(0, 0.04, n), 6),
+        'Longitude': np.round(town_lon + rng.normal(0, 0.06, n), 6),
+        'Description': descriptions,
+        'Cost': np.where(is_free, 0, rng.choice([200, 500, 1000, 1500, 2500, 3500, 5000], size=n)),
+        'AvgVisitTimeHrs': rng.choice([0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 4.0], size=n),
+        'Popularity': rng.integers(3, 11, size=n),
+        'Crowded': rng.choice(['Yes', 'No'], size=n),
+    })
+
+
+# ===== STAGES =====
+# Each setup(ctx) does untimed preparation and returns the callable to time.
+
+def setup_load_data(ctx):
+    return lambda: load_data(ctx['csv_path'])
+
+def setup_tfidf_fit(ctx):
+    data = ctx['data']
+    profile = " ".join(data[data['Category'] == 'Beach']['Description'])
+    documents = [profile] + data['Description'].tolist()
+    return lambda: TfidfVectorizer(stop_words='english').fit_transform(documents)
+
+def setup_catalog_build(ctx):
+    return lambda: Catalog(ctx['data'])
+
+def setup_content_scores(ctx, model):
+    catalog = ctx['catalog']
+    if model == 'lsa':
+        catalog.embedding_index  # fitted once, like a prebuilt catalog
+    catalog.content_scores(['Beach'], model=model)  # cached TF-IDF matrix
+    return lambda: catalog.content_scores(['Beach', 'Historical'], model=model)
+
+def setup_nearest_lsa(ctx):
+    catalog = ctx['catalog']
+    catalog.embedding_index
+    return lambda: catalog.nearest("colonial fort with ramparts and a museum", top_n=10)
+
+def setup_find_optimal_k(ctx):
+    features = prepare_kmeans_features_v3(ctx['data'])
+    return lambda: find_optimal_k_simple(features)
+
+def setup_greedy_selection(ctx):
+    catalog = ctx['catalog']
+    candidates, start, _ = prepare_candidates(
+        catalog.data, ['Beach', 'Historical'], 8, 5000, None, (6.03, 80.22), catalog
+    )
+    return lambda: list(iter_greedy_selection(candidates, start, 8, 5000))
+
+def setup_haversine_matrix(ctx):
+    locations = ctx['data'][['Latitude', 'Longitude', 'Name']].iloc[:STAGE_MAX_ROWS['haversine_matrix']]
+    return lambda: haversine_matrix(locations)
+
+def setup_solve_tsp(ctx):
+    # Same call optimize_route makes: travel-time limit only, no visit durations
+    distance_matrix = haversine_matrix(ctx['route'])
+    return lambda: solve_tsp(distance_matrix, time_limit=8 * 60)
+
+def setup_build_map(ctx):
+    def run():
+        clear_geometry_cache()
+        return build_map(ctx['route'])
+    return run
+
+STAGES = [
+    ('load_data', setup_load_data),
+    ('tfidf_fit', setup_tfidf_fit),
+    ('catalog_build', setup_catalog_build),
+    ('content_scores_tfidf', lambda ctx: setup_content_scores(ctx, 'tfidf')),
+    ('content_scores_lsa', lambda ctx: setup_content_scores(ctx, 'lsa')),
+    ('nearest_lsa', setup_nearest_lsa),
+    ('find_optimal_k_simple', setup_find_optimal_k),
+    ('greedy_selection', setup_greedy_selection),
+    ('haversine_matrix', setup_haversine_matrix),
+    ('solve_tsp', setup_solve_tsp),
+    ('build_map', setup_build_map),
+]
+
+
+def measure(fn, repeats, trace_memory):
+    """Best wall time over repeats, plus peak traced memory (MB) from one extra run"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    peak_mb = None
+    if trace_memory:
+        tracemalloc.start()
+        fn()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return best, peak_mb
+
+
+def run_size(n, stages, repeats, trace_memory, seed, workdir):
+    data = make_synthetic_catalog(n, seed)
+    csv_path = os.path.join(workdir, f"attractions_{n}.csv")
+    data.to_csv(csv_path, index=False)
+    ctx = {'csv_path': csv_path, 'data': data}
+    ctx['catalog'] = Catalog(data)
+    # Route stages use the stops nearest Galle, so every size routes a comparable, feasible trip
+    galle = TOWNS[0]
+    nearest = ((data['Latitude'] - galle[1])**2 + (data['Longitude'] - galle[2])**2).nsmallest(ROUTE_SIZE).index
+    ctx['route'] = data.loc[nearest]
+
+    results = {}
+    for name, setup in STAGES:
+        if stages and name not in stages:
+            continue
+        fn = setup(ctx)
+        seconds, peak_mb = measure(fn, repeats if n < 10000 else 1, trace_memory)
+        results[name] = {
+            'seconds': round(seconds, 6),
+            'peak_mb': None if peak_mb is None else round(peak_mb, 3),
+            'rows': min(n, STAGE_MAX_ROWS.get(name, n)),
+        }
+        memory = '' if peak_mb is None else f", peak {peak_mb:.1f} MB"
+        print(f"  {name:<24} {seconds * 1000:10.2f} ms{memory}", file=sys.stderr)
+    return results
+
+
+def compare(baseline, current, tolerance, min_seconds=0.005, min_mb=1.0):
+    """List of regression messages for stages slower/bigger than the baseline"""
+    regressions = []
+    for size, stages in current['results'].items():
+        for stage, now in stages.items():
+            before = baseline.get('results', {}).get(size, {}).get(stage)
+            if before is None:
+                continue
+            if now['seconds'] > before['seconds'] * (1 + tolerance) and now['seconds'] - before['seconds'] > min_seconds:
+                regressions.append(
+                    f"{stage} @ {size} rows: {before['seconds'] * 1000:.2f} ms -> {now['seconds'] * 1000:.2f} ms"
+                )
+            if (now.get('peak_mb') is not None and before.get('peak_mb') is not None
+                    and now['peak_mb'] > before['peak_mb'] * (1 + tolerance)
+                    and now['peak_mb'] - before['peak_mb'] > min_mb):
+                regressions.append(
+                    f"{stage} @ {size} rows: peak {before['peak_mb']:.1f} MB -> {now['peak_mb']:.1f} MB"
+                )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pipeline stages on synthetic catalogs")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--stages', nargs='+', choices=[name for name, _ in STAGES], help="subset of stages")
+    parser.add_argument('--repeats', type=int, default=3, help="timed repeats for catalogs under 10k rows")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc pass")
+    parser.add_argument('--save', help="write results JSON to this path")
+    parser.add_argument('--compare', help="baseline JSON to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed relative slowdown")
+    args = parser.parse_args(argv)
+
+    stub, base_url = start_ors_stub()
+    os.environ['OPENROUTESERVICE_BASE_URL'] = base_url
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in args.sizes:
+            print(f"{n} rows", file=sys.stderr)
+            # find_optimal_k_simple prints a debug log for every call
+            with contextlib.redirect_stdout(io.StringIO()):
+                results[str(n)] = run_size(n, args.stages, args.repeats, not args.no_memory, args.seed, workdir)
+    stub.shutdown()
+
+    report = {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved results to {args.save}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        if regressions:
+            return 1
+        print("No regressions against baseline", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
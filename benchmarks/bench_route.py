@@ -0,0 +1,93 @@
+"""Compare the parallel route portfolio with single searches by route size.
+
+Usage:
+    python benchmarks/bench_route.py --stops 10 30 60 --save benchmarks/results/route.json
+
+For every route size, random attractions of a synthetic catalog are routed by
+route_optimizer.solve_tsp three ways:
+  - single: the default search (cheapest arc, greedy descent, no deadline)
+  - gls: one cheapest arc + guided local search with the portfolio's deadline,
+    the single-process search the portfolio has to beat
+  - portfolio: the PORTFOLIO searches in parallel (route_optimizer.PORTFOLIO_WORKERS
+    processes, PLANNER_ROUTE_PORTFOLIO_SECONDS deadline, early return)
+The table shows each runtime and the route distance relative to the shortest.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'app'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_pipeline import make_synthetic_catalog  # noqa: E402
+import route_optimizer  # noqa: E402
+
+
+def tour_km(distance_matrix, order):
+    """Length of the route through order (routes end at the last stop)"""
+    return float(sum(distance_matrix[a][b] for a, b in zip(order, order[1:])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the route portfolio with single searches")
+    parser.add_argument('--stops', type=int, nargs='+', default=[10, 30, 60])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help="write results JSON to this path")
+    args = parser.parse_args(argv)
+
+    data = make_synthetic_catalog(max(args.stops) * 10, seed=args.seed)
+    rng = np.random.default_rng(args.seed)
+    # Start the pool outside the timings, as a long-running process would have it
+    route_optimizer.portfolio_pool()
+
+    results = []
+    print(f"{'stops':>5} {'run':>3} {'mode':<9} {'runtime':>10} {'km':>9} {'vs best':>7}", file=sys.stderr)
+    for n in args.stops:
+        for repeat in range(args.repeats):
+            rows = data.iloc[rng.choice(len(data), n, replace=False)]
+            distance_matrix = route_optimizer.haversine_matrix(rows)
+            runs = []
+            for mode in ('single', 'gls', 'portfolio'):
+                start = time.perf_counter()
+                search = None
+                if mode == 'gls':
+                    search = {'first_solution': 'PATH_CHEAPEST_ARC', 'metaheuristic': 'GUIDED_LOCAL_SEARCH',
+                              'deadline': time.time() + route_optimizer.PORTFOLIO_DEADLINE_SECONDS}
+                order = route_optimizer.solve_tsp(distance_matrix, portfolio=mode == 'portfolio', search=search)
+                runs.append({'stops': n, 'repeat': repeat, 'mode': mode,
+                             'runtime_ms': (time.perf_counter() - start) * 1000,
+                             'km': tour_km(distance_matrix, order)})
+            best = min(run['km'] for run in runs) or 1.0
+            for run in runs:
+                run['relative_km'] = run['km'] / best
+                results.append(run)
+                print(f"{n:>5} {repeat:>3} {run['mode']:<9} {run['runtime_ms']:>8.1f}ms {run['km']:>9.1f} "
+                      f"{run['relative_km']:>7.1%}", file=sys.stderr)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({
+                'meta': {
+                    'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'cpu_count': os.cpu_count(),
+                    'portfolio_workers': route_optimizer.PORTFOLIO_WORKERS,
+                    'portfolio_seconds': route_optimizer.PORTFOLIO_DEADLINE_SECONDS,
+                },
+                'results': results,
+            }, f, indent=2)
+        print(f"Saved results to {args.save}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Compare the greedy and the exact selection methods by request size.
+
+Usage:
+    python benchmarks/bench_selection.py --sizes 90 1000 10000 --save benchmarks/results/selection.json
+
+For every synthetic catalog size and time limit, each method of
+hybrid_recommender.SELECTION_METHODS runs on the same prepared candidates
+(see compare_selection); the table shows its runtime, the total hybrid score
+relative to the best method and how much of the time and budget it used.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'app'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_pipeline import make_synthetic_catalog  # noqa: E402
+from catalog import Catalog  # noqa: E402
+from hybrid_recommender import SELECTION_METHODS, compare_selection  # noqa: E402
+
+CATEGORIES = ['Beach', 'Historical']
+LOCATION = (6.03, 80.22)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare selection methods by request size")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[90, 1000, 10000])
+    parser.add_argument('--time-limits', type=float, nargs='+', default=[4, 8, 12])
+    parser.add_argument('--budget', type=float, default=5000)
+    parser.add_argument('--methods', nargs='+', choices=SELECTION_METHODS, default=list(SELECTION_METHODS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help="write results JSON to this path")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'rows':>7} {'hours':>5} {'method':<7} {'runtime':>10} {'picks':>5} {'score':>7} "
+          f"{'vs best':>7} {'hours used':>10} {'budget used':>11}  status", file=sys.stderr)
+    for n in args.sizes:
+        catalog = Catalog(make_synthetic_catalog(n, seed=args.seed)).warm()
+        for time_limit in args.time_limits:
+            rows = compare_selection(
+                catalog.data, CATEGORIES, time_limit, args.budget, None, LOCATION,
+                methods=args.methods, catalog=catalog
+            )
+            best = max((row['score'] for row in rows), default=0) or 1.0
+            for row in rows:
+                row.update({'rows': n, 'time_limit': time_limit, 'budget': args.budget,
+                            'relative_score': row['score'] / best})
+                results.append(row)
+                print(f"{n:>7} {time_limit:>5g} {row['method']:<7} {row['runtime_ms']:>8.1f}ms "
+                      f"{row['attractions']:>5} {row['score']:>7.2f} {row['relative_score']:>7.1%} "
+                      f"{row['hours'] / time_limit:>10.0%} {row['cost'] / args.budget:>11.0%}  {row['status']}",
+                      file=sys.stderr)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({
+                'meta': {
+                    'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'cpu_count': os.cpu_count(),
+                },
+                'results': results,
+            }, f, indent=2)
+        print(f"Saved results to {args.save}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Benchmark cold start: imports, catalog loading and the first itinerary.
+
+Usage:
+    python benchmarks/bench_startup.py --save benchmarks/results/startup.json
+    python benchmarks/bench_startup.py --compare benchmarks/results/startup.json
+
+Every stage runs in a fresh interpreter, the way a new container or worker
+process starts, and is timed end to end (interpreter start included); the best
+of --repeats runs is kept. The catalog artifact is built into a temporary
+directory first, so the artifact stages do not depend on a local build.
+--compare flags stages slower than a previous run by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APP_IMPORTS = "import catalog, hybrid_recommender, map_visualizer, pipeline, route_optimizer, xai"
+FIRST_ITINERARY = """
+from catalog import load_catalog
+from hybrid_recommender import hybrid_recommend
+from map_visualizer import build_map
+from route_optimizer import optimize_route
+catalog = load_catalog()
+recs = hybrid_recommend(catalog.data, ['Beach', 'Historical'], 8, 5000, None, (6.03, 80.22), catalog=catalog)
+build_map(optimize_route(recs, 8, start_location=(6.03, 80.22)))
+"""
+
+# name -> (code run in a fresh interpreter, uses the prebuilt artifact)
+STAGES = [
+    ('python_startup', "pass", False),
+    ('import_app_modules', APP_IMPORTS, False),
+    ('catalog_from_csv', "from catalog import load_catalog; load_catalog(artifact_path=None).warm()", False),
+    ('catalog_from_artifact', "from catalog import load_catalog; load_catalog().warm()", True),
+    ('first_itinerary_from_csv', FIRST_ITINERARY.replace("load_catalog()", "load_catalog(artifact_path=None)"), False),
+    ('first_itinerary_from_artifact', FIRST_ITINERARY, True),
+    ('streamlit_first_run', (
+        "from streamlit.testing.v1 import AppTest; "
+        f"AppTest.from_file({os.path.join(ROOT, 'app', 'main.py')!r}, default_timeout=120).run()"
+    ), True),
+]
+
+
+def run_stage(code, env, repeats):
+    """Best wall time (s) of running code in a fresh interpreter from the repo root"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, '-c', code], cwd=ROOT, env=env, check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def compare(baseline, current, tolerance, min_seconds=0.05):
+    """List of regression messages for stages slower than the baseline"""
+    regressions = []
+    for stage, now in current['results'].items():
+        before = baseline.get('results', {}).get(stage)
+        if before is None:
+            continue
+        if now['seconds'] > before['seconds'] * (1 + tolerance) and now['seconds'] - before['seconds'] > min_seconds:
+            regressions.append(f"{stage}: {before['seconds'] * 1000:.0f} ms -> {now['seconds'] * 1000:.0f} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark cold start of the planner")
+    parser.add_argument('--stages', nargs='+', choices=[name for name, _, _ in STAGES], help="subset of stages")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--save', help="write results JSON to this path")
+    parser.add_argument('--compare', help="baseline JSON to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed relative slowdown")
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        artifact = os.path.join(workdir, 'catalog.pkl')
+        subprocess.run(
+            [sys.executable, os.path.join('app', 'build_catalog.py'), '--out', artifact],
+            cwd=ROOT, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        base_env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, 'app'))
+        for name, code, uses_artifact in STAGES:
+            if args.stages and name not in args.stages:
+                continue
+            # A missing artifact path makes load_catalog fall back to the CSV
+            env = dict(base_env, PLANNER_CATALOG_ARTIFACT=artifact if uses_artifact else os.path.join(workdir, 'none'))
+            seconds = run_stage(code, env, args.repeats)
+            results[name] = {'seconds': round(seconds, 4)}
+            print(f"  {name:<30} {seconds * 1000:10.1f} ms", file=sys.stderr)
+
+    report = {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved results to {args.save}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        if regressions:
+            return 1
+        print("No regressions against baseline", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""Local load generator for app/service.py.
+
+Usage:
+    python app/service.py --port 8080 &
+    python benchmarks/load_service.py --url http://127.0.0.1:8080 --endpoint recommend --concurrency 32 --duration 20
+
+Sends a fixed mix of planning requests from concurrent keep-alive clients and
+reports throughput, latency percentiles and status codes (503 = backpressure).
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+CATEGORIES = ['Beach', 'Historical', 'Wildlife', 'Nature', 'Cultural', 'Adventure']
+
+STOPS = [
+    {'Name': 'Galle Dutch Fort', 'Latitude': 6.0269, 'Longitude': 80.217, 'AvgVisitTimeHrs': 2},
+    {'Name': 'Mirissa Beach', 'Latitude': 5.9485, 'Longitude': 80.455, 'AvgVisitTimeHrs': 3},
+    {'Name': 'Unawatuna Beach', 'Latitude': 6.0094, 'Longitude': 80.2488, 'AvgVisitTimeHrs': 2.5},
+]
+
+
+def make_payload(endpoint, rng, distinct):
+    """Request body; `distinct` bounds how many different bodies exist (repeats exercise coalescing)"""
+    seed = rng.randrange(distinct)
+    local = random.Random(seed)
+    if endpoint == 'recommend':
+        return {
+            'categories': local.sample(CATEGORIES, local.randint(1, 3)),
+            'time_limit': local.randint(2, 12),
+            'budget': local.choice([1000, 5000, 10000]),
+            'crowded': local.choice([None, 'Yes', 'No']),
+            'location': [round(5.95 + local.random() * 0.3, 4), round(80.2 + local.random(), 4)],
+        }
+    if endpoint == 'optimize':
+        return {'stops': local.sample(STOPS, 3), 'time_limit': 8, 'location': [6.03, 80.22]}
+    return {'points': [[s['Latitude'], s['Longitude']] for s in local.sample(STOPS, 3)]}
+
+
+def client(url, endpoint, deadline, distinct, latencies, statuses, lock, seed):
+    parsed = urlparse(url)
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=60)
+    while time.time() < deadline:
+        body = json.dumps(make_payload(endpoint, rng, distinct))
+        start = time.perf_counter()
+        try:
+            conn.request('POST', f'/{endpoint}', body, {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=60)
+            status = 'conn_error'
+        elapsed = time.perf_counter() - start
+        with lock:
+            statuses[status] += 1
+            if status == 200:
+                latencies.append(elapsed)
+        if status == 503:
+            time.sleep(0.05)
+    conn.close()
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the planning service")
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--endpoint', choices=['recommend', 'optimize', 'geometry'], default='recommend')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=20.0, help="seconds")
+    parser.add_argument('--distinct', type=int, default=500, help="number of distinct request bodies")
+    args = parser.parse_args(argv)
+
+    latencies, statuses, lock = [], Counter(), threading.Lock()
+    deadline = time.time() + args.duration
+    threads = [
+        threading.Thread(target=client, args=(args.url, args.endpoint, deadline, args.distinct,
+                                              latencies, statuses, lock, i))
+        for i in range(args.concurrency)
+    ]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    latencies.sort()
+    summary = {
+        'endpoint': args.endpoint,
+        'concurrency': args.concurrency,
+        'seconds': round(elapsed, 2),
+        'ok_per_second': round(statuses[200] / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'statuses': {str(k): v for k, v in statuses.items()},
+    }
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
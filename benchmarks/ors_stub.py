@@ -0,0 +1,49 @@
+"""Local stand-in for the OpenRouteService directions API.
+
+Answers POST /v2/directions/<profile>/geojson with a straight-line route
+(densified to a few points) after an optional fixed delay, so map building
+can be benchmarked offline and repeatably. Point the app at it with
+OPENROUTESERVICE_BASE_URL=http://127.0.0.1:<port>.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ORSStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        (lon1, lat1), (lon2, lat2) = body['coordinates'][:2]
+        steps = self.server.points_per_leg
+        coordinates = [
+            [lon1 + (lon2 - lon1) * i / (steps - 1), lat1 + (lat2 - lat1) * i / (steps - 1)]
+            for i in range(steps)
+        ]
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        payload = json.dumps({
+            'type': 'FeatureCollection',
+            'features': [{'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': coordinates}}],
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_ors_stub(port=0, latency=0.0, points_per_leg=20):
+    """Start the stub in a background thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), ORSStubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.points_per_leg = points_per_leg
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
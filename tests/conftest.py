@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'app'))
+# The catalog and its artifact are found relative to the repository root
+os.chdir(ROOT)
+
+
+@pytest.fixture(scope='session')
+def catalog():
+    from catalog import load_catalog
+    return load_catalog()
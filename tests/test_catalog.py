@@ -0,0 +1,85 @@
+"""Catalog deltas keep the derived models equal to a fresh rebuild."""
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from catalog import Catalog
+from data_loader import load_data
+
+CATEGORY_SETS = [['Beach'], ['Historical', 'Cultural'], ['Nature', 'Wildlife', 'Adventure']]
+
+
+@pytest.fixture
+def updated():
+    """A catalog with clusters and distances built, then appended to, patched and deleted from"""
+    catalog = Catalog(load_data())
+    for crowded_preference in (None, True, False):
+        catalog.cluster_state(crowded_preference)
+    catalog.distance_matrix
+    catalog.apply_delta({'op': 'append', 'rows': [
+        {'Name': 'Test Reef', 'Category': 'Beach', 'Latitude': 6.05, 'Longitude': 80.3,
+         'Description': 'Snorkeling over a shallow coral reef with turtles and reef sharks.',
+         'Cost': 500, 'AvgVisitTimeHrs': 2.0, 'Popularity': 7, 'Crowded': 'No'},
+        {'Name': 'Test Fort', 'Category': 'Historical', 'Latitude': 5.98, 'Longitude': 80.6,
+         'Description': 'Ramparts of a colonial fort overlooking the harbour.',
+         'Cost': 0, 'AvgVisitTimeHrs': 1.0, 'Popularity': 6, 'Crowded': 'Yes'},
+    ]})
+    catalog.apply_delta({'op': 'patch', 'id': 3, 'changes': {
+        'Description': 'Quiet lagoon with kayaking, mangroves and birdlife.', 'Latitude': 6.1, 'Cost': 1500,
+    }})
+    catalog.apply_delta({'op': 'delete', 'ids': [1, 7]})
+    return catalog
+
+
+def test_baseline_content_scores(catalog):
+    # Same scores as TfidfVectorizer fitted on the profile document plus all descriptions
+    data = catalog.data
+    for categories in CATEGORY_SETS:
+        profile = " ".join(data[data['Category'].isin(categories)]['Description'])
+        tfidf = TfidfVectorizer(stop_words='english').fit_transform([profile] + data['Description'].tolist())
+        expected = cosine_similarity(tfidf[0:1], tfidf[1:])[0]
+        np.testing.assert_allclose(catalog.content_scores(categories, model='tfidf'), expected, atol=1e-12)
+
+
+def test_deltas_match_rebuild(updated):
+    rebuilt = Catalog(updated.data.copy())
+    assert updated.version == 3
+    assert updated.changed_since(0) == {90, 91, 3, 1, 7}
+    for categories in CATEGORY_SETS:
+        np.testing.assert_allclose(
+            updated.content_scores(categories, model='tfidf'), rebuilt.content_scores(categories, model='tfidf'),
+            atol=1e-12
+        )
+    masks = np.array([updated.data['Category'].isin(c).values for c in CATEGORY_SETS])
+    np.testing.assert_allclose(
+        updated.profile_scores(masks, positions=[0, 5, 89], model='tfidf'),
+        rebuilt.profile_scores(masks, positions=[0, 5, 89], model='tfidf'), atol=1e-12
+    )
+    np.testing.assert_allclose(updated.distance_matrix, rebuilt.distance_matrix)
+
+
+def test_cluster_labels_follow_row_order(updated):
+    for crowded_preference in (None, True, False):
+        labels = updated.cluster_state(crowded_preference)['labels']
+        expected = updated.data.index[updated.data.index.isin(labels.index)]
+        assert labels.index.equals(expected)
+        assert 90 in labels.index or 91 in labels.index
+        assert not {1, 7} & set(labels.index)
+
+
+@pytest.mark.parametrize('delta', [
+    {'op': 'patch', 'id': 999, 'changes': {'Cost': 1}},
+    {'op': 'delete', 'ids': [2, 999]},
+    {'op': 'rename'},
+])
+def test_invalid_delta_leaves_catalog_unchanged(updated, delta):
+    data = updated.data.copy()
+    distances = updated.distance_matrix.copy()
+    scores = updated.content_scores(['Beach'], model='tfidf')
+    with pytest.raises((KeyError, ValueError)):
+        updated.apply_delta(delta)
+    assert updated.version == 3
+    assert updated.data.equals(data)
+    np.testing.assert_array_equal(updated.distance_matrix, distances)
+    np.testing.assert_array_equal(updated.content_scores(['Beach'], model='tfidf'), scores)
@@ -0,0 +1,57 @@
+"""Batched recommendation paths pick the same itineraries as hybrid_recommend."""
+import numpy as np
+import pandas as pd
+
+from hybrid_recommender import hybrid_recommend, hybrid_recommend_batch, hybrid_recommend_sweep
+from xai import selected_ids
+
+
+def sample_profiles(catalog, seed, count):
+    """(categories, time limit, budget, crowd preference, location, start hour) of random users"""
+    rng = np.random.default_rng(seed)
+    categories = sorted(catalog.data['Category'].unique())
+    return [
+        (
+            list(rng.choice(categories, int(rng.integers(1, 4)), replace=False)),
+            int(rng.integers(2, 10)),
+            int(rng.choice([500, 2000, 5000, 20000])),
+            [None, True, False][i % 3],
+            None if i % 4 == 0 else (float(rng.uniform(5.95, 6.15)), float(rng.uniform(80.1, 81.0))),
+            None if i % 2 == 0 else int(rng.integers(6, 18)),
+        )
+        for i in range(count)
+    ]
+
+
+def test_batch_matches_single_requests(catalog):
+    profiles = sample_profiles(catalog, seed=3, count=60)
+    batch = hybrid_recommend_batch(catalog, profiles)
+    for profile, recs in zip(profiles, batch):
+        categories, time_limit, budget, crowded_preference, location, hour = profile
+        expected = hybrid_recommend(
+            None, categories, time_limit, budget, crowded_preference, location, catalog=catalog,
+            departure_hour=hour
+        )
+        pd.testing.assert_frame_equal(recs, expected, obj=str(profile))
+
+
+def test_sweep_matches_single_requests(catalog):
+    time_limits = [2, 4, 6, 8, 12]
+    budgets = [500, 2000, 20000]
+    for profile in sample_profiles(catalog, seed=5, count=12):
+        categories, _, _, crowded_preference, location, hour = profile
+        frontier = hybrid_recommend_sweep(
+            catalog, categories, crowded_preference, time_limits, budgets, location, departure_hour=hour
+        )
+        for b, budget in enumerate(budgets):
+            for t, time_limit in enumerate(time_limits):
+                _, explanation_data = hybrid_recommend(
+                    None, categories, time_limit, budget, crowded_preference, location, catalog=catalog,
+                    return_explanation_data=True, departure_hour=hour
+                )
+                expected = selected_ids(explanation_data) if explanation_data else []
+                index = frontier['grid'][b, t]
+                got = frontier['itineraries'][index]['ids'] if index >= 0 else []
+                assert list(got) == list(expected), (profile, time_limit, budget)
+                if index >= 0:
+                    assert frontier['itineraries'][index]['hours'] <= time_limit + 1e-9
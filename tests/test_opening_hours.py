@@ -0,0 +1,87 @@
+"""Timed plans (with a start time) keep their time limit and opening hours."""
+import numpy as np
+import pytest
+
+from hybrid_recommender import hybrid_recommend
+from metrics import collect, counters
+from opening_hours import wait_hours
+from route_optimizer import route_order
+from travel_time import travel_hours
+from utils import haversine_vectorized
+
+
+def sample_requests(catalog, seed, count):
+    """(categories, time limit, start hour, location) of random requests"""
+    rng = np.random.default_rng(seed)
+    categories = sorted(catalog.data['Category'].unique())
+    return [
+        (
+            list(rng.choice(categories, 2, replace=False)),
+            int(rng.integers(2, 10)),
+            int(rng.integers(6, 18)),
+            (float(rng.uniform(5.95, 6.15)), float(rng.uniform(80.1, 81.0))),
+        )
+        for _ in range(count)
+    ]
+
+
+def timeline_problem(data, ids, location, departure_hour, time_limit):
+    """Why visiting ids in order breaks the opening hours or the time limit, or None"""
+    clock = float(departure_hour)
+    previous = location
+    for attraction_id in ids:
+        row = data.loc[attraction_id]
+        distance = haversine_vectorized(previous[0], previous[1], row['Latitude'], row['Longitude'])
+        clock += travel_hours(distance, previous[1], row['Longitude'], clock)
+        wait = wait_hours(clock, row['AvgVisitTimeHrs'], row['OpenHour'], row['CloseHour'])
+        if np.isnan(wait):
+            return f"{row['Name']} is closed on arrival at {clock:.2f}"
+        clock += wait + row['AvgVisitTimeHrs']
+        previous = (row['Latitude'], row['Longitude'])
+    if clock - departure_hour > time_limit + 1e-6:
+        return f"takes {clock - departure_hour:.2f} h of {time_limit} h"
+    return None
+
+
+def fallbacks():
+    return sum(counters().get('route_fallback', {}).values())
+
+
+@pytest.mark.parametrize('timed', [False, True])
+def test_greedy_itineraries_get_solved_routes(catalog, timed):
+    # The route solver counts travel, waits and visits like the greedy, so whatever
+    # the greedy picks within the time limit can be routed without a fallback order
+    before = fallbacks()
+    routed = 0
+    for categories, time_limit, hour, location in sample_requests(catalog, seed=0, count=20):
+        departure_hour = hour if timed else None
+        recs = hybrid_recommend(
+            catalog.data, categories, time_limit, 10000, None, location,
+            catalog=catalog, departure_hour=departure_hour
+        )
+        if recs.empty:
+            continue
+        with collect() as spans:
+            order = route_order(recs, time_limit, start_location=location, departure_hour=departure_hour)
+        assert sorted(order) == list(range(len(recs)))
+        solves = [s for s in spans if s['span'] == 'route.solve']
+        assert solves and all(s['attrs']['objective'] is not None for s in solves), (categories, hour)
+        routed += 1
+    assert routed
+    assert fallbacks() == before
+
+
+@pytest.mark.parametrize('selection', ['dp', 'cpsat'])
+def test_exact_selection_keeps_opening_hours(catalog, selection):
+    checked = 0
+    for categories, time_limit, hour, location in sample_requests(catalog, seed=3, count=12):
+        recs, explanation_data = hybrid_recommend(
+            catalog.data, categories, time_limit, 10000, None, location, return_explanation_data=True,
+            catalog=catalog, selection=selection, departure_hour=hour
+        )
+        if recs.empty:
+            continue
+        ids = [step['attraction_id'] for step in explanation_data['selection_steps']]
+        assert timeline_problem(catalog.data, ids, location, hour, time_limit) is None, (categories, hour)
+        checked += 1
+    assert checked
@@ -0,0 +1,59 @@
+"""Both result cache tiers keep to their byte caps and evict the least recently used results."""
+import pickle
+import sqlite3
+
+from result_cache import SHARED_EVICT_TO, ResultCache, canonical_request
+
+
+def value(label):
+    return {'label': label, 'payload': 'x' * 1000}
+
+
+SIZE = len(pickle.dumps(value('a'), protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResultCache(max_bytes=3 * SIZE, shared_path=None)
+    for key in 'abc':
+        cache.put(key, value(key))
+    assert cache.get('a') == value('a')  # a is now more recent than b
+    cache.put('d', value('d'))
+    assert cache.get('b') is None
+    assert [cache.get(key)['label'] for key in 'acd'] == ['a', 'c', 'd']
+    assert cache.bytes == 3 * SIZE
+    assert cache.stats['evictions'] == 1
+
+
+def test_shared_tier_evicts_down_from_its_cap(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    # A process tier too small for any result: every get goes to SQLite
+    cache = ResultCache(max_bytes=1, shared_path=path, shared_max_bytes=5 * SIZE)
+    for key in 'abcde':
+        cache.put(key, value(key))
+    assert cache.get('a') == value('a')  # a is now more recent than b
+    cache.put('f', value('f'))
+
+    db = sqlite3.connect(path)
+    kept = {key for (key,) in db.execute('SELECT key FROM results')}
+    (total,) = db.execute('SELECT bytes FROM results_size').fetchone()
+    (actual,) = db.execute('SELECT SUM(size) FROM results').fetchone()
+    db.close()
+    assert total == actual <= 5 * SIZE * SHARED_EVICT_TO
+    assert 'b' not in kept and {'a', 'f'} <= kept
+    # Another process's cache sees the same rows
+    other = ResultCache(max_bytes=1, shared_path=path, shared_max_bytes=5 * SIZE)
+    assert other.get('f') == value('f') and other.get('b') is None
+    assert other.stats['shared_hits'] == 1
+
+
+def test_jittered_requests_share_a_key(catalog):
+    request = {
+        'selected_categories': ['Beach', 'Nature'], 'time_limit': 4.2, 'budget': 5300,
+        'crowded_preference': None, 'user_location': (6.03011, 80.21702), 'selection': 'greedy',
+        'departure_hour': None,
+    }
+    jittered = dict(request, selected_categories=['Nature', 'Beach'], user_location=(6.03024, 80.21691))
+    cache = ResultCache(shared_path=None)
+    assert cache.key(catalog, canonical_request(request)) == cache.key(catalog, canonical_request(jittered))
+    assert canonical_request(request)['time_limit'] <= request['time_limit']
+    assert canonical_request(request)['budget'] <= request['budget']
@@ -0,0 +1,76 @@
+"""The HTTP service answers bad requests with 400 and rejects work with 503 when saturated."""
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import service as service_module
+from service import PlannerServer, PlannerService
+
+
+@pytest.fixture(scope='module')
+def server(catalog):
+    # Forked workers inherit the loaded catalog instead of loading their own
+    service_module._CATALOG = catalog
+    service = PlannerService(1, 4, result_cache=False)
+    server = PlannerServer(('127.0.0.1', 0), catalog, service, request_timeout=60)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    service.shutdown()
+
+
+def post(server, endpoint, body):
+    """(status, headers, JSON payload) of a POST to the service"""
+    url = f'http://127.0.0.1:{server.server_address[1]}/{endpoint}'
+    data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data, method='POST')) as response:
+            return response.status, response.headers, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, json.load(e)
+
+
+STOP = {'Name': 'A', 'Latitude': 6.03, 'Longitude': 80.21, 'Cost': 0, 'AvgVisitTimeHrs': 1, 'Popularity': 5}
+
+
+REQUEST = {'categories': ['Beach'], 'time_limit': 4, 'budget': 5000}
+
+
+@pytest.mark.parametrize('endpoint, body, error', [
+    ('recommend', b'{not json', "Invalid JSON"),
+    ('recommend', b'[1, 2]', "JSON object"),
+    ('recommend', {'categories': ['Beach'], 'time_limit': 4}, "Missing budget"),
+    ('recommend', dict(REQUEST, time_limit='long'), "time_limit must be a number"),
+    ('recommend', dict(REQUEST, crowded='maybe'), "Invalid crowded preference"),
+    # Raised in the worker process
+    ('optimize', {'stops': [dict(STOP, Cost='free'), STOP]}, "stop Cost must be a number"),
+    ('optimize', {'stops': [dict(STOP, Latitude=None), STOP]}, "must be a number, got None"),
+])
+def test_invalid_requests_get_400(server, endpoint, body, error):
+    errors = server.service.stats['errors']
+    status, _, payload = post(server, endpoint, body)
+    assert status == 400, payload
+    assert error in payload['error']
+    # Client mistakes are not counted as service errors
+    assert server.service.stats['errors'] == errors
+
+
+def test_valid_request_gets_its_own_id(server):
+    status, _, payload = post(server, 'optimize', {'id': 'r1', 'stops': [STOP, dict(STOP, Latitude=6.1)]})
+    assert status == 200, payload
+    assert payload['id'] == 'r1'
+    assert len(payload['stops']) == 2
+
+
+def test_saturated_service_answers_503(server, monkeypatch):
+    monkeypatch.setattr(server.service, 'max_pending', 0)
+    rejected = server.service.stats['rejected']
+    status, headers, payload = post(server, 'recommend', REQUEST)
+    assert status == 503, payload
+    assert headers['Retry-After'] == '1'
+    assert server.service.stats['rejected'] == rejected + 1